@@ -6,8 +6,11 @@ import time
 import threading
 import argparse
 import json
+import logging
 
-from src import ui_utils, story_manager, game, model_manager
+# (Only imports the standard library. The rest of 'src' is imported once
+# the arguments are parsed, so '--help' doesn't wait for it)
+from src import model_manager
 
 # Initial Setup #
 
@@ -19,6 +22,15 @@ DATA_PATH = "game_data"
 TRANSCRIPT_PATH = os.path.join(DATA_PATH, "transcripts")
 SAVESPATH = os.path.join(DATA_PATH, "saves")
 STORY_JSON = os.path.join(DATA_PATH, "storyDatabase.json")
+# Pre-sampled first AI responses. (See 'src/opening_cache.py')
+OPENINGS_JSON = os.path.join(DATA_PATH, "openings.json")
+# Number of saves shown at once in the load menu.
+SAVES_PER_PAGE = 10
+LOG_PATH = os.path.join(DATA_PATH, "play_game.log")
+METRICS_PATH = os.path.join(DATA_PATH, "metrics.jsonl")
+
+# When the game was started. (Used to log the time to the first prompt)
+START_TIME = time.perf_counter()
 
 # Argument parser
 parser = argparse.ArgumentParser("Play NotAnother AIDungeon")
@@ -33,11 +45,76 @@ parser.add_argument("--update-model",
                     dest="update_model",
                     action="store_true",
                     help="Updates the GPT2 model if it's not up-to-date.")
+parser.add_argument("--candidates",
+                    dest="num_candidates",
+                    type=int,
+                    help="Number of AI responses generated at once. "
+                    "The extras are used by '/retry'. (Default is 3)")
+parser.add_argument("--speculate",
+                    action="store_true",
+                    help="Generate the likely next AI response while "
+                    "you are typing.")
+parser.add_argument("--token-budget",
+                    dest="token_budget",
+                    type=int,
+                    help="Max number of tokens sent to the AI each turn. "
+                    "(Lower is faster, but the AI remembers less)")
+parser.add_argument("--backend",
+                    choices=list(model_manager.BACKENDS.keys()),
+                    help="What runs the AI model. 'numpy' doesn't need "
+                    "TensorFlow. (Default is 'tensorflow')")
+parser.add_argument("--disable-streaming",
+                    dest="enable_streaming",
+                    action="store_false",
+                    help="Show the AI text once it's done, instead of while "
+                    "it's generated.")
+parser.add_argument("--save-cache",
+                    dest="save_cache",
+                    action="store_true",
+                    help="Save the AI's attention cache with the game. "
+                    "(It makes the first turn after loading a save faster, "
+                    "but it can be tens of MB for each save)")
+parser.add_argument("--metrics-log",
+                    dest="metrics_log",
+                    nargs="?",
+                    const=METRICS_PATH,
+                    help="Add each turn's timings to a file as a line of "
+                    "JSON. (The file is '{}' if it isn't given. Off by "
+                    "default)".format(METRICS_PATH))
+parser.add_argument("--metrics-port",
+                    dest="metrics_port",
+                    type=int,
+                    help="Serve the turn timings for Prometheus at "
+                    "'http://127.0.0.1:PORT/metrics'.")
+parser.add_argument("--profile-startup",
+                    dest="profile_startup",
+                    action="store_true",
+                    help="Print how long it took to get to the menu, and "
+                    "how long each import took, then quit.")
 parser.set_defaults(gpu=False)
 parser.set_defaults(enable_slow_print=True)
+parser.set_defaults(enable_streaming=True)
+parser.set_defaults(save_cache=False)
 parser.set_defaults(update_model=False)
+parser.set_defaults(num_candidates=3)
+parser.set_defaults(speculate=False)
+parser.set_defaults(token_budget=None)
+parser.set_defaults(backend="tensorflow")
+parser.set_defaults(metrics_log=None)
+parser.set_defaults(metrics_port=None)
+parser.set_defaults(profile_startup=False)
 args = parser.parse_args()
 
+# Times the imports below. (See '--profile-startup')
+import_profiler = None
+if args.profile_startup:
+    from src import startup_profiler
+    import_profiler = startup_profiler.ImportProfiler()
+    import_profiler.start()
+
+from src import ui_utils, story_manager, game, turn_metrics
+from src import save_catalog
+
 
 # Use textwrap to prevent text from becoming too long.
 def wrap_text(string: str, terminal_width: int):
@@ -89,49 +166,88 @@ def get_json(json_path):
         return json.load(f)
 
 
-# get game saves. (List of saves and some info from them)
-def get_game_saves(saves_path):
-    saves = [
-        x for x in os.listdir(saves_path) if x.split(".")[-1].lower() == "json"
-    ]
-    if len(saves) == 0:
-        return False
-
-    saves_info = []
-    for save in saves:
-        save_info = {}
-        save_location = os.path.join(saves_path, save)
-        save_data = get_json(save_location)
-
-        save_info['filePath'] = save_location
-        save_info['fileName'] = save.split(".json")[0]
-        save_info['genre'] = save_data['genre']
-        save_info['class'] = save_data['class']
-        save_info['player'] = save_data['player']
-
-        saves_info.append(save_info)
-    return saves_info
+# get game saves. (A page of saves, newest first, with some info from
+# them, and the total number of saves)
+def get_game_saves(saves_path, page: int = 0):
+    return save_catalog.listSaves(saves_path, page * SAVES_PER_PAGE,
+                                  SAVES_PER_PAGE)
 
 
 # Thinking Indicator #
 
 # We'll use this to stop the thinking_indicator thread.
-thinking_indicator_is_running = False
+# (An event, so it stops right away when the AI text starts showing)
+thinking_indicator_stop = threading.Event()
 
 
 # This will be used in a thread for showing if the AI is thinking.
 def thinking_indicator():
-    global thinking_indicator_is_running
     thinking = ['|', '/', '-', '\\']
     string_length = len("\rThe AI is thinking {}".format(thinking[0]))
-    while thinking_indicator_is_running:
-        for think in thinking:
-            print("\rThe AI is thinking {}".format(think), end="")
-            time.sleep(0.25)
+    i = 0
+    while not thinking_indicator_stop.is_set():
+        print("\rThe AI is thinking {}".format(thinking[i % len(thinking)]),
+              end="",
+              flush=True)
+        i += 1
+        thinking_indicator_stop.wait(0.25)
     # Clears the text
     print("\r{}".format(" " * string_length), end="\r")
 
 
+# Stops the thinking_indicator thread. (Can be called more than once)
+def stop_thinking_indicator(thinking_thread: threading.Thread):
+    thinking_indicator_stop.set()
+    # Wait for thinking_indicator to stop
+    thinking_thread.join()
+
+
+# Prints where the time to the menu went. (See '--profile-startup')
+def print_startup_profile():
+    import_profiler.stop()
+    print("Time to menu: {:.2f}s".format(time.perf_counter() - START_TIME))
+    print("Imports: {:.2f}s".format(import_profiler.totalSeconds()))
+    print(import_profiler.report())
+
+
+# Model Loading #
+
+# Set once the model load time has been logged.
+model_load_logged = False
+
+
+# Shows what the model is doing while it loads, and blocks until it's done.
+def wait_for_model(model_manager: model_manager.ModelManager):
+    global model_load_logged
+    wait_start = time.perf_counter()
+    if not model_manager.loadedEvent.is_set():
+        spinner = ['|', '/', '-', '\\']
+        string_length = 0
+        i = 0
+        while not model_manager.loadedEvent.wait(0.25):
+            message = "\rLoading the AI model ({}) {}".format(
+                model_manager.loadStage, spinner[i % len(spinner)])
+            string_length = max(string_length, len(message))
+            print(message.ljust(string_length), end="")
+            i += 1
+        # Clears the text
+        print("\r{}".format(" " * string_length), end="\r")
+
+    try:
+        model_manager.waitUntilLoaded()
+    except RuntimeError:
+        logging.exception("Failed to load the model")
+        print("Failed to load the AI model! (See {}) exiting...".format(
+            LOG_PATH))
+        sys.exit(1)
+
+    if not model_load_logged:
+        logging.info("Model loaded in %.2fs (waited %.2fs for it)",
+                     model_manager.loadTime,
+                     time.perf_counter() - wait_start)
+        model_load_logged = True
+
+
 # Title Screen #
 
 
@@ -156,6 +272,12 @@ def title_screen_options(game: game.Game):
 
 
 def title_screen(game: game.Game):
+    logging.info("Time to title screen: %.2fs",
+                 time.perf_counter() - START_TIME)
+    if args.profile_startup:
+        print_startup_profile()
+        sys.exit()
+
     # Clears the terminal of prior code for a properly formatted title screen.
     clear_screen()
     time.sleep(0.75)  # Add a pause to make the intro less jarring.
@@ -166,6 +288,13 @@ def title_screen(game: game.Game):
     print("    Play    ")
     print("    Help    ")
     print("    Quit    ")
+    print("")
+    if game.modelManager.isLoaded():
+        print("(AI model is ready)")
+    elif game.modelManager.loadError is not None:
+        print("(AI model failed to load)")
+    else:
+        print("(AI model is loading in the background...)")
     title_screen_options(game)
 
 
@@ -192,31 +321,49 @@ def setup_game(game: game.Game):
 
     if load_save in ("yes", "y"):
         # Display save options
-        saves = get_game_saves(SAVESPATH)
-        if saves == False:
+        page = 0
+        saves, num_saves = get_game_saves(SAVESPATH, page)
+        if num_saves == 0:
             print("There are no saves! exiting...")
             sys.exit(1)
-        save_options = {}
-        slow_print(args.enable_slow_print, "Select a save by number", 25, 50,
-                   True)
-        for i in range(len(saves)):
-            save = saves[i]
-
-            message = "{}: ".format(i + 1)
-            message += "File: {} ".format(save['fileName'])
-            message += "Genre: {} ".format(save['genre'])
-            message += "Class: {} ".format(save['class'])
-            message += "Player Name: {}\n".format(save['player'])
-
-            slow_print(args.enable_slow_print, message, 25, 50, False)
-
-            save_options[str(i + 1)] = save['filePath']
-
-        user_option = input("> ").strip()
-
-        while user_option not in save_options.keys():
-            print("Invalid option please try again.")
-            user_option = input("> ").strip()
+        num_pages = (num_saves + SAVES_PER_PAGE - 1) // SAVES_PER_PAGE
+
+        while True:
+            save_options = {}
+            slow_print(args.enable_slow_print, "Select a save by number", 25,
+                       50, True)
+            for i in range(len(saves)):
+                save = saves[i]
+                number = page * SAVES_PER_PAGE + i + 1
+
+                message = "{}: ".format(number)
+                message += "File: {} ".format(save['fileName'])
+                message += "Genre: {} ".format(save['genre'])
+                message += "Class: {} ".format(save['class'])
+                message += "Player Name: {} ".format(save['player'])
+                message += "Turns: {}\n".format(save['turns'])
+
+                slow_print(args.enable_slow_print, message, 25, 50, False)
+
+                save_options[str(number)] = save['filePath']
+
+            if num_pages > 1:
+                print("Page {} of {}. (n)ext or (p)revious page".format(
+                    page + 1, num_pages))
+
+            user_option = input("> ").strip().lower()
+            while user_option not in save_options.keys() and (
+                    num_pages == 1 or user_option not in ("n", "p")):
+                print("Invalid option please try again.")
+                user_option = input("> ").strip().lower()
+
+            if user_option in save_options.keys():
+                break
+            if user_option == "n":
+                page = (page + 1) % num_pages
+            else:
+                page = (page - 1) % num_pages
+            saves, num_saves = get_game_saves(SAVESPATH, page)
 
         # Once selected get the save filePath and load it via StoryManager.
         save_path = save_options[user_option]
@@ -298,13 +445,26 @@ def setup_game(game: game.Game):
 
             game.startGame(genre_setting, player_name, class_setting)
 
+    first_prompt = True
+    # Set when game.currentText was already shown while it was generated.
+    text_shown = False
     while game.keepGoing:
         terminal_width = 80
         if os.get_terminal_size()[0] < 90:
             terminal_width = os.get_terminal_size()[0] - 10
 
-        message = wrap_text(game.currentText, terminal_width)
-        slow_print(args.enable_slow_print, message, 50, 75, True)
+        if not text_shown:
+            message = wrap_text(game.currentText, terminal_width)
+            slow_print(args.enable_slow_print, message, 50, 75, True)
+
+        # Let the AI get a head start while the player is typing.
+        if game.modelManager.isLoaded():
+            game.speculate()
+
+        if first_prompt:
+            logging.info("Time to first prompt: %.2fs",
+                         time.perf_counter() - START_TIME)
+            first_prompt = False
 
         user_input = input("> ").strip()
 
@@ -320,25 +480,70 @@ def setup_game(game: game.Game):
                 # print the new text in it's place.
                 print("> " + new_input)
 
-        global thinking_indicator_is_running
-        thinking_indicator_is_running = True
+        # Only blocks if the model is still loading.
+        wait_for_model(game.modelManager)
+
+        thinking_indicator_stop.clear()
         thinking_thread = threading.Thread(target=thinking_indicator)
 
         # Start thinking indicator
         thinking_thread.start()
 
-        game.gameCommand(user_input)
-
-        # Stop thinking indicator
-        thinking_indicator_is_running = False
-        # Wait for thinking_indicator to stop
-        thinking_thread.join()
+        # Show the AI text as it's generated. (The thinking indicator
+        # stops once the first of it comes)
+        printer = None
+        on_text = None
+        if args.enable_streaming:
+            printer = ui_utils.StreamPrinter(
+                terminal_width,
+                onFirstText=lambda: stop_thinking_indicator(thinking_thread))
+            on_text = printer.write
+        try:
+            game.gameCommand(user_input, on_text)
+        finally:
+            # Stop thinking indicator
+            stop_thinking_indicator(thinking_thread)
+            if printer is not None:
+                printer.finish()
+        text_shown = printer is not None and printer.printed
+
+    if game.speculator is not None:
+        hit_rate = game.speculator.hitRate()
+        if hit_rate is not None:
+            print("Speculation hit rate: {:.0%} ({}/{})".format(
+                hit_rate, game.speculator.hits,
+                game.speculator.hits + game.speculator.misses))
 
 
 if __name__ == "__main__":
+    logging.basicConfig(filename=LOG_PATH,
+                        level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    # The model loads while the player goes through the menus.
     model_manager = model_manager.ModelManager(MODEL_DIR,
                                                MODEL_NAME,
-                                               allowGpu=args.gpu)
-    game = game.Game(model_manager, TRANSCRIPT_PATH, SAVESPATH, STORY_JSON)
+                                               allowGpu=args.gpu,
+                                               loadModel=False,
+                                               backend=args.backend)
+    model_manager.loadModelInBackground()
+
+    # (An empty '--metrics-log=' is the same as leaving it out)
+    metrics = turn_metrics.TurnMetrics(args.metrics_log or None)
+    if args.metrics_port is not None:
+        metrics.startServer(args.metrics_port)
+        logging.info("Serving metrics on port %d", args.metrics_port)
+
+    game = game.Game(model_manager,
+                     TRANSCRIPT_PATH,
+                     SAVESPATH,
+                     STORY_JSON,
+                     numCandidates=args.num_candidates,
+                     speculate=args.speculate,
+                     tokenBudget=args.token_budget,
+                     metrics=metrics,
+                     openingsPath=OPENINGS_JSON,
+                     saveAttentionCache=args.save_cache)
 
     title_screen(game)
+    metrics.close()
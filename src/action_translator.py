@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# Turns the player's input into the action text that goes in the story.
+# ("I open the door" -> "You open the door.")
+#
+# Stuff for translating first person to second person
+# Pulled from...
+# https://github.com/Latitude-Archives/AIDungeon/blob/develop/story/utils.py
+#
+# Each mapping is replaced in order, with a few variations of it, like
+# the original did with one regex for each. So the later mappings only
+# see what the earlier ones left. ("I was" -> "you was", since "I" is
+# replaced before "I was" is tried)
+#
+# The replacements are made into one table when this is imported, and
+# the quotes are found once. (The regexes checked the rest of the string
+# for quotes at every match, so long inputs took a long time) The text
+# outside of them is scanned once for the mapped words, and a word by
+# itself is looked up in a dict. Only words right next to each other are
+# settled in the table's order, the same way replacing each variation in
+# turn would. (See 'replaceFirstPerson')
+import functools
+import re
+
+FIRST_TO_SECOND_MAPPINGS = [
+    ("I'm", "you're"),
+    ("Im", "you're"),
+    ("Ive", "you've"),
+    ("I am", "you are"),
+    ("was I", "were you"),
+    ("am I", "are you"),
+    ("wasn't I", "weren't you"),
+    ("I", "you"),
+    ("I'd", "you'd"),
+    ("i", "you"),
+    ("I've", "you've"),
+    ("was I", "were you"),
+    ("am I", "are you"),
+    ("wasn't I", "weren't you"),
+    ("I", "you"),
+    ("I'd", "you'd"),
+    ("i", "you"),
+    ("I've", "you've"),
+    ("I was", "you were"),
+    ("my", "your"),
+    ("we", "you"),
+    ("we're", "you're"),
+    ("mine", "yours"),
+    ("me", "you"),
+    ("us", "you"),
+    ("our", "your"),
+    ("I'll", "you'll"),
+    ("myself", "yourself"),
+]
+
+FIRST_LETTERS_REGEX = re.compile(r"((?<=[\.\?!]\s)(\w+)|(^\w+))")
+
+
+# Simply capitalize the first letter in a word.
+def capitalize(word):
+    return word[0].upper() + word[1:]
+
+
+# Generates variations of a mapping in FIRST_TO_SECOND_MAPPINGS
+def mappingVariationPairs(mapping: tuple):
+    mappingList = []
+    mappingList.append((" " + mapping[0] + " ", " " + mapping[1] + " "))
+    mappingList.append((" " + capitalize(mapping[0]) + " ",
+                        " " + capitalize(mapping[1]) + " "))
+
+    # Change you before punctuation
+    # (These used to be regexes, that left a '\' in front of the '?' and
+    # '!' they added)
+    if mapping[0] == "you":
+        mapping = ("you", "me")
+    mappingList.append((" " + mapping[0] + ",", " " + mapping[1] + ","))
+    mappingList.append((" " + mapping[0] + "?", " " + mapping[1] + "?"))
+    mappingList.append((" " + mapping[0] + "!", " " + mapping[1] + "!"))
+    mappingList.append((" " + mapping[0] + ".", " " + mapping[1] + "."))
+
+    return mappingList
+
+
+# (text, replacement) pairs, in the order they're replaced.
+TRANSLATION_TABLE = [
+    variation for mapping in FIRST_TO_SECOND_MAPPINGS
+    for variation in mappingVariationPairs(mapping)
+]
+
+# The table by what is replaced. (words, character after them) ->
+# [(place in the table, replacement words), ...]
+# (Every variation is " " + words + one of " ,?!.")
+TRANSLATIONS = {}
+for order, (currentWord, replWord) in enumerate(TRANSLATION_TABLE):
+    TRANSLATIONS.setdefault((currentWord[1:-1], currentWord[-1]), []).append(
+        (order, replWord[1:-1]))
+# The replacement a word gets if there are no other mapped words next to
+# it. (The first one in the table)
+FIRST_TRANSLATIONS = {x: y[0][1] for x, y in TRANSLATIONS.items()}
+
+# Finds runs of mapped words with one space between each (a word can only
+# change how the words next to it are replaced), and the character after
+# them. (With a space before them, and a space or punctuation after them)
+MAPPED_WORDS = set(x for words, _ in TRANSLATIONS for x in words.split(" "))
+MAPPED_WORD = "(?:" + "|".join(
+    re.escape(x) for x in sorted(MAPPED_WORDS, key=len, reverse=True)) + ")"
+MAPPED_WORDS_REGEX = re.compile(r"(?<= )(" + MAPPED_WORD + "(?: " +
+                                MAPPED_WORD + r")*)(?=([ ,?!.]))")
+
+
+# Replaces first person words with second person ones, but only outside
+# of quotations.
+#
+# (Like the original, text is in quotes if there's an odd number of '"'
+# after it)
+def translateToSecondPerson(text: str):
+    parts = text.split('"')
+    # The parts outside of quotes are joined with '"' (which isn't in any
+    # of the replacements), so they can all be replaced at once.
+    outside = '"'.join(parts[-1::-2])
+    parts[-1::-2] = replaceFirstPerson(outside).split('"')
+
+    return '"'.join(parts)
+
+
+# Same as doing 'text.replace(currentWord, replWord)' for each pair in
+# TRANSLATION_TABLE, in order.
+#
+# That can be worked out from where the mapped words are in 'text'...
+# - A replacement keeps the space before it and the character after it,
+#   and never makes a mapped word, so a variation can only match the
+#   words as they are in 'text', and only if none of them were replaced.
+# - Each str.replace only replaces matches that don't overlap, going left
+#   to right. (" I I " -> " you I ", since the space between them is in
+#   the first match. The table has "I" twice, so the next one gets it)
+# So a word by itself gets its first replacement in the table, and runs
+# of words next to each other are settled by 'translateWords'.
+def replaceFirstPerson(text: str):
+    return MAPPED_WORDS_REGEX.sub(replaceWords, text)
+
+
+# (Called by MAPPED_WORDS_REGEX.sub for each run of mapped words)
+def replaceWords(match):
+    words, after = match.group(1, 2)
+    if " " not in words:
+        return FIRST_TRANSLATIONS.get((words, after), words)
+    return translateWords(words, after)
+
+
+# Replaces a run of mapped words (which have 'after' after them) the way
+# the table would, going through each variation in order.
+@functools.lru_cache(maxsize=256)
+def translateWords(words: str, after: str):
+    words = words.split(" ")
+    afters = [" "] * (len(words) - 1) + [after]
+
+    # Every match of a variation, as (place in the table, first word,
+    # number of words, replacement).
+    matches = []
+    for i, word in enumerate(words):
+        for order, replWord in TRANSLATIONS.get((word, afters[i]), ()):
+            matches.append((order, i, 1, replWord))
+        if i + 1 < len(words):
+            key = (word + " " + words[i + 1], afters[i + 1])
+            for order, replWord in TRANSLATIONS.get(key, ()):
+                matches.append((order, i, 2, replWord))
+    matches.sort()
+
+    replaced = [False] * len(words)
+    lastOrder = None
+    for order, i, numWords, replWord in matches:
+        if order != lastOrder:
+            lastOrder = order
+            # The first word the next match of this str.replace can start
+            # at. (A match takes the space after its words, which is the
+            # space before the next word)
+            nextWord = 0
+        if i < nextWord or any(replaced[i:i + numWords]):
+            continue
+
+        words[i:i + numWords] = [replWord] + [None] * (numWords - 1)
+        replaced[i:i + numWords] = [True] * numWords
+        nextWord = i + numWords + 1
+
+    return " ".join(x for x in words if x is not None)
+
+
+# Capitalizing the first word in every sentence.
+def capitalizeFirstLetters(text: str):
+    def cap(match):
+        return capitalize(match.group())
+
+    return FIRST_LETTERS_REGEX.sub(cap, text)
+
+
+# (The game calls this for the same input to show it, and then to run it)
+@functools.lru_cache(maxsize=32)
+def prepareAction(actionText: str):
+    # Lets first remove any whitespace
+    actionText = actionText.strip()
+
+    # Check if the input is dialogue
+    if actionText[0] == '"':
+        actionText = "You say, " + actionText
+    else:
+        # If not add 'You' if needed.
+        if "you" not in actionText[:6].lower() and "I" not in actionText[:6]:
+            actionText = actionText[0].lower() + actionText[1:]
+            actionText = "You " + actionText
+
+        # Make sure we add punctuation
+        if actionText[-1] not in [".", "?", "!"]:
+            actionText = actionText + "."
+
+    # Translate first person text into second person text.
+    actionText = " " + actionText
+    actionText = translateToSecondPerson(actionText)
+
+    actionText = actionText.strip()
+    actionText = capitalizeFirstLetters(actionText)
+
+    return actionText
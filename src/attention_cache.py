@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Attention cache files, saved next to a story.
+#
+# ModelManager keeps the attention cache of the last context it ran, so
+# the next turn only feeds the tokens that changed. A loaded save starts
+# without one, so its first turn would feed the whole seed. Game writes
+# the cache to '<storyFile>.kv' when it quits, and gives it back to the
+# ModelManager when the save is loaded.
+#
+# The file starts with two header lines...
+# RPG-KV 1
+# {"modelId": "...", "numTokens": 812, "tokensHash": "...",
+#  "shape": [1, 12, 2, 12, 812, 64], "dtype": "float16",
+#  "byteorder": "little"}
+# followed by the tokens (int32), and then the cache in the order of
+# 'shape'. It's stored as float16 to halve the size. (The model uses
+# float32, so it's converted back when it's read)
+#
+# The file is only used if it was made by the same model (see
+# ModelManager.modelId) and it's all there. The tokens don't have to
+# match the story. The ModelManager only reuses the part of the cache
+# that is the start of the next context, so an old file is only slower,
+# never wrong.
+import hashlib
+import json
+import sys
+from array import array
+
+MAGIC = b"RPG-KV"
+CACHE_VERSION = 1
+DTYPE = "float16"
+
+
+def cachePath(storyFile: str):
+    return storyFile + ".kv"
+
+
+def tokensHash(tokenBytes: bytes):
+    return hashlib.sha1(tokenBytes).hexdigest()
+
+
+# Makes the file for 'past', the attention cache of 'tokens'.
+def encodeCache(modelId: str, tokens: list, past):
+    tokenBytes = array('i', tokens).tobytes()
+    header = {
+        'modelId': modelId,
+        'numTokens': len(tokens),
+        'tokensHash': tokensHash(tokenBytes),
+        'shape': list(past.shape),
+        'dtype': DTYPE,
+        'byteorder': sys.byteorder,
+    }
+
+    return b"".join([
+        "{} {}\n".format(MAGIC.decode(), CACHE_VERSION).encode("utf-8"),
+        json.dumps(header).encode("utf-8") + b"\n",
+        tokenBytes,
+        past.astype(DTYPE).tobytes(),
+    ])
+
+
+# Returns (tokens, past) from a file's contents. (None if the file isn't
+# from the model 'modelId', or it's damaged)
+def decodeCache(data: bytes, modelId: str):
+    # (Imported here, so loading the module doesn't import NumPy)
+    import numpy as np
+
+    if not data.startswith(MAGIC + b" "):
+        return None
+    try:
+        magic, headerLine, data = data.split(b"\n", 2)
+        version = int(magic.split(b" ")[1])
+        header = json.loads(headerLine.decode("utf-8"))
+        numTokens = int(header['numTokens'])
+        shape = [int(x) for x in header['shape']]
+    except (ValueError, IndexError, KeyError, TypeError):
+        return None
+    if version != CACHE_VERSION or header.get('modelId') != modelId:
+        return None
+    if (header.get('dtype') != DTYPE
+            or header.get('byteorder') != sys.byteorder):
+        return None
+
+    tokenBytes = data[:numTokens * array('i').itemsize]
+    if tokensHash(tokenBytes) != header.get('tokensHash'):
+        return None
+
+    count = 1
+    for size in shape:
+        count *= size
+    pastBytes = data[len(tokenBytes):]
+    if len(pastBytes) != count * np.dtype(DTYPE).itemsize:
+        return None
+
+    tokens = array('i')
+    tokens.frombytes(tokenBytes)
+    past = np.frombuffer(pastBytes, dtype=DTYPE).reshape(shape)
+    return tokens.tolist(), past.astype(np.float32)
+
+
+def readCache(filePath: str, modelId: str):
+    try:
+        with open(filePath, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return decodeCache(data, modelId)
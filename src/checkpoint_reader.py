@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# Reads the tensors of a TensorFlow (V2) checkpoint without TensorFlow.
+#
+# A checkpoint 'model-1' is made of...
+# - 'model-1.index': A (leveldb) table that maps each tensor name to
+#   where it is in the data files. (The "" key is the bundle header)
+# - 'model-1.data-00000-of-00001': The raw bytes of the tensors.
+#
+# Only uncompressed tables are supported, which is what TensorFlow writes.
+import os
+import struct
+
+import numpy as np
+
+# Table footer: 2 block handles padded to 40 bytes, and the magic number.
+FOOTER_SIZE = 48
+TABLE_MAGIC = 0xdb4775248b80fb57
+
+# TensorFlow DataType enum -> numpy dtype
+DTYPES = {
+    1: np.float32,
+    2: np.float64,
+    3: np.int32,
+    4: np.uint8,
+    5: np.int16,
+    6: np.int8,
+    9: np.int64,
+    10: np.bool_,
+    17: np.uint16,
+    19: np.float16,
+}
+
+
+class CheckpointReader:
+    # 'prefix' is the checkpoint path without the extension. ('model-1')
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+        with open(prefix + ".index", "rb") as f:
+            entries = readTable(f.read())
+
+        header = parseProto(entries.pop(b"", b""))
+        self.numShards = header.get(1, [1])[0]
+        if header.get(2, [0])[0] != 0:
+            raise ValueError("Only little endian checkpoints are supported")
+
+        # name -> dict with 'dtype', 'shape', 'shard', 'offset', and 'size'
+        self.entries = {}
+        for key, value in entries.items():
+            self.entries[key.decode("utf-8")] = parseEntry(value)
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def getShape(self, name: str):
+        return self.entries[name]['shape']
+
+    def getTensor(self, name: str):
+        entry = self.entries[name]
+        if entry['dtype'] not in DTYPES:
+            raise ValueError("Unsupported dtype {} for '{}'".format(
+                entry['dtype'], name))
+
+        dataPath = "{}.data-{:05d}-of-{:05d}".format(self.prefix,
+                                                     entry['shard'],
+                                                     self.numShards)
+        with open(dataPath, "rb") as f:
+            f.seek(entry['offset'])
+            data = f.read(entry['size'])
+
+        dtype = np.dtype(DTYPES[entry['dtype']]).newbyteorder('<')
+        return np.frombuffer(data, dtype=dtype).reshape(entry['shape'])
+
+
+# Same as 'tf.train.latest_checkpoint'. Reads the 'checkpoint' file in
+# 'directory' and returns the checkpoint prefix. (None if there isn't one)
+def latestCheckpoint(directory: str):
+    checkpointFile = os.path.join(directory, "checkpoint")
+    if not os.path.isfile(checkpointFile):
+        return None
+
+    with open(checkpointFile, "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key.strip() == "model_checkpoint_path":
+                path = value.strip().strip('"')
+                if not os.path.isabs(path):
+                    path = os.path.join(directory, path)
+                return path
+
+    return None
+
+
+# Returns (value, new position) for the varint at 'pos'.
+def readVarint(data: bytes, pos: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+# Returns a dict of every key -> value in a table.
+def readTable(data: bytes):
+    footer = data[-FOOTER_SIZE:]
+    magic = struct.unpack("<Q", footer[-8:])[0]
+    if magic != TABLE_MAGIC:
+        raise ValueError("Not a checkpoint index file")
+
+    # Skip the metaindex handle.
+    _, pos = readVarint(footer, 0)
+    _, pos = readVarint(footer, pos)
+    indexOffset, pos = readVarint(footer, pos)
+    indexSize, pos = readVarint(footer, pos)
+
+    entries = {}
+    indexBlock = readBlock(data, indexOffset, indexSize)
+    for _, handle in readBlockEntries(indexBlock):
+        offset, pos = readVarint(handle, 0)
+        size, pos = readVarint(handle, pos)
+        for key, value in readBlockEntries(readBlock(data, offset, size)):
+            entries[key] = value
+
+    return entries
+
+
+# Each block is followed by 1 byte for the compression type and a crc.
+def readBlock(data: bytes, offset: int, size: int):
+    compression = data[offset + size]
+    if compression != 0:
+        raise ValueError("Compressed checkpoint index files aren't supported")
+    return data[offset:offset + size]
+
+
+# Yields (key, value) for each entry in a block. Keys only store the
+# part that is different from the previous key.
+def readBlockEntries(block: bytes):
+    numRestarts = struct.unpack("<I", block[-4:])[0]
+    end = len(block) - 4 - 4 * numRestarts
+
+    pos = 0
+    key = b""
+    while pos < end:
+        shared, pos = readVarint(block, pos)
+        nonShared, pos = readVarint(block, pos)
+        valueSize, pos = readVarint(block, pos)
+        key = key[:shared] + block[pos:pos + nonShared]
+        pos += nonShared
+        yield key, block[pos:pos + valueSize]
+        pos += valueSize
+
+
+# Parses a protobuf message into a dict of field number -> list of values.
+# (Varints are ints, and everything else is bytes)
+def parseProto(data: bytes):
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        tag, pos = readVarint(data, pos)
+        fieldNumber = tag >> 3
+        wireType = tag & 0x7
+
+        if wireType == 0:
+            value, pos = readVarint(data, pos)
+        elif wireType == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wireType == 2:
+            size, pos = readVarint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        elif wireType == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported protobuf wire type " + str(wireType))
+
+        fields.setdefault(fieldNumber, []).append(value)
+
+    return fields
+
+
+# Parses a BundleEntryProto.
+def parseEntry(data: bytes):
+    fields = parseProto(data)
+    if 7 in fields:
+        raise ValueError("Sliced tensors aren't supported")
+
+    # TensorShapeProto. (Each dim is a TensorShapeProto.Dim with a size)
+    shape = []
+    shapeFields = parseProto(fields.get(2, [b""])[0])
+    for dim in shapeFields.get(2, []):
+        shape.append(parseProto(dim).get(1, [0])[0])
+
+    return {
+        'dtype': fields.get(1, [0])[0],
+        'shape': shape,
+        'shard': fields.get(3, [0])[0],
+        'offset': fields.get(4, [0])[0],
+        'size': fields.get(5, [0])[0],
+    }
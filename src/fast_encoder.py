@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# A faster drop-in replacement for the BPE encoder from gpt-2
+# ('gpt_2/src/encoder.py'). It reads the same 'encoder.json' and
+# 'vocab.bpe' files and gives the exact same tokens.
+#
+# The differences are...
+# - BPE merges are done on token ids instead of strings, using a
+#   dictionary of (first id, second id) -> merge rank, and arrays for
+#   what each merge turns into.
+# - The word cache is a LRU cache with a max size in bytes, instead of a
+#   dictionary that grows forever.
+# - Decoding uses the bytes of each token directly.
+# - 'encode_many' encodes a list of strings.
+import json
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+import regex as re
+
+
+# Same as 'bytes_to_unicode' from gpt-2.
+# Maps each byte to the unicode character used for it in 'encoder.json'.
+def bytesToUnicode():
+    bs = list(range(ord("!"), ord("~") + 1))
+    bs += list(range(ord("¡"), ord("¬") + 1))
+    bs += list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(2**8):
+        if b not in bs:
+            bs.append(b)
+            cs.append(2**8 + n)
+            n += 1
+    cs = [chr(n) for n in cs]
+    return dict(zip(bs, cs))
+
+
+class FastEncoder:
+    def __init__(self,
+                 encoder: dict,
+                 bpeMerges: list,
+                 errors: str = 'replace',
+                 cacheBytes: int = 8 * 1024 * 1024):
+        # Kept under the same names as gpt-2's Encoder.
+        self.encoder = encoder
+        self.decoder = {v: k for k, v in self.encoder.items()}
+        self.errors = errors  # how to handle errors in decoding
+        self.byte_encoder = bytesToUnicode()
+        self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
+
+        # Same pattern as gpt-2
+        self.pat = re.compile(
+            r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+        )
+
+        # Token id for each byte.
+        self.byteIds = array(
+            'i', [self.encoder[self.byte_encoder[b]] for b in range(256)])
+
+        # The bytes of each token id.
+        self.tokenBytes = [b""] * (max(self.decoder.keys()) + 1)
+        for tokenId, token in self.decoder.items():
+            self.tokenBytes[tokenId] = bytes(
+                [self.byte_decoder[c] for c in token])
+
+        # A pair of ids is stored as one int. (first << pairShift | second)
+        self.pairShift = len(self.tokenBytes).bit_length()
+
+        # pair -> rank, and for each rank the pair and what it merges into.
+        self.mergeRanks = {}
+        self.mergeFirst = array('i')
+        self.mergeSecond = array('i')
+        self.mergeResult = array('i')
+        for first, second in bpeMerges:
+            merged = first + second
+            if (first not in self.encoder or second not in self.encoder
+                    or merged not in self.encoder):
+                continue
+
+            # (If a pair is listed twice the last one wins, like gpt-2)
+            pair = (self.encoder[first] << self.pairShift
+                    | self.encoder[second])
+            self.mergeRanks[pair] = len(self.mergeResult)
+            self.mergeFirst.append(self.encoder[first])
+            self.mergeSecond.append(self.encoder[second])
+            self.mergeResult.append(self.encoder[merged])
+
+        # Word -> tokens cache. (Oldest used words are removed first once
+        # it goes over 'cacheBytes')
+        self.cacheBytes = cacheBytes
+        self.cache = OrderedDict()
+        self.cacheSize = 0
+        # Guards the cache, since the game, the speculator and the
+        # inference scheduler can encode at the same time.
+        self.cacheLock = threading.Lock()
+
+    # Runs the BPE merges on the bytes of a word and returns its tokens.
+    def bpe(self, word: bytes):
+        byteIds = self.byteIds
+        ids = [byteIds[b] for b in word]
+
+        mergeRanks = self.mergeRanks
+        pairShift = self.pairShift
+        while len(ids) > 1:
+            # Find the pair that was merged first during training.
+            bestRank = -1
+            prev = ids[0]
+            for cur in ids[1:]:
+                rank = mergeRanks.get(prev << pairShift | cur, -1)
+                if rank != -1 and (bestRank == -1 or rank < bestRank):
+                    bestRank = rank
+                prev = cur
+
+            if bestRank == -1:
+                break
+
+            # Merge every occurrence of it.
+            first = self.mergeFirst[bestRank]
+            second = self.mergeSecond[bestRank]
+            merged = self.mergeResult[bestRank]
+
+            newIds = []
+            i = 0
+            numIds = len(ids)
+            while i < numIds:
+                if (ids[i] == first and i < numIds - 1
+                        and ids[i + 1] == second):
+                    newIds.append(merged)
+                    i += 2
+                else:
+                    newIds.append(ids[i])
+                    i += 1
+            ids = newIds
+
+        return ids
+
+    # Tokens for one word (a match of self.pat), using the cache.
+    # (Has to be called with self.cacheLock held)
+    def _encodeWord(self, word: str):
+        cache = self.cache
+        tokens = cache.get(word)
+        if tokens is not None:
+            cache.move_to_end(word)
+            return tokens
+
+        tokens = tuple(self.bpe(word.encode('utf-8')))
+
+        cache[word] = tokens
+        self.cacheSize += self._cacheEntrySize(word, tokens)
+        while self.cacheSize > self.cacheBytes and len(cache) > 1:
+            oldWord, oldTokens = cache.popitem(last=False)
+            self.cacheSize -= self._cacheEntrySize(oldWord, oldTokens)
+
+        return tokens
+
+    # Rough number of bytes a cache entry takes up.
+    def _cacheEntrySize(self, word: str, tokens: tuple):
+        return sys.getsizeof(word) + sys.getsizeof(tokens) + 100
+
+    def encode(self, text: str):
+        words = self.pat.findall(text)
+
+        # (Held for the whole text, since taking it for each word is
+        # slower. The merges hold the GIL either way)
+        bpeTokens = []
+        with self.cacheLock:
+            for word in words:
+                bpeTokens.extend(self._encodeWord(word))
+        return bpeTokens
+
+    # Encodes each string in 'texts'. (Returns a list of token lists)
+    def encode_many(self, texts: list):
+        return [self.encode(text) for text in texts]
+
+    # The raw bytes of 'tokens'. (Might end in the middle of a character)
+    def decodeBytes(self, tokens: list):
+        return b"".join([self.tokenBytes[token] for token in tokens])
+
+    def decode(self, tokens: list):
+        return self.decodeBytes(tokens).decode('utf-8', errors=self.errors)
+
+
+# Same as 'get_encoder' from gpt-2.
+def get_encoder(modelName: str, modelsDir: str):
+    with open(os.path.join(modelsDir, modelName, 'encoder.json'), 'r') as f:
+        encoder = json.load(f)
+    with open(os.path.join(modelsDir, modelName, 'vocab.bpe'),
+              'r',
+              encoding="utf-8") as f:
+        bpeData = f.read()
+    bpeMerges = [
+        tuple(mergeStr.split()) for mergeStr in bpeData.split('\n')[1:-1]
+    ]
+    return FastEncoder(encoder=encoder, bpeMerges=bpeMerges)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# Flat weight files. A faster way to load the model than the checkpoint.
+#
+# 'weights.bin' holds the model's tensors one after another (each one
+# starts at a multiple of ALIGNMENT bytes), and 'weights.json' says
+# where each one is...
+# {
+#   "checkpoint": "model-1",       (The checkpoint it was made from)
+#   "checkpointSize": 1234,        (Size of the checkpoint's data files)
+#   "tensors": {
+#     "model/wte": {"dtype": "float16", "shape": [50257, 1024], "offset": 0},
+#     ...
+#   }
+# }
+#
+# The file is memory-mapped when loaded, so processes that load the same
+# file share one copy of it in the page cache. (Float16 files are half
+# the size, but they have to be converted to float32 after they're read)
+#
+# Usage: python -m src.flat_weights gpt2-model/rpg_model [--dtype float16]
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+
+from . import checkpoint_reader
+
+INDEX_NAME = "weights.json"
+DATA_NAME = "weights.bin"
+ALIGNMENT = 64
+DTYPES = ("float32", "float16")
+
+# Tensors in each layer of gpt-2's model. ('model/h0/ln_1/g', ...)
+LAYER_TENSORS = ('ln_1/g', 'ln_1/b', 'attn/c_attn/w', 'attn/c_attn/b',
+                 'attn/c_proj/w', 'attn/c_proj/b', 'ln_2/g', 'ln_2/b',
+                 'mlp/c_fc/w', 'mlp/c_fc/b', 'mlp/c_proj/w', 'mlp/c_proj/b')
+
+
+# Names of the checkpoint tensors that gpt-2's model uses.
+# (The checkpoint can also have optimizer state, which isn't needed)
+def modelTensorNames(numLayers: int):
+    names = ['model/wte', 'model/wpe', 'model/ln_f/g', 'model/ln_f/b']
+    for layer in range(numLayers):
+        for name in LAYER_TENSORS:
+            names.append('model/h{}/{}'.format(layer, name))
+    return names
+
+
+# Writes the flat weight file for the latest checkpoint in 'modelPath'.
+def convertCheckpoint(modelPath: str, dtype: str = "float32"):
+    if dtype not in DTYPES:
+        raise ValueError("Unsupported dtype: " + dtype)
+
+    prefix = checkpoint_reader.latestCheckpoint(modelPath)
+    if prefix is None:
+        raise ValueError("No checkpoint in " + modelPath)
+    reader = checkpoint_reader.CheckpointReader(prefix)
+
+    with open(os.path.join(modelPath, 'hparams.json')) as f:
+        numLayers = json.load(f)['n_layer']
+
+    tensors = ((x, reader.getTensor(x)) for x in modelTensorNames(numLayers))
+    return writeWeights(
+        modelPath, tensors, dtype, {
+            'checkpoint': os.path.basename(prefix),
+            'checkpointSize': getCheckpointSize(prefix),
+        })
+
+
+# Writes the flat weight file for 'tensors', a list of (name, array).
+# 'info' is added to the index. (Without 'checkpoint' the file is
+# always used. See hasWeights)
+def writeWeights(modelPath: str,
+                 tensors,
+                 dtype: str = "float32",
+                 info: dict = None):
+    if dtype not in DTYPES:
+        raise ValueError("Unsupported dtype: " + dtype)
+
+    index = dict(info or {})
+    index['tensors'] = {}
+
+    # Written to temporary files first, so a half written file is
+    # never loaded.
+    dataPath = os.path.join(modelPath, DATA_NAME)
+    indexPath = os.path.join(modelPath, INDEX_NAME)
+    offset = 0
+    with open(dataPath + ".tmp", "wb") as f:
+        for name, tensor in tensors:
+            tensor = tensor.astype(dtype)
+
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+
+            index['tensors'][name] = {
+                'dtype': dtype,
+                'shape': list(tensor.shape),
+                'offset': offset,
+            }
+            f.write(tensor.tobytes())
+            offset += tensor.nbytes
+
+    with open(indexPath + ".tmp", "w") as f:
+        json.dump(index, f, indent=2)
+
+    os.replace(dataPath + ".tmp", dataPath)
+    os.replace(indexPath + ".tmp", indexPath)
+
+    return dataPath
+
+
+# True if 'modelPath' has a flat weight file made from its latest
+# checkpoint. (Or a flat weight file and no checkpoint)
+def hasWeights(modelPath: str):
+    indexPath = os.path.join(modelPath, INDEX_NAME)
+    if not os.path.isfile(indexPath) or not os.path.isfile(
+            os.path.join(modelPath, DATA_NAME)):
+        return False
+
+    prefix = checkpoint_reader.latestCheckpoint(modelPath)
+    if prefix is None:
+        return True
+
+    with open(indexPath, "r") as f:
+        index = json.load(f)
+
+    return (index.get('checkpoint') == os.path.basename(prefix)
+            and index.get('checkpointSize') == getCheckpointSize(prefix))
+
+
+# Memory-maps the flat weight file in 'modelPath'.
+# Returns a dict of tensor name -> read-only array.
+def loadWeights(modelPath: str):
+    with open(os.path.join(modelPath, INDEX_NAME), "r") as f:
+        index = json.load(f)
+
+    data = np.memmap(os.path.join(modelPath, DATA_NAME),
+                     dtype=np.uint8,
+                     mode='r')
+
+    weights = {}
+    for name, info in index['tensors'].items():
+        count = 1
+        for size in info['shape']:
+            count *= size
+        weights[name] = np.frombuffer(data,
+                                      dtype=np.dtype(info['dtype']),
+                                      count=count,
+                                      offset=info['offset']).reshape(
+                                          info['shape'])
+
+    return weights
+
+
+# Total size of a checkpoint's data files.
+def getCheckpointSize(prefix: str):
+    return sum(
+        [os.path.getsize(x) for x in glob.glob(prefix + ".data-*-of-*")])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a checkpoint to a flat weight file.")
+    parser.add_argument("modelPath",
+                        help="Model directory. (Like 'gpt2-model/rpg_model')")
+    parser.add_argument("--dtype",
+                        choices=DTYPES,
+                        default="float32",
+                        help="How the weights are stored. (float16 is half "
+                        "the size, but only float32 is shared between "
+                        "processes)")
+    args = parser.parse_args()
+
+    dataPath = convertCheckpoint(args.modelPath, args.dtype)
+    print("Wrote", dataPath)
@@ -1,15 +1,30 @@
 #!/usr/bin/env python
+from . import action_translator, save_format
 from .model_manager import ModelManager
+from .opening_cache import OpeningCache, getDatabaseId
 from .story_manager import StoryManager
 from .story_starter import StoryStarter
+from .save_writer import SaveWriter
+from .speculator import Speculator
+from .turn_metrics import TurnMetrics
 import datetime
 import os
-import re
+import threading
+import time
 
 
 class Game:
-    def __init__(self, modelManager: ModelManager, transcriptPath: str,
-                 savesPath: str, storiesJSON: str):
+    def __init__(self,
+                 modelManager: ModelManager,
+                 transcriptPath: str,
+                 savesPath: str,
+                 storiesJSON: str,
+                 numCandidates: int = 3,
+                 speculate: bool = False,
+                 tokenBudget: int = None,
+                 metrics: TurnMetrics = None,
+                 openingsPath: str = None,
+                 saveAttentionCache: bool = False):
         self.keepGoing = True
         self.firstAction = True
         self.modelManager = modelManager
@@ -25,14 +40,72 @@ class Game:
         self.currentText = ""
         self.currentAction = ""
 
+        # Number of AI responses generated per action. The extra ones
+        # are kept in 'self.candidates' so '/retry' doesn't have to
+        # run the AI again.
+        self.numCandidates = max(1, numCandidates)
+        self.candidates = []
+        # The rest of the candidates while they're still being generated,
+        # as (Future, stop event). (See '_streamFromSeed')
+        self.spareCandidates = None
+
+        # Sampling settings passed to the ModelManager. (See
+        # ModelManager.settings) The "continue" action doesn't need as
+        # much text, so it uses cheaper settings.
+        self.actionSettings = {}
+        self.continueSettings = {'length': 40}
+        # The settings used for the current candidates.
+        self.candidateSettings = self.actionSettings
+
+        # Used to generate the likely next AI responses while the
+        # player is typing. (See 'self.speculate()')
+        self.speculator = None
+        if speculate:
+            self.speculator = Speculator(self._generateFromSeed)
+        # The "continue" action the last speculation was for. (Its tokens
+        # are reused if it's the next action)
+        self.speculatedAction = None
+
+        # Pre-sampled AI responses for continuing the starting prompt,
+        # and the file they're read from. (See 'opening_cache.py')
+        self.openings = []
+        self.openingsPath = openingsPath
+        self.openingCache = None
+
+        # If the model's attention cache is saved with the story when the
+        # game quits. (See 'attention_cache.py') It's off by default, since
+        # it's about 37KB per token with the 124M model, and more with
+        # bigger ones. (A cache saved before is still read)
+        self.saveAttentionCache = saveAttentionCache
+        # The attention cache that was read with the story.
+        self.loadedPast = None
+
+        # Where the time of each turn goes. (See '/stats')
+        self.metrics = metrics
+        if self.metrics is None:
+            self.metrics = TurnMetrics()
+
         # Will use the current date to make a save file.
         self.curSaveFile = datetime.datetime.now().strftime(
             "%Y-%m-%d_%Hh_%Mm_%Ss")
 
+        # Max number of tokens in the AI seed. (Defaults to as much
+        # as the model can take)
+        if tokenBudget is None:
+            tokenBudget = self.modelManager.getContextBudget()
+
         # Create StoryManager Object
-        self.storyManager = StoryManager(self.curSaveFile + ".json",
-                                         self.savesPath,
-                                         memorySize=15)
+        self.storyManager = StoryManager(
+            self.curSaveFile + save_format.SAVE_EXTENSION,
+            self.savesPath,
+            memorySize=15,
+            # (Not '.enc', so the encoder loads with the model instead
+            # of before the menus)
+            encoder=self.modelManager,
+            tokenBudget=tokenBudget,
+            tokenizerId=self.modelManager.tokenizerId,
+            journal=True,
+            writer=SaveWriter())
 
         return
 
@@ -49,17 +122,43 @@ class Game:
         helpText += "/remember - marks the last action as important\n"
         helpText += "/rewind - rewind the previous action\n"
         helpText += "/retry - send the last action back into the bot\n"
+        helpText += "/stats - shows how long the last turns took\n"
 
         return helpText
 
     def quitGame(self):
         self.keepGoing = False
+        self._dropSpareCandidates()
+        if self.saveAttentionCache:
+            self._writeAttentionCache()
+        # (Stops the SaveWriter's thread)
+        self.storyManager.close()
+
+    # Saves the model's attention cache with the story, so the first turn
+    # after it's loaded only has to feed the tokens that changed.
+    def _writeAttentionCache(self):
+        if not hasattr(self.modelManager, 'exportCache'):
+            return
+        cache = self.modelManager.exportCache()
+        # (Not if it's still the one that was loaded)
+        if cache is not None and cache[1] is not self.loadedPast:
+            self.storyManager.saveAttentionCache(self.modelManager.modelId,
+                                                 *cache)
+
+    # Gives the attention cache saved with the story to the model.
+    def _readAttentionCache(self):
+        if not hasattr(self.modelManager, 'importCache'):
+            return
+        cache = self.storyManager.loadAttentionCache(self.modelManager.modelId)
+        if cache is not None and self.modelManager.importCache(*cache):
+            self.loadedPast = cache[1]
 
     def transcript(self, fileName: str):
         if fileName.split('.')[-1].lower() != ".txt":
             fileName += ".txt"
 
         filePath = os.path.join(self.transcriptPath, fileName)
+        self.storyManager.flush()
 
         with open(filePath, 'w') as transcriptFile:
             transcriptFile.write(self.storyManager.getTranscript() + "\n" +
@@ -72,12 +171,195 @@ class Game:
         aiText = self.storyManager.revertAction()
 
         self.currentText = aiText
+        # The candidates were for the action that was reverted.
+        self.candidates = []
+        self._dropSpareCandidates()
+
+    # Uses the next AI response for the current text.
+    # (Only reruns the AI once we run out of candidates)
+    # 'onText' is the same as in gameCommand.
+    def retry(self, onText=None):
+        if len(self.candidates) == 0:
+            self.candidates = self._takeSpareCandidates()
+        if len(self.candidates) == 0:
+            turn = self.metrics.startTurn("retry")
+            self._generateCandidates(self.candidateSettings, turn, onText)
+            self.currentText = self.candidates.pop(0)
+            with turn.stage("saveStory"):
+                self.storyManager.updateCurrentPrompt(self.currentText)
+            self.metrics.finishTurn(turn)
+            return
+
+        self.currentText = self.candidates.pop(0)
+        self.storyManager.updateCurrentPrompt(self.currentText)
+
+    # Runs the AI on the current seed and fills 'self.candidates'
+    # (The time it takes is added to 'turn')
+    # If 'onText' is given (and the response wasn't speculated) the first
+    # response is streamed to 'onText' as it's generated. (Unless the
+    # ModelManager can't stream, like InferenceScheduler)
+    # If 'openings' are given they're used instead of running the AI.
+    def _generateCandidates(self,
+                            settings: dict,
+                            turn,
+                            onText=None,
+                            openings: list = None):
+        # (Frees the model for this turn)
+        self._dropSpareCandidates()
+
+        with turn.stage("buildSeed"):
+            aiSeed = tuple(self.storyManager.getAISeedTokens())
+
+        with turn.stage("generate"):
+            result = None
+            if openings:
+                result = list(openings), None
+                turn.cachedOpening = True
+            elif self.speculator is not None:
+                result = self.speculator.take(aiSeed, settings)
+                turn.speculated = result is not None
+
+            canStream = hasattr(self.modelManager, 'streamFromTokens')
+            if result is None and onText is not None and canStream:
+                result = self._streamFromSeed(aiSeed, settings, onText, turn)
+            elif result is None:
+                result = self._generateFromSeed(aiSeed, settings)
+
+        candidates, stats = result
+        turn.promptTokens = len(aiSeed)
+        if stats is not None:
+            turn.addModelStats(stats)
+        # Splits the parts of "generate" that weren't running the model
+        # into their own stages. (Unless they were done in the background
+        # by the speculator)
+        if stats is not None and not turn.speculated:
+            for name, key in (("wait", 'waitSeconds'),
+                              ("decode", 'decodeSeconds'), ("stripText",
+                                                            'stripSeconds')):
+                turn.addStage("generate", -stats[key])
+                turn.addStage(name, stats[key])
+
+        self.candidates = candidates
+        self.candidateSettings = settings
+
+    # 'aiSeed' is a tuple of tokens.
+    # Returns the AI responses, and the ModelManager's stats for them.
+    # (Or None if it doesn't have stats. See ModelManager.getLastStats)
+    # 'stop' is passed to the ModelManager. (See getSamplesFromTokens)
+    def _generateFromSeed(self, aiSeed: tuple, settings: dict, stop=None):
+        aiOutputs = self.modelManager.getSamplesFromTokens(list(aiSeed),
+                                                           self.numCandidates,
+                                                           stop=stop,
+                                                           **settings)
+
+        stats = None
+        if hasattr(self.modelManager, 'getLastStats'):
+            stats = dict(self.modelManager.getLastStats())
+
+        start = time.perf_counter()
+        candidates = [self._stripAIText(x) for x in aiOutputs]
+        if stats is not None:
+            stats['stripSeconds'] = time.perf_counter() - start
+
+        return candidates, stats
+
+    # Same as _generateFromSeed, but calls 'onText' with the text of the
+    # first AI response as it's generated. The text is only passed on once
+    # _stripAIText can't remove it, so all of the calls add up to the
+    # response.
+    #
+    # Returns as soon as the first response is done, with only that one.
+    # The others are generated in the background and kept in
+    # 'self.spareCandidates' until '/retry' needs them.
+    def _streamFromSeed(self, aiSeed: tuple, settings: dict, onText, turn):
+        text = ""
+        shownLength = 0
+        stripSeconds = 0.0
+
+        def show(newText: str):
+            if turn.firstTextSeconds is None:
+                turn.firstTextSeconds = time.perf_counter() - turn.start
+            onText(newText)
+
+        def onSampleText(fragment: str):
+            nonlocal text, shownLength, stripSeconds
+            text += fragment
+
+            start = time.perf_counter()
+            stableText = self._stableAIText(text)
+            stripSeconds += time.perf_counter() - start
+
+            if len(stableText) > shownLength:
+                show(stableText[shownLength:])
+                shownLength = len(stableText)
+
+        stop = threading.Event()
+        aiOutput, rest = self.modelManager.streamFromTokens(list(aiSeed),
+                                                            self.numCandidates,
+                                                            onSampleText,
+                                                            stop=stop,
+                                                            **settings)
+        stats = dict(self.modelManager.getLastStats())
+        self.spareCandidates = (rest, stop)
+
+        start = time.perf_counter()
+        candidate = self._stripAIText(aiOutput)
+        stripSeconds += time.perf_counter() - start
+        if len(candidate) > shownLength:
+            show(candidate[shownLength:])
+
+        stats['stripSeconds'] = stripSeconds
+        return [candidate], stats
+
+    # Waits for the candidates that were still being generated, and
+    # returns them. ([] if there aren't any, or they failed. Then '/retry'
+    # just runs the AI again)
+    def _takeSpareCandidates(self):
+        if self.spareCandidates is None:
+            return []
+        rest, _ = self.spareCandidates
+        self.spareCandidates = None
+
+        try:
+            aiOutputs = rest.result()
+        except Exception:
+            return []
+        return [self._stripAIText(x) for x in aiOutputs]
+
+    # Stops generating the spare candidates, since they're for a response
+    # that is being replaced.
+    def _dropSpareCandidates(self):
+        if self.spareCandidates is not None:
+            self.spareCandidates[1].set()
+            self.spareCandidates = None
+
+    # Starts generating the AI responses for the most likely next
+    # commands in the background. (Meant to be called while waiting
+    # for the player's input)
+    def speculate(self):
+        if self.speculator is None or not self.keepGoing:
+            return
+        # (Continuing the starting prompt uses the cached openings)
+        if len(self.openings) > 0:
+            return
+
+        # The "continue" action (empty input) is the most likely.
+        currentText = self.currentText
+        if self.oldText != "":
+            currentText = self.oldText
+        nextAction = self.storyManager.previewAction(
+            currentText, self.prepareAction("continue"))
+        self.speculatedAction = nextAction
+        seeds = [(tuple(self.storyManager.getAISeedTokens(nextAction)),
+                  self.continueSettings)]
 
-    # Simply reruns the AI with the current text.
-    def retry(self):
-        aiText = self.modelManager.getSampleFromText(
-            self.storyManager.getAISeed())
-        self.currentAction = self._stripAIText(aiText)
+        # Then '/retry' if there aren't any candidates left.
+        if (len(self.candidates) == 0 and self.spareCandidates is None
+                and not self.firstAction):
+            seeds.append((tuple(self.storyManager.getAISeedTokens()),
+                          self.candidateSettings))
+
+        self.speculator.speculate(seeds)
 
     # All this does is initialize the 'self.currentText'
     def startGame(self,
@@ -86,11 +368,17 @@ class Game:
                   characterClass: str,
                   customPrompt: str = None):
         # Get the initial prompt from the StoryStarter
+        self.openings = []
         if genre == "custom" and customPrompt != None:
             initialPrompt = customPrompt
         else:
-            initialPrompt = self.storyStarter.getPrompt(
-                genre, characterName, characterClass)
+            template = self.storyStarter.pickTemplate(genre, characterClass)
+            initialPrompt = self.storyStarter.makePrompt(
+                characterName, template)
+
+            openingCache = self._getOpeningCache()
+            if openingCache is not None:
+                self.openings = openingCache.get(template, characterName)
 
         # Lets add our game info into the storyData
         self.storyManager.storyData['genre'] = genre
@@ -99,132 +387,30 @@ class Game:
 
         self.currentText = initialPrompt
 
+    # Reads the opening cache the first time it's needed. (None if the
+    # Game wasn't given one)
+    def _getOpeningCache(self):
+        if self.openingCache is None and self.openingsPath is not None:
+            self.openingCache = OpeningCache(
+                self.openingsPath, self.modelManager.modelId,
+                getDatabaseId(self.storyStarter.starterJson))
+        return self.openingCache
+
     # Simply resume the loaded game. (Also returns transcript)
     def resumeGame(self):
         self.currentText = self.storyManager.storyData['currentPrompt']
         self.firstAction = False
+        self._readAttentionCache()
         return self.storyManager.getTranscript()
 
+    # Turns the player's input into the action text. (See
+    # 'action_translator.py')
     def prepareAction(self, actionText):
-        # Stuff for translating first person to second person
-        # Pulled from...
-        # https://github.com/Latitude-Archives/AIDungeon/blob/develop/story/utils.py
-
-        # Capitalizing the first word in every sentence.
-        def capitalizeFirstLetters(text):
-            def capitalizeHelper(string):
-                stringList = list(string)
-                stringList[0] = stringList[0].upper()
-                return "".join(stringList)
-
-            firstLettersRegex = re.compile(r"((?<=[\.\?!]\s)(\w+)|(^\w+))")
-
-            def cap(match):
-                return capitalizeHelper(match.group())
-
-            result = firstLettersRegex.sub(cap, text)
-            return result
-
-        # Simply capitalize the first letter in a word.
-        def capitalize(word):
-            return word[0].upper() + word[1:]
-
-        # Generates variations of firstToSecondMappings
-        def mappingVariationPairs(mapping: tuple):
-            mappingList = []
-            mappingList.append(
-                (" " + mapping[0] + " ", " " + mapping[1] + " "))
-            mappingList.append((" " + capitalize(mapping[0]) + " ",
-                                " " + capitalize(mapping[1]) + " "))
-
-            # Change you before punctuation
-            if mapping[0] == "you":
-                mapping = ("you", "me")
-            mappingList.append(
-                (" " + mapping[0] + ",", " " + mapping[1] + ","))
-            mappingList.append(
-                (" " + mapping[0] + "\?", " " + mapping[1] + "\?"))
-            mappingList.append(
-                (" " + mapping[0] + "\!", " " + mapping[1] + "\!"))
-            mappingList.append(
-                (" " + mapping[0] + "\.", " " + mapping[1] + "."))
-
-            return mappingList
-
-        # Replace text, but only outside of quotations
-        def replaceOutsideQuotes(text, currentWord, replWord):
-            regExpr = re.compile(currentWord + '(?=([^"]*"[^"]*")*[^"]*$)')
-
-            output = regExpr.sub(replWord, text)
-            return output
-
-        firstToSecondMappings = [
-            ("I'm", "you're"),
-            ("Im", "you're"),
-            ("Ive", "you've"),
-            ("I am", "you are"),
-            ("was I", "were you"),
-            ("am I", "are you"),
-            ("wasn't I", "weren't you"),
-            ("I", "you"),
-            ("I'd", "you'd"),
-            ("i", "you"),
-            ("I've", "you've"),
-            ("was I", "were you"),
-            ("am I", "are you"),
-            ("wasn't I", "weren't you"),
-            ("I", "you"),
-            ("I'd", "you'd"),
-            ("i", "you"),
-            ("I've", "you've"),
-            ("I was", "you were"),
-            ("my", "your"),
-            ("we", "you"),
-            ("we're", "you're"),
-            ("mine", "yours"),
-            ("me", "you"),
-            ("us", "you"),
-            ("our", "your"),
-            ("I'll", "you'll"),
-            ("myself", "yourself"),
-        ]
-
-        # Lets first remove any whitespace
-        actionText = actionText.strip()
-
-        # Check if the input is dialogue
-        if actionText[0] == '"':
-            actionText = "You say, " + actionText
-        else:
-            # If not add 'You' if needed.
-            if "you" not in actionText[:6].lower(
-            ) and "I" not in actionText[:6]:
-                actionText = actionText[0].lower() + actionText[1:]
-                actionText = "You " + actionText
-
-            # Make sure we add punctuation
-            if actionText[-1] not in [".", "?", "!"]:
-                actionText = actionText + "."
-
-        # Translate first person text into second person text.
-        actionText = " " + actionText
-        for pair in firstToSecondMappings:
-            variations = mappingVariationPairs(pair)
-            for variation in variations:
-                actionText = replaceOutsideQuotes(actionText, variation[0],
-                                                  variation[1])
-
-        actionText = actionText.strip()
-        actionText = capitalizeFirstLetters(actionText)
-
-        return actionText
+        return action_translator.prepareAction(actionText)
 
     def _stripAIText(self, inputText):
         # First lets fix any weird punctuation.
-        inputText = inputText.replace("’", "'")
-        inputText = inputText.replace("`", "'")
-        inputText = inputText.replace("“", '"')
-        inputText = inputText.replace("”", '"')
+        inputText = self._fixPunctuation(inputText)
 
         # Find the last sentence
         lastIndex = max(inputText.rfind("."), inputText.rfind("?"),
@@ -261,7 +447,55 @@ class Game:
 
         return inputText
 
-    def gameCommand(self, inputStr: str):
+    # Replaces the fancy quotes the AI sometimes uses.
+    def _fixPunctuation(self, inputText):
+        inputText = inputText.replace("’", "'")
+        inputText = inputText.replace("`", "'")
+        inputText = inputText.replace("“", '"')
+        inputText = inputText.replace("”", '"')
+        return inputText
+
+    # The start of _stripAIText(text) that stays the same however 'text'
+    # goes on. (For showing an AI response while it's generated)
+    #
+    # Following each step of _stripAIText...
+    # - The cut at the last sentence can only move forward, but the text
+    #   after the current last sentence is cut if no other one comes.
+    #   (If there isn't a sentence yet everything is kept either way)
+    # - Everything after a '<' or '>' is cut. (They end the response, so
+    #   they're only in the last token)
+    # - If there's an odd number of quotes, more text might not close it,
+    #   and everything from that quote is cut.
+    # - The last line is removed if it has "you say" or "you ask", so a
+    #   line is only safe once the next one starts. (The first line is
+    #   never removed)
+    def _stableAIText(self, inputText):
+        inputText = self._fixPunctuation(inputText)
+
+        for token in ("<", ">"):
+            if inputText.find(token) > 0:
+                inputText = inputText[:inputText.find(token)]
+
+        lastIndex = max(inputText.rfind("."), inputText.rfind("?"),
+                        inputText.rfind("!"))
+        if lastIndex > 0:
+            inputText = inputText[:lastIndex + 1]
+
+        if inputText.count('"') % 2 != 0:
+            inputText = inputText[:inputText.rfind('"')]
+
+        if "\n" in inputText:
+            inputText = inputText[:inputText.rfind("\n")]
+
+        return inputText
+
+    # Runs a command or an action.
+    #
+    # If 'onText' is given, an AI response that has to be generated is
+    # passed to it (a bit at a time) while it's generated, and then set
+    # as self.currentText. (Responses from the speculator, the
+    # candidates or the opening cache aren't passed to it)
+    def gameCommand(self, inputStr: str, onText=None):
         # If help was ran previously reset self.oldText
         if self.oldText != "":
             self.currentText = self.oldText
@@ -283,6 +517,8 @@ class Game:
             inputStr = inputStr[1:].strip()
             if inputStr == "quit":
                 # do exit
+                if self.speculator is not None:
+                    self.speculator.cancel()
                 self.quitGame()
                 return
             elif inputStr == "remember":
@@ -300,33 +536,55 @@ class Game:
                 return
             elif inputStr == "retry":
                 # do retry
-                self.retry()
+                self.retry(onText)
                 return
             elif inputStr == "help":
                 # do help
                 self.oldText = self.currentText
                 self.currentText = self.help()
                 return
+            elif inputStr == "stats":
+                # Shown the same way as help.
+                self.oldText = self.currentText
+                self.currentText = self.metrics.summary()
+                return
             else:
                 # do nothing if invalid.
                 self.currentText = "Invalid command. See '/help'"
                 return
 
         # Do main loop
-        userText = self.prepareAction(inputStr)
-        curAction = self.storyManager.createAction(self.currentText, userText)
-
-        # Takes the current action and saves it for seed generation
-        # to send to the AI
-        if self._remember:
-            self.storyManager.saveAction(curAction)
-            self._remember = False
-        self.storyManager.updateMemory(curAction)
-        aiSeed = self.storyManager.getAISeed()
-
+        turn = self.metrics.startTurn("continue" if inputStr ==
+                                      "continue" else "action")
+        with turn.stage("prepareAction"):
+            userText = self.prepareAction(inputStr)
+
+        with turn.stage("updateStory"):
+            curAction = self.storyManager.createAction(
+                self.currentText, userText, preview=self.speculatedAction)
+            self.speculatedAction = None
+
+            # Takes the current action and saves it for seed generation
+            # to send to the AI
+            if self._remember:
+                self.storyManager.saveAction(curAction)
+                self._remember = False
+            self.storyManager.updateMemory(curAction)
+
+        # The cached openings are only for continuing the starting prompt.
+        openings = []
+        if self.firstAction and inputStr == "continue":
+            openings = self.openings
+        self.openings = []
         self.firstAction = False
 
         # Send the seed to the AI
-        aiOutput = self.modelManager.getSampleFromText(aiSeed)
-        self.currentText = self._stripAIText(aiOutput)
-        self.storyManager.updateCurrentPrompt(self.currentText)
+        settings = self.actionSettings
+        if inputStr == "continue":
+            settings = self.continueSettings
+        self._generateCandidates(settings, turn, onText, openings)
+        self.currentText = self.candidates.pop(0)
+        with turn.stage("saveStory"):
+            self.storyManager.updateCurrentPrompt(self.currentText)
+
+        self.metrics.finishTurn(turn)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# Runs the model in several worker processes, so generation can use more
+# than one core. (One process only runs one generation at a time)
+#
+# Each worker process has its own ModelManager. With the numpy backend and
+# a flat weight file (see 'flat_weights.py') the workers share one
+# memory-mapped copy of the weights. (With the tensorflow backend each
+# worker has its own copy, so use fewer workers)
+#
+# Requests are sent to the worker with the fewest requests in flight
+# (or to each worker in turn with dispatch='round-robin') over a pipe,
+# and each request gets a 'concurrent.futures.Future' back.
+# Workers that crash are restarted, and the requests they had are sent
+# again. (A request fails if it was sent MAX_ATTEMPTS times) A worker
+# that dies before it has loaded the model (killed for using too much
+# memory, say) isn't restarted, since the next one would most likely die
+# the same way. The pool fails like the model failed to load.
+#
+# Since InferencePool has the same 'enc', 'encode', 'tokenizerId',
+# 'modelId', 'getContextBudget', 'getSampleFromText', 'getSamplesFromText',
+# 'getSamplesFromTokens' and 'getLastStats' as ModelManager it can be
+# passed to Game in its place. (It can't stream, so Game shows each
+# response once it's done)
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.reduction import ForkingPickler
+
+from .model_manager import ModelManager
+
+DISPATCH = ('least-loaded', 'round-robin')
+MAX_ATTEMPTS = 2
+
+# Environment variables that limit the threads of the math libraries.
+# (Workers get a copy of the environment when they start)
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS')
+
+
+# Default number of workers. One for every 'threadsPerWorker' cores,
+# leaving a core for the game itself if there is more than one.
+def defaultPoolSize(threadsPerWorker: int = 1):
+    if hasattr(os, 'sched_getaffinity'):
+        numCores = len(os.sched_getaffinity(0))
+    else:
+        numCores = os.cpu_count() or 1
+
+    return max(1, (numCores - 1) // max(1, threadsPerWorker))
+
+
+class PoolRequest:
+    def __init__(self, method: str, args: tuple, settings: dict):
+        self.method = method
+        self.args = args
+        self.settings = settings
+        self.attempts = 0
+        self.future = concurrent.futures.Future()
+        self.submitTime = time.perf_counter()
+        # The worker's stats for the request. (See getLastStats)
+        self.stats = None
+
+
+class PoolWorker:
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.sendLock = threading.Lock()
+        # Set once the worker has loaded the model.
+        self.ready = threading.Event()
+        # requestId -> PoolRequest
+        self.inFlight = {}
+
+
+class InferencePool:
+    def __init__(self,
+                 modelDir: str,
+                 modelName: str,
+                 numWorkers: int = None,
+                 backend: str = 'numpy',
+                 allowGpu: bool = False,
+                 dispatch: str = 'least-loaded',
+                 threadsPerWorker: int = 1):
+        if dispatch not in DISPATCH:
+            raise ValueError("Unknown dispatch: " + dispatch)
+
+        # Only used for the encoder and settings. (The model isn't loaded)
+        self.modelManager = ModelManager(modelDir,
+                                         modelName,
+                                         loadModel=False,
+                                         backend=backend)
+        self.enc = self.modelManager.enc
+        self.tokenizerId = self.modelManager.tokenizerId
+        self.modelId = self.modelManager.modelId
+        self.getContextBudget = self.modelManager.getContextBudget
+        self.encode = self.modelManager.encode
+
+        if numWorkers is None:
+            numWorkers = defaultPoolSize(threadsPerWorker)
+        self.workerArgs = (modelDir, modelName, backend, allowGpu)
+        self.dispatch = dispatch
+        self.threadsPerWorker = max(1, threadsPerWorker)
+
+        # (Forking a process that has TensorFlow threads isn't safe)
+        self.context = multiprocessing.get_context('spawn')
+
+        # Guards the workers, and their requests in flight.
+        self.lock = threading.Lock()
+        self.nextRequestId = 0
+        self.nextWorker = 0
+        self.closing = False
+        self.loadError = None
+        self.restarts = 0
+        self.threadStats = threading.local()
+
+        with self.lock:
+            self.workers = [
+                self._startWorker(i) for i in range(max(1, numWorkers))
+            ]
+
+    # Queues 'text' and returns a Future for a list of 'numSamples' samples.
+    # ('settings' are the same as ModelManager.getSamplesFromText)
+    def submit(self, text: str, numSamples: int = 1, **settings):
+        return self.submitTokens(self.enc.encode(text), numSamples, **settings)
+
+    # Same as submit, but for text that is already tokens.
+    def submitTokens(self, tokens: list, numSamples: int = 1, **settings):
+        return self._submit('getSamplesFromTokens', (tokens, numSamples),
+                            settings).future
+
+    # Same as ModelManager.getSamplesFromTokenBatch, but returns a Future.
+    # (The whole batch runs on one worker)
+    def submitTokenBatch(self,
+                         contexts: list,
+                         numSamples: int = 1,
+                         **settings):
+        return self._submit('getSamplesFromTokenBatch', (contexts, numSamples),
+                            settings).future
+
+    def getSampleFromText(self, inputStr: str, **settings):
+        return self.getSamplesFromText(inputStr, 1, **settings)[0]
+
+    def getSamplesFromText(self, inputStr: str, numSamples: int, **settings):
+        return self.submit(inputStr, numSamples, **settings).result()
+
+    # (A request can't be stopped once it's sent, so 'stop' isn't used)
+    def getSamplesFromTokens(self,
+                             contextTokens: list,
+                             numSamples: int,
+                             stop=None,
+                             **settings):
+        request = self._submit('getSamplesFromTokens',
+                               (contextTokens, numSamples), settings)
+        result = request.future.result()
+        self.threadStats.last = request.stats
+
+        return result
+
+    def getSamplesFromTokenBatch(self, contexts: list, numSamples: int,
+                                 **settings):
+        return self.submitTokenBatch(contexts, numSamples, **settings).result()
+
+    # Same as ModelManager.getLastStats, from the worker that ran the
+    # request. 'waitSeconds' is the rest of the time it took. (Waiting for
+    # the worker, and being sent to it and back)
+    def getLastStats(self):
+        return getattr(self.threadStats, 'last', None)
+
+    # Number of requests each worker has in flight.
+    def getLoads(self):
+        with self.lock:
+            return [len(x.inFlight) for x in self.workers]
+
+    # Blocks until every worker has loaded the model. (Raises the error
+    # if loading failed)
+    def waitUntilLoaded(self):
+        while self.loadError is None:
+            # (A worker that was restarted is a new PoolWorker, so the
+            # workers are checked again each time)
+            with self.lock:
+                waiting = [x for x in self.workers if not x.ready.is_set()]
+            if len(waiting) == 0:
+                return
+            waiting[0].ready.wait(0.1)
+
+        raise RuntimeError("Failed to load the model") from self.loadError
+
+    # Stops the workers once the requests they have are done.
+    def close(self):
+        with self.lock:
+            self.closing = True
+            workers = list(self.workers)
+
+        for worker in workers:
+            try:
+                with worker.sendLock:
+                    worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+
+        for worker in workers:
+            worker.process.join()
+            worker.reader.join()
+
+    def _submit(self, method: str, args: tuple, settings: dict):
+        request = PoolRequest(method, args, settings)
+        request.future.set_running_or_notify_cancel()
+        self._send(request)
+
+        return request
+
+    # Starts a worker process, and the thread that reads its results.
+    # (Has to be called with self.lock held)
+    def _startWorker(self, index: int):
+        parentConn, childConn = self.context.Pipe()
+        process = self.context.Process(target=workerMain,
+                                       args=(childConn, ) + self.workerArgs,
+                                       daemon=True)
+
+        # Keep the workers from fighting over the cores. (Unless the
+        # limits were already set)
+        added = [x for x in THREAD_VARIABLES if x not in os.environ]
+        for name in added:
+            os.environ[name] = str(self.threadsPerWorker)
+        try:
+            process.start()
+        finally:
+            for name in added:
+                del os.environ[name]
+
+        # Only the worker uses its end of the pipe. (Closing it here means
+        # reading gets an EOFError if the worker dies)
+        childConn.close()
+
+        worker = PoolWorker(index, process, parentConn)
+        worker.reader = threading.Thread(target=self._reader,
+                                         args=(worker, ),
+                                         daemon=True)
+        worker.reader.start()
+        return worker
+
+    # Picks the worker for the next request. (Has to be called with
+    # self.lock held)
+    def _pickWorker(self):
+        numWorkers = len(self.workers)
+        start = self.nextWorker % numWorkers
+        self.nextWorker += 1
+
+        # Starting from the next worker in turn, so ties are spread out.
+        order = self.workers[start:] + self.workers[:start]
+        if self.dispatch == 'round-robin':
+            return order[0]
+        return min(order, key=lambda x: len(x.inFlight))
+
+    def _send(self, request: PoolRequest):
+        with self.lock:
+            if self.closing:
+                error = RuntimeError("The inference pool is closed")
+            elif self.loadError is not None:
+                error = RuntimeError("Failed to load the model")
+            else:
+                error = None
+                worker = self._pickWorker()
+                requestId = self.nextRequestId
+                self.nextRequestId += 1
+                worker.inFlight[requestId] = request
+                request.attempts += 1
+
+        if error is not None:
+            request.future.set_exception(error)
+            return
+
+        try:
+            message = ForkingPickler.dumps(
+                (requestId, request.method, request.args, request.settings))
+        except Exception as e:
+            # The request can't be sent. (Unless the worker died, and
+            # _workerStopped already took it to send again)
+            with self.lock:
+                request = worker.inFlight.pop(requestId, None)
+            if request is not None:
+                request.future.set_exception(e)
+            return
+
+        # If the worker died the request gets sent again by _workerStopped.
+        try:
+            with worker.sendLock:
+                worker.conn.send_bytes(message)
+        except (OSError, ValueError):
+            pass
+
+    # Reads results from a worker until it stops.
+    def _reader(self, worker: PoolWorker):
+        while True:
+            try:
+                requestId, ok, result = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            # The worker has loaded the model (or failed to).
+            if requestId is None:
+                if not ok:
+                    self.loadError = result
+                worker.ready.set()
+                continue
+
+            with self.lock:
+                request = worker.inFlight.pop(requestId, None)
+            if request is None:
+                continue
+
+            if ok:
+                result, request.stats = result
+                if request.stats is not None:
+                    request.stats['waitSeconds'] = (
+                        time.perf_counter() - request.submitTime -
+                        request.stats['modelSeconds'] -
+                        request.stats['decodeSeconds'])
+                request.future.set_result(result)
+            else:
+                request.future.set_exception(result)
+
+        self._workerStopped(worker)
+
+    # Restarts a worker that stopped without being told to, and sends
+    # its requests again. (Unless it stopped before it loaded the model)
+    def _workerStopped(self, worker: PoolWorker):
+        worker.process.join()
+        worker.conn.close()
+
+        with self.lock:
+            requests = list(worker.inFlight.values())
+            worker.inFlight.clear()
+
+            if (not worker.ready.is_set() and not self.closing
+                    and self.loadError is None):
+                self.loadError = RuntimeError(
+                    "Inference worker stopped while loading the model "
+                    "(exit code {})".format(worker.process.exitcode))
+            worker.ready.set()
+
+            restart = not self.closing and self.loadError is None
+            if restart:
+                self.restarts += 1
+                self.workers[worker.index] = self._startWorker(worker.index)
+
+        for request in requests:
+            if restart and request.attempts < MAX_ATTEMPTS:
+                self._send(request)
+            else:
+                request.future.set_exception(
+                    RuntimeError(
+                        "Inference worker stopped (exit code {})".format(
+                            worker.process.exitcode)))
+
+
+# Runs in each worker process. Loads the model, and then runs requests
+# from 'conn' until it gets None.
+def workerMain(conn, modelDir: str, modelName: str, backend: str,
+               allowGpu: bool):
+    try:
+        modelManager = ModelManager(modelDir,
+                                    modelName,
+                                    allowGpu=allowGpu,
+                                    backend=backend)
+    except Exception as e:
+        sendResult(conn, None, False, e)
+        return
+    sendResult(conn, None, True, None)
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        requestId, method, args, settings = message
+        try:
+            result = getattr(modelManager, method)(*args, **settings)
+        except Exception as e:
+            sendResult(conn, requestId, False, e)
+            continue
+        sendResult(conn, requestId, True,
+                   (result, modelManager.getLastStats()))
+
+
+def sendResult(conn, requestId, ok: bool, result):
+    try:
+        conn.send((requestId, ok, result))
+    except Exception:
+        if ok:
+            raise
+        # The error can't be pickled, so just send what it says.
+        conn.send((requestId, False, RuntimeError(repr(result))))
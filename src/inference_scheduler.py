@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# Lets several games share one ModelManager by batching their requests.
+#
+# Requests can be submitted from any number of threads. A worker thread
+# waits up to 'maxWait' seconds after the first request for more to
+# show up, and then runs everything it got in as few batched sess.run
+# calls as it can. Each request gets a 'concurrent.futures.Future' back.
+# (Coroutines can use 'asyncio.wrap_future' on it)
+#
+# Requests are sorted by the length of their context (after the oldest
+# tokens are cut to fit the context budget, like ModelManager does), and
+# contexts that are at most 'maxPadding' tokens shorter than the longest
+# one in a batch are padded to fit. The padding is masked, so it doesn't
+# change a request's result. If the backend can't pad (see
+# ModelManager.canPadBatches) only requests with exactly the same length
+# are batched.
+#
+# Since InferenceScheduler has the same 'enc', 'encode', 'tokenizerId',
+# 'modelId', 'getContextBudget', 'getSampleFromText', 'getSamplesFromText',
+# 'getSamplesFromTokens' and 'getLastStats' as ModelManager it can be
+# passed to Game in its place. (It can't stream, so Game shows each
+# response once it's done)
+import concurrent.futures
+import queue
+import threading
+import time
+
+from .model_manager import ModelManager
+
+
+class InferenceRequest:
+    def __init__(self, tokens: list, numSamples: int, settings: dict):
+        self.tokens = tokens
+        self.numSamples = numSamples
+        self.settings = settings
+        self.future = concurrent.futures.Future()
+        self.submitTime = time.perf_counter()
+        # The model's stats for the request. (See getLastStats)
+        self.stats = None
+
+
+class InferenceScheduler:
+    def __init__(self,
+                 modelManager: ModelManager,
+                 maxBatchSize: int = 8,
+                 maxWait: float = 0.01,
+                 maxPadding: int = 64):
+        self.modelManager = modelManager
+        self.enc = modelManager.enc
+        self.tokenizerId = modelManager.tokenizerId
+        self.modelId = modelManager.modelId
+        self.getContextBudget = modelManager.getContextBudget
+        self.encode = modelManager.encode
+        self.maxBatchSize = max(1, maxBatchSize)
+        self.maxWait = maxWait
+        self.maxPadding = 0
+        if modelManager.canPadBatches():
+            self.maxPadding = max(0, maxPadding)
+
+        self.requests = queue.Queue()
+        self.threadStats = threading.local()
+
+        self.worker = threading.Thread(target=self._worker, daemon=True)
+        self.worker.start()
+
+    # Queues 'text' and returns a Future for a list of 'numSamples' samples.
+    # ('settings' are the same as ModelManager.getSamplesFromText)
+    def submit(self, text: str, numSamples: int = 1, **settings):
+        return self.submitTokens(self.enc.encode(text), numSamples, **settings)
+
+    # Same as submit, but for text that is already tokens.
+    def submitTokens(self, tokens: list, numSamples: int = 1, **settings):
+        return self._queueRequest(tokens, numSamples, settings).future
+
+    def getSampleFromText(self, inputStr: str, **settings):
+        return self.getSamplesFromText(inputStr, 1, **settings)[0]
+
+    def getSamplesFromText(self, inputStr: str, numSamples: int, **settings):
+        return self.submit(inputStr, numSamples, **settings).result()
+
+    # (A request can't be stopped once it's sent, so 'stop' isn't used)
+    def getSamplesFromTokens(self,
+                             contextTokens: list,
+                             numSamples: int,
+                             stop=None,
+                             **settings):
+        request = self._queueRequest(contextTokens, numSamples, settings)
+        result = request.future.result()
+        self.threadStats.last = request.stats
+
+        return result
+
+    # Same as ModelManager.getLastStats, but 'waitSeconds' includes the
+    # time the request was queued. (If the request was batched, the times
+    # are for the whole batch, and it has 'batchSize')
+    def getLastStats(self):
+        return getattr(self.threadStats, 'last', None)
+
+    # Stops the worker thread once the queued requests are done.
+    def close(self):
+        self.requests.put(None)
+        self.worker.join()
+
+    def _queueRequest(self, tokens: list, numSamples: int, settings: dict):
+        request = InferenceRequest(tokens, numSamples, settings)
+        self.requests.put(request)
+
+        return request
+
+    # Length of a request's context once it's cut to the context budget.
+    def _contextLength(self, request: InferenceRequest):
+        budget = self.getContextBudget(request.settings.get('length'))
+        return min(len(request.tokens), budget)
+
+    # Waits for the first request, then collects whatever else shows up
+    # within 'maxWait' seconds. (Returns None once 'close' is called)
+    def _collectRequests(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.maxWait
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Put it back so the worker stops after this batch.
+                self.requests.put(None)
+                break
+            batch.append(request)
+
+        return batch
+
+    def _runGroup(self, requests: list, numSamples: int, settings: dict):
+        start = time.perf_counter()
+        try:
+            if len(requests) == 1:
+                # Nothing to batch with, so use the normal path which
+                # can reuse the attention cache.
+                request = requests[0]
+                results = [
+                    self.modelManager.getSamplesFromTokens(
+                        request.tokens, numSamples, **settings)
+                ]
+            else:
+                contexts = [x.tokens for x in requests]
+                results = self.modelManager.getSamplesFromTokenBatch(
+                    contexts, numSamples, **settings)
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+
+        stats = self.modelManager.getLastStats()
+        for request, result in zip(requests, results):
+            request.stats = dict(stats)
+            request.stats['waitSeconds'] += start - request.submitTime
+            if len(requests) > 1:
+                request.stats['contextTokens'] = self._contextLength(request)
+                request.stats['newTokens'] = request.stats['contextTokens']
+                request.stats['generatedTokens'] //= len(requests)
+            request.future.set_result(result)
+
+    def _worker(self):
+        while True:
+            batch = self._collectRequests()
+            if batch is None:
+                return
+
+            # Group the requests that can run in the same batch.
+            groups = {}
+            for request in batch:
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                key = (request.numSamples,
+                       tuple(sorted(request.settings.items())))
+                groups.setdefault(key, []).append(request)
+
+            for (numSamples, settings), requests in groups.items():
+                for batchRequests in self._splitByLength(requests):
+                    self._runGroup(batchRequests, numSamples, dict(settings))
+
+    # Splits 'requests' into batches of requests with contexts that are
+    # close enough in length to be padded. (From the longest to the
+    # shortest, so the longest context is the first of its batch)
+    def _splitByLength(self, requests: list):
+        requests = sorted(requests, key=self._contextLength, reverse=True)
+
+        batches = []
+        for request in requests:
+            if len(batches) > 0:
+                batch = batches[-1]
+                padding = (self._contextLength(batch[0]) -
+                           self._contextLength(request))
+                if (len(batch) < self.maxBatchSize
+                        and padding <= self.maxPadding):
+                    batch.append(request)
+                    continue
+            batches.append([request])
+
+        return batches
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+Checks that 'src/action_translator.py' turns player input into the same
+action text as the regex version 'Game.prepareAction' used to have, and
+times both on short and long (pasted) inputs.
+
+The old version is copied below. Its '?' and '!' replacements left a '\\'
+in front of the punctuation, so that is removed from its output before
+comparing.
+
+The inputs are a list of sentences with the odd cases (quotes, "I was",
+repeated words, ...) and random sentences made from the mapped words.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import action_translator
+
+
+# The old version, from 'src/game.py'.
+def legacyPrepareAction(actionText):
+    # Stuff for translating first person to second person
+    # Pulled from...
+    # https://github.com/Latitude-Archives/AIDungeon/blob/develop/story/utils.py
+
+    # Capitalizing the first word in every sentence.
+    def capitalizeFirstLetters(text):
+        def capitalizeHelper(string):
+            stringList = list(string)
+            stringList[0] = stringList[0].upper()
+            return "".join(stringList)
+
+        firstLettersRegex = re.compile(r"((?<=[\.\?!]\s)(\w+)|(^\w+))")
+
+        def cap(match):
+            return capitalizeHelper(match.group())
+
+        result = firstLettersRegex.sub(cap, text)
+        return result
+
+    # Simply capitalize the first letter in a word.
+    def capitalize(word):
+        return word[0].upper() + word[1:]
+
+    # Generates variations of firstToSecondMappings
+    def mappingVariationPairs(mapping: tuple):
+        mappingList = []
+        mappingList.append((" " + mapping[0] + " ", " " + mapping[1] + " "))
+        mappingList.append((" " + capitalize(mapping[0]) + " ",
+                            " " + capitalize(mapping[1]) + " "))
+
+        # Change you before punctuation
+        if mapping[0] == "you":
+            mapping = ("you", "me")
+        mappingList.append((" " + mapping[0] + ",", " " + mapping[1] + ","))
+        mappingList.append(
+            (" " + mapping[0] + "\\?", " " + mapping[1] + "\\?"))
+        mappingList.append(
+            (" " + mapping[0] + "\\!", " " + mapping[1] + "\\!"))
+        mappingList.append((" " + mapping[0] + "\\.", " " + mapping[1] + "."))
+
+        return mappingList
+
+    # Replace text, but only outside of quotations
+    def replaceOutsideQuotes(text, currentWord, replWord):
+        regExpr = re.compile(currentWord + '(?=([^"]*"[^"]*")*[^"]*$)')
+
+        output = regExpr.sub(replWord, text)
+        return output
+
+    firstToSecondMappings = [
+        ("I'm", "you're"),
+        ("Im", "you're"),
+        ("Ive", "you've"),
+        ("I am", "you are"),
+        ("was I", "were you"),
+        ("am I", "are you"),
+        ("wasn't I", "weren't you"),
+        ("I", "you"),
+        ("I'd", "you'd"),
+        ("i", "you"),
+        ("I've", "you've"),
+        ("was I", "were you"),
+        ("am I", "are you"),
+        ("wasn't I", "weren't you"),
+        ("I", "you"),
+        ("I'd", "you'd"),
+        ("i", "you"),
+        ("I've", "you've"),
+        ("I was", "you were"),
+        ("my", "your"),
+        ("we", "you"),
+        ("we're", "you're"),
+        ("mine", "yours"),
+        ("me", "you"),
+        ("us", "you"),
+        ("our", "your"),
+        ("I'll", "you'll"),
+        ("myself", "yourself"),
+    ]
+
+    # Lets first remove any whitespace
+    actionText = actionText.strip()
+
+    # Check if the input is dialogue
+    if actionText[0] == '"':
+        actionText = "You say, " + actionText
+    else:
+        # If not add 'You' if needed.
+        if "you" not in actionText[:6].lower() and "I" not in actionText[:6]:
+            actionText = actionText[0].lower() + actionText[1:]
+            actionText = "You " + actionText
+
+        # Make sure we add punctuation
+        if actionText[-1] not in [".", "?", "!"]:
+            actionText = actionText + "."
+
+    # Translate first person text into second person text.
+    actionText = " " + actionText
+    for pair in firstToSecondMappings:
+        variations = mappingVariationPairs(pair)
+        for variation in variations:
+            actionText = replaceOutsideQuotes(actionText, variation[0],
+                                              variation[1])
+
+    actionText = actionText.strip()
+    actionText = capitalizeFirstLetters(actionText)
+
+    return actionText
+
+
+# Inputs with the odd cases of the old version.
+GOLDEN_INPUTS = [
+    "I open the door",
+    "open the door",
+    "I was there",
+    "was I there?",
+    "where am I?",
+    "where am I",
+    "I am the king!",
+    "was I am here",
+    "wasn't I the one, I think",
+    "I I I I",
+    "hit me me me",
+    "me my mine myself",
+    "I'm here and Im there and Ive been",
+    "I'd go, I've gone, I'll go",
+    "we're going and we went",
+    "We go with our friends",
+    "My sword is mine.",
+    "Me, myself and I",
+    "tell us about it",
+    "i think i can",
+    "I say \"I am the king\" and I leave",
+    "\"I am the king\"",
+    "\"hello",
+    "I say \"hello and I leave",
+    "I say \"a\" and \"b\" to me",
+    "I shout \"me!\" at me!",
+    "Am I dead? I am not. I was!",
+    "you and I",
+    "You look at me",
+    "I look at you",
+    "ask them about us, me, my, and our things.",
+    "I swing my sword at the dragon. I then run away",
+    "   I walk   slowly  ",
+    "continue",
+    "x",
+    "I",
+    "Ivan and Imogen meet me",
+]
+
+# Words used to make random inputs.
+RANDOM_WORDS = [
+    "I", "i", "I'm", "Im", "Ive", "I've", "I'd", "I'll", "am", "was", "wasn't",
+    "my", "My", "we", "We", "we're", "mine", "me", "Me", "us", "our", "myself",
+    "Was", "Am", "Wasn't", "We're", "Mine", "Us", "Our", "Myself", "you",
+    "the", "door", "open", "go", "king", "sword", "\"", "\"hello", "there\"",
+    ",", ".", "?", "!"
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check and time the action translator.")
+    parser.add_argument("--random",
+                        type=int,
+                        default=5000,
+                        help="Number of random inputs to check.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lengths",
+                        default="100,1000,5000,20000",
+                        help="Comma separated lengths (in characters) of "
+                        "the inputs to time.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    inputs = GOLDEN_INPUTS + [randomInput(rng) for i in range(args.random)]
+    mismatches = 0
+    for text in inputs:
+        old = legacyPrepareAction(text).replace("\\?", "?").replace("\\!", "!")
+        new = action_translator.prepareAction.__wrapped__(text)
+        if old != new:
+            mismatches += 1
+            if mismatches <= 10:
+                print("Different: {!r}\n  old: {!r}\n  new: {!r}".format(
+                    text, old, new))
+    print("{} inputs checked, {} different".format(len(inputs), mismatches))
+
+    print("{:>8} {:>12} {:>12} {:>8}".format("length", "old", "new",
+                                             "speedup"))
+    for length in [int(x) for x in args.lengths.split(",")]:
+        text = pastedInput(length)
+        oldSeconds = timeCall(legacyPrepareAction, text)
+        newSeconds = timeCall(action_translator.prepareAction.__wrapped__,
+                              text)
+        print("{:>8} {:>10.2f}ms {:>10.3f}ms {:>7.0f}x".format(
+            length, oldSeconds * 1000, newSeconds * 1000,
+            oldSeconds / newSeconds))
+
+    if mismatches > 0:
+        sys.exit(1)
+
+
+def randomInput(rng: random.Random):
+    words = [rng.choice(RANDOM_WORDS) for i in range(rng.randint(1, 12))]
+    # (Punctuation is usually stuck to the word before it)
+    text = ""
+    for word in words:
+        if word in (",", ".", "?", "!") or rng.random() < 0.1:
+            text += word
+        else:
+            text += " " + word
+    if text.strip() == "":
+        return "I"
+    return text
+
+
+# The golden inputs joined together, like a long pasted paragraph.
+def pastedInput(length: int):
+    text = ""
+    i = 0
+    while len(text) < length:
+        sentence = GOLDEN_INPUTS[i % len(GOLDEN_INPUTS)].strip()
+        if sentence[-1] not in ".?!":
+            sentence += "."
+        text += sentence + " "
+        i += 1
+    return text[:length].strip()
+
+
+# Average seconds per call. (Repeated for at least 0.2 seconds)
+def timeCall(function, text: str):
+    calls = 0
+    start = time.perf_counter()
+    while calls == 0 or time.perf_counter() - start < 0.2:
+        function(text)
+        calls += 1
+    return (time.perf_counter() - start) / calls
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Compares 'src/fast_encoder.py' with the BPE encoder from gpt-2.
+
+Encodes the game transcripts and the storyDatabase prompts with both
+encoders, checks that they give the same tokens, and prints how long
+each one took.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from gpt_2.src import encoder
+from src import fast_encoder
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the fast BPE encoder against gpt-2's.")
+    parser.add_argument("--model-dir",
+                        dest="modelDir",
+                        default=os.path.join(ROOT_DIR, "gpt2-model"),
+                        help="Directory with the models.")
+    parser.add_argument("--model-name",
+                        dest="modelName",
+                        default="rpg_model",
+                        help="Model with the 'encoder.json' and 'vocab.bpe'.")
+    parser.add_argument("--data-dir",
+                        dest="dataDir",
+                        default=os.path.join(ROOT_DIR, "game_data"),
+                        help="Directory with 'storyDatabase.json' and "
+                        "the 'transcripts' folder.")
+    parser.add_argument("-r",
+                        "--repeat",
+                        type=int,
+                        default=3,
+                        help="Number of times to encode everything.")
+    args = parser.parse_args()
+
+    texts = getTexts(args.dataDir)
+    numChars = sum([len(x) for x in texts])
+    print("Texts:", len(texts), "Characters:", numChars)
+
+    encoders = [
+        ("gpt-2", encoder.get_encoder(args.modelName, args.modelDir)),
+        ("fast", fast_encoder.get_encoder(args.modelName, args.modelDir)),
+    ]
+
+    results = {}
+    for name, enc in encoders:
+        # The first run starts with an empty cache.
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tokens = [enc.encode(text) for text in texts]
+            times.append(time.perf_counter() - start)
+        results[name] = tokens
+
+        print("{:>6}: first run {:.3f}s, best run {:.3f}s ({:.0f} chars/s)".
+              format(name, times[0], min(times), numChars / min(times)))
+
+    fastEnc = encoders[1][1]
+    start = time.perf_counter()
+    fastEnc.encode_many(texts)
+    print("encode_many: {:.3f}s".format(time.perf_counter() - start))
+
+    # Check that both give the exact same tokens (and decode the same).
+    mismatches = 0
+    for text, oldTokens, newTokens in zip(texts, results["gpt-2"],
+                                          results["fast"]):
+        if oldTokens != newTokens or fastEnc.decode(newTokens) != text:
+            mismatches += 1
+            if mismatches <= 5:
+                print("Mismatch:", repr(text[:60]))
+
+    if mismatches > 0:
+        print(mismatches, "texts did not match!")
+        return 1
+
+    print("All tokens match.")
+    return 0
+
+
+# The text of every transcript, and every prompt in the story database.
+def getTexts(dataDir: str):
+    texts = []
+
+    for transcript in glob.glob(os.path.join(dataDir, "transcripts", "*")):
+        if os.path.isfile(transcript):
+            with open(transcript, "r", errors="replace") as f:
+                texts.append(f.read())
+
+    storyJSON = os.path.join(dataDir, "storyDatabase.json")
+    with open(storyJSON, "r") as f:
+        storyDatabase = json.load(f)
+
+    for genre, classes in storyDatabase.items():
+        for charClass, classDatabase in classes.items():
+            for prompt in classDatabase["prompt"]:
+                for item1 in classDatabase["item1"]:
+                    for item2 in classDatabase["item2"]:
+                        text = "You are Craig, a " + charClass + ". "
+                        text += "You have a " + item1 + " and a " + item2
+                        text += ".\n\n" + prompt
+                        texts.append(text)
+
+    return texts
+
+
+if __name__ == "__main__":
+    sys.exit(main())
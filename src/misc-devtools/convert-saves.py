@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Converts the saves in 'game_data/saves' from the old JSON format to the
+compressed one in 'src/save_format.py'. ('<name>.json' is replaced by
+'<name>.save')
+
+The game still loads the old saves (and converts them the next time they
+are saved), so this is only needed to shrink the existing saves at once.
+Each save is loaded with its journal, and only written again if the new
+format reads back the same. Saves that are already converted are skipped.
+"""
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import save_format, story_manager
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert the saves to the compressed save format.")
+    parser.add_argument("--saves-dir",
+                        dest="savesDir",
+                        default=os.path.join(ROOT_DIR, "game_data", "saves"),
+                        help="Directory with the saves.")
+    parser.add_argument("--dry-run",
+                        dest="dryRun",
+                        action="store_true",
+                        help="Only list the saves that would be converted.")
+    args = parser.parse_args()
+
+    saves = sorted(x for x in os.listdir(args.savesDir)
+                   if save_format.isStoryFile(x))
+    oldTotal = 0
+    newTotal = 0
+    for name in saves:
+        filePath = os.path.join(args.savesDir, name)
+        if not save_format.isOldFormat(filePath):
+            continue
+        if args.dryRun:
+            print(name)
+            continue
+
+        oldSize = fileSize(filePath)
+        newPath = convertSave(filePath)
+        newSize = fileSize(newPath)
+        oldTotal += oldSize
+        newTotal += newSize
+        print("{} -> {}: {:.1f}KB -> {:.1f}KB".format(
+            name, os.path.basename(newPath), oldSize / 1e3, newSize / 1e3))
+
+    if newTotal > 0:
+        print("Total: {:.1f}KB -> {:.1f}KB ({:.1f}x smaller)".format(
+            oldTotal / 1e3, newTotal / 1e3, oldTotal / newTotal))
+
+
+# Size of a save and its journal.
+def fileSize(filePath: str):
+    size = os.path.getsize(filePath)
+    if os.path.isfile(filePath + ".journal"):
+        size += os.path.getsize(filePath + ".journal")
+    return size
+
+
+# Returns the path of the converted save.
+def convertSave(filePath: str):
+    manager = story_manager.StoryManager(os.path.basename(filePath),
+                                         os.path.dirname(filePath))
+    storyDict = manager.getStoryDict()
+    data = save_format.encodeStory(storyDict)
+    if save_format.decodeStory(data) != storyDict:
+        raise RuntimeError("{} would change if converted".format(filePath))
+
+    # (Also empties the journal, the new file includes it, and removes the
+    # old file)
+    manager.saveStory()
+    manager.flush()
+    return manager.storyFile
+
+
+if __name__ == "__main__":
+    main()
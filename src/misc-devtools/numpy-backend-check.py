@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Checks that 'src/numpy_backend.py' gives the same logits as gpt-2's
+TensorFlow model.
+
+Makes a small randomly initialized checkpoint (or uses '--model-dir'),
+runs the same tokens through both, and compares the logits for a whole
+context and for tokens fed one at a time after an attention cache.
+Then times sampling with both backends.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import model_manager, numpy_backend, tf_backend
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the NumPy backend with TensorFlow.")
+    parser.add_argument("--model-dir",
+                        dest="modelDir",
+                        help="Directory with a checkpoint and 'hparams.json'. "
+                        "(Default is a new random checkpoint)")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=1e-3,
+                        help="Max allowed difference between the logits.")
+    parser.add_argument("--context",
+                        type=int,
+                        default=64,
+                        help="Number of context tokens.")
+    args = parser.parse_args()
+
+    tf_backend.importTensorflow()
+    tf = tf_backend.tf
+    model = tf_backend.model
+
+    modelDir = args.modelDir
+    if modelDir is None:
+        modelDir = tempfile.mkdtemp()
+        makeRandomCheckpoint(modelDir)
+        print("Random checkpoint:", modelDir)
+
+    with open(os.path.join(modelDir, "hparams.json")) as f:
+        hparams = model_manager.HParams(json.load(f))
+
+    settings = {
+        'temperature': 1.0,
+        'topK': 40,
+        'topP': 0.0,
+        'length': 40,
+        'maxSentences': 0
+    }
+
+    # Nothing is a stop or sentence token, so sampling always
+    # generates 'length' tokens.
+    noTokens = np.zeros(hparams.n_vocab, dtype=bool)
+    backends = {}
+    for name in model_manager.BACKENDS:
+        backendClass = model_manager.getBackend(name)
+        backends[name] = backendClass(hparams=hparams,
+                                      modelPath=modelDir,
+                                      stopTokens=noTokens,
+                                      sentenceTokens=noTokens,
+                                      settings=settings,
+                                      allowGpu=False)
+        backends[name].load(lambda stage: None)
+
+    tfBackend = backends['tensorflow']
+    npBackend = backends['numpy']
+
+    # The logits straight from gpt-2's model.
+    with tfBackend.graph.as_default():
+        tokensInput = tf.placeholder(tf.int32, [None, None])
+        pastInput = tf.placeholder(tf.float32,
+                                   model.past_shape(hparams=tfBackend.hparams))
+        lmOutput = model.model(hparams=tfBackend.hparams,
+                               X=tokensInput,
+                               past=pastInput,
+                               reuse=True)
+
+    def tfLogits(tokens, past):
+        return tfBackend.sess.run([lmOutput['logits'], lmOutput['present']],
+                                  feed_dict={
+                                      tokensInput: tokens,
+                                      pastInput: past
+                                  })
+
+    rng = np.random.default_rng(0)
+    tokens = rng.integers(0, hparams.n_vocab, size=(2, args.context))
+    emptyPast = np.zeros(npBackend.pastShape(2, 0), dtype=np.float32)
+
+    failed = False
+
+    # The whole context at once.
+    tfOut, tfPresent = tfLogits(tokens, emptyPast)
+    cache = np.zeros(npBackend.pastShape(2, args.context), dtype=np.float32)
+    npOut = npBackend.forward(tokens, cache, 0)
+    failed |= not report("Context logits", tfOut, npOut, args.tolerance)
+    failed |= not report("Attention cache", tfPresent, cache, args.tolerance)
+
+    # The last few tokens one at a time, after the cache of the rest.
+    split = args.context - 4
+    past = tfLogits(tokens[:, :split], emptyPast)[1]
+    cache = np.zeros(npBackend.pastShape(2, args.context), dtype=np.float32)
+    npBackend.forward(tokens[:, :split], cache, 0)
+    for i in range(split, args.context):
+        tfOut, present = tfLogits(tokens[:, i:i + 1], past)
+        past = np.concatenate([past, present], axis=-2)
+        npOut = npBackend.forward(tokens[:, i:i + 1], cache, i)
+        failed |= not report("Cached logits {}".format(i), tfOut, npOut,
+                             args.tolerance)
+
+    # Top-k and top-p filtering.
+    logits = rng.normal(size=(4, hparams.n_vocab)).astype(np.float32)
+    with tfBackend.graph.as_default():
+        logitsInput = tf.constant(logits)
+        filtered = tfBackend.sess.run([
+            tf_backend.topKLogits(logitsInput, tf.constant(40)),
+            tf_backend.topPLogits(logitsInput, tf.constant(0.9))
+        ])
+    failed |= not report("Top-k", filtered[0],
+                         numpy_backend.topKLogits(logits, 40), 0)
+    failed |= not report("Top-p", filtered[1],
+                         numpy_backend.topPLogits(logits, 0.9), 0)
+
+    # Sampling speed.
+    for name, backend in backends.items():
+        backend.sample(tokens[:1].tolist(), emptyPast[:1], 3, settings)
+        start = time.perf_counter()
+        out, _ = backend.sample(tokens[:1].tolist(), emptyPast[:1], 3,
+                                settings)
+        print("{:>10}: {} tokens in {:.3f}s".format(
+            name, out.size,
+            time.perf_counter() - start))
+
+    if failed:
+        print("The backends don't match!")
+        return 1
+
+    print("The backends match.")
+    return 0
+
+
+# Prints the biggest difference between 'a' and 'b', and returns True if
+# it's within 'tolerance'.
+def report(name: str, a, b, tolerance: float):
+    difference = float(np.max(np.abs(np.asarray(a) - np.asarray(b))))
+    ok = difference <= tolerance
+    print("{}: max difference {:.2e} {}".format(name, difference,
+                                                "ok" if ok else "FAILED"))
+    return ok
+
+
+# Saves a small gpt-2 model with random weights to 'modelDir'.
+def makeRandomCheckpoint(modelDir: str):
+    tf = tf_backend.tf
+    model = tf_backend.model
+
+    hparamsValues = {
+        'n_vocab': 500,
+        'n_ctx': 128,
+        'n_embd': 64,
+        'n_head': 4,
+        'n_layer': 3
+    }
+    with open(os.path.join(modelDir, "hparams.json"), "w") as f:
+        json.dump(hparamsValues, f)
+
+    hparams = model.default_hparams()
+    hparams.override_from_dict(hparamsValues)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        model.model(hparams=hparams, X=tf.zeros([1, 1], dtype=tf.int32))
+
+        # Random norm and bias weights too, so they get checked.
+        variables = tf.trainable_variables()
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for variable in variables:
+                shape = variable.shape.as_list()
+                value = np.random.normal(scale=0.1, size=shape)
+                if variable.name.split("/")[-1].startswith("g"):
+                    value += 1
+                sess.run(variable.assign(value.astype(np.float32)))
+
+            saver = tf.train.Saver(variables)
+            saver.save(sess, os.path.join(modelDir, "model"), global_step=1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Measures how generation throughput scales with the number of workers in
+'src/inference_pool.py'.
+
+Sends the same set of requests to an InferencePool with each number of
+workers in '--workers' (all at once, like several players would), and
+prints the requests per second and the per-worker load.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import inference_pool, model_manager
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the multi-process inference pool.")
+    parser.add_argument("--model-dir",
+                        dest="modelDir",
+                        default=os.path.join(ROOT_DIR, "gpt2-model"),
+                        help="Directory with the models.")
+    parser.add_argument("--model-name",
+                        dest="modelName",
+                        default="rpg_model",
+                        help="Model to load.")
+    parser.add_argument("--backend",
+                        choices=list(model_manager.BACKENDS.keys()),
+                        default="numpy",
+                        help="Backend each worker uses.")
+    parser.add_argument("--workers",
+                        default="1,2,4",
+                        help="Comma separated numbers of workers to try.")
+    parser.add_argument("--dispatch",
+                        choices=inference_pool.DISPATCH,
+                        default="least-loaded")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=24,
+                        help="Number of requests sent to each pool.")
+    parser.add_argument("--length",
+                        type=int,
+                        default=40,
+                        help="Number of tokens generated per request.")
+    args = parser.parse_args()
+
+    prompts = [
+        "You are Craig, a knight. You have a sword and a shield.\n\n"
+        "You are on your way to the town of Ironwood {}.\n> You look "
+        "around.\n".format(i) for i in range(args.requests)
+    ]
+
+    print("Default pool size:", inference_pool.defaultPoolSize())
+    for numWorkers in [int(x) for x in args.workers.split(",")]:
+        pool = inference_pool.InferencePool(args.modelDir,
+                                            args.modelName,
+                                            numWorkers=numWorkers,
+                                            backend=args.backend,
+                                            dispatch=args.dispatch)
+        pool.waitUntilLoaded()
+
+        # One request per worker first, so nothing is timed cold.
+        warmup = [pool.submit(x, 1, length=2) for x in prompts[:numWorkers]]
+        for future in warmup:
+            future.result()
+
+        start = time.perf_counter()
+        futures = [
+            pool.submit(x, 3, length=args.length, maxSentences=0)
+            for x in prompts
+        ]
+        loads = pool.getLoads()
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+
+        print(
+            "{} workers: {:.2f} requests/s ({:.2f}s) loads at start {}".format(
+                numWorkers, args.requests / elapsed, elapsed, loads))
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Compares the old story file format (indented JSON with a copy of each
+action in every list) with the one in 'src/save_format.py'.
+
+Builds long stories with 'src/story_manager.py', and prints the file size
+and the time to write and to load each one in both formats. (Loading is
+timed with StoryManager, so it includes setting up the actions)
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import save_format, story_manager
+from src.save_writer import writeFile
+
+
+# Stands in for the BPE encoder. (One token per word, with gpt-2 sized ids)
+class WordEncoder:
+    def encode(self, text: str):
+        return [random.Random(x).randrange(50257) for x in text.split(" ")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the old and new story file formats.")
+    parser.add_argument("--turns",
+                        default="1000,5000",
+                        help="Comma separated story lengths to try.")
+    parser.add_argument("--remembered",
+                        type=int,
+                        default=100,
+                        help="Number of remembered actions in each story.")
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=5,
+                        help="Number of times each operation is timed.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print("{:>6} {:>6} {:>10} {:>10} {:>10}".format("turns", "format", "size",
+                                                    "save", "load"))
+    for numTurns in [int(x) for x in args.turns.split(",")]:
+        storyDict = makeStory(numTurns, args.remembered)
+        formats = (
+            ("json", lambda: json.dumps(storyDict, indent=2)),
+            ("zlib", lambda: save_format.encodeStory(storyDict, "zlib")),
+            ("lzma", lambda: save_format.encodeStory(storyDict, "lzma")),
+        )
+        for name, encode in formats:
+            extension = save_format.SAVE_EXTENSION
+            if name == "json":
+                extension = save_format.OLD_EXTENSION
+            filePath = os.path.join(directory, name + extension)
+
+            start = time.perf_counter()
+            for i in range(args.repeat):
+                writeFile('replace', filePath, encode())
+            saveSeconds = (time.perf_counter() - start) / args.repeat
+
+            start = time.perf_counter()
+            for i in range(args.repeat):
+                story_manager.StoryManager(os.path.basename(filePath),
+                                           directory)
+            loadSeconds = (time.perf_counter() - start) / args.repeat
+
+            print("{:>6} {:>6} {:>8.2f}MB {:>8.1f}ms {:>8.1f}ms".format(
+                numTurns, name,
+                os.path.getsize(filePath) / 1e6, saveSeconds * 1000,
+                loadSeconds * 1000))
+
+
+# The storyData of a story with 'numTurns' actions, 'numRemembered' of
+# them saved. (Like StoryManager.getStoryDict returns)
+def makeStory(numTurns: int, numRemembered: int):
+    manager = story_manager.StoryManager("story.save",
+                                         tempfile.mkdtemp(),
+                                         memorySize=15,
+                                         encoder=WordEncoder())
+    # (Only the finished story is written)
+    manager._record = lambda record: None
+
+    every = max(1, numTurns // max(1, numRemembered))
+    for i in range(numTurns):
+        action = manager.createAction(
+            "The AI wrote this part of the story, turn {}. ".format(i) * 4,
+            "You do thing number {}.".format(i))
+        if i % every == 0 and numRemembered > 0:
+            manager.saveAction(action)
+        manager.updateMemory(action)
+
+    return manager.getStoryDict()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+Checks how 'src/inference_scheduler.py' batches requests.
+
+Writes a tiny gpt-2 model with random weights (and a byte level
+vocabulary) to a temp directory, and sends requests to an
+InferenceScheduler from several threads at once...
+
+- Contexts longer than the context budget, which have to be cut like
+  ModelManager.getSamplesFromTokens does.
+- Contexts of different lengths, which are padded to share a batch.
+  Each request has to be run with its whole context, not cut to fit
+  the others, and (sampling greedily) has to get the same sample as it
+  would by itself.
+
+Then checks that every request got its samples, and prints how many
+requests per second the scheduler gets through with more and more
+threads sending them. (Without batching, with only contexts of the same
+length batched, and with padding)
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import (fast_encoder, flat_weights, inference_scheduler,
+                 model_manager)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check batching in the inference scheduler.")
+    parser.add_argument("--length",
+                        type=int,
+                        default=8,
+                        help="Tokens sampled for each request.")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=8,
+                        help="Requests sent by each thread when measuring "
+                        "throughput.")
+    parser.add_argument("--max-threads",
+                        dest="maxThreads",
+                        type=int,
+                        default=8,
+                        help="Most threads sending requests at once.")
+    args = parser.parse_args()
+
+    modelDir = tempfile.mkdtemp()
+    makeRandomModel(os.path.join(modelDir, "rpg_model"))
+    modelManager = model_manager.ModelManager(modelDir,
+                                              "rpg_model",
+                                              backend="numpy")
+    budget = modelManager.getContextBudget(args.length)
+    # Greedy sampling, so batched requests can be compared with the same
+    # requests run by themselves.
+    greedy = {'length': args.length, 'topK': 1, 'topP': 0.0, 'maxSentences': 0}
+
+    # Record the contexts of each batch the scheduler runs.
+    batches = []
+    runBatch = modelManager.getSamplesFromTokenBatch
+
+    def recordBatch(contexts, numSamples, **settings):
+        batches.append([list(x) for x in contexts])
+        return runBatch(contexts, numSamples, **settings)
+
+    modelManager.getSamplesFromTokenBatch = recordBatch
+
+    rng = np.random.default_rng(0)
+
+    def randomTokens(numTokens):
+        return rng.integers(0, 256, numTokens).tolist()
+
+    failed = False
+
+    # A batch of contexts that are too long.
+    longContexts = [randomTokens(modelManager.hparams.n_ctx - 4)] * 2
+    try:
+        modelManager.getSamplesFromTokenBatch(longContexts,
+                                              1,
+                                              length=args.length)
+        print("Long batch: ok")
+    except Exception as e:
+        print("Long batch: failed ({!r})".format(e))
+        failed = True
+
+    # Concurrent requests, too long, and with different lengths.
+    contexts = [randomTokens(budget + 36) for _ in range(3)]
+    contexts += [randomTokens(100), randomTokens(105), randomTokens(105)]
+    for numTokens in (100, 105):
+        contexts.append(contexts[-1][:numTokens])
+
+    # What each request gets by itself.
+    expected = [
+        modelManager.getSamplesFromTokens(x, 1, **greedy) for x in contexts
+    ]
+
+    batches.clear()
+    scheduler = inference_scheduler.InferenceScheduler(modelManager,
+                                                       maxWait=0.5)
+    futures = sendConcurrently(scheduler, contexts, 1, **greedy)
+
+    for i, future in enumerate(futures):
+        try:
+            samples = future.result()
+        except Exception as e:
+            print("Request {} ({} tokens): failed ({!r})".format(
+                i, len(contexts[i]), e))
+            failed = True
+            continue
+        if samples != expected[i]:
+            print("Request {} ({} tokens): got {!r} batched, but {!r} by "
+                  "itself".format(i, len(contexts[i]), samples, expected[i]))
+            failed = True
+    scheduler.close()
+
+    # Each batched context has to be one of the requests' whole context.
+    # (Only cut to the budget)
+    wholeContexts = [tuple(x[-budget:]) for x in contexts]
+    for batch in batches:
+        lengths = sorted(set(len(x[-budget:]) for x in batch))
+        print("Batch of {} with {} tokens".format(len(batch), lengths))
+        for context in batch:
+            if tuple(context[-budget:]) not in wholeContexts:
+                print("  A context was changed to fit the batch")
+                failed = True
+    if len(batches) == 0 or max(len(x) for x in batches) < 4:
+        print("The contexts weren't batched")
+        failed = True
+
+    # Throughput, with each thread sending requests one after the other.
+    # (The contexts are 200 to 263 tokens long)
+    modelManager.getSamplesFromTokenBatch = runBatch
+    modes = [
+        ("no batching", {
+            'maxBatchSize': 1
+        }),
+        ("same length", {
+            'maxPadding': 0
+        }),
+        ("padded", {}),
+    ]
+    print()
+    print("Requests per second:")
+    print("{:>8}".format("threads") + "".join("{:>14}".format(name)
+                                              for name, _ in modes))
+    numThreads = 1
+    while numThreads <= args.maxThreads:
+        line = "{:>8}".format(numThreads)
+        for _, options in modes:
+            scheduler = inference_scheduler.InferenceScheduler(
+                modelManager, **options)
+            requestContexts = [
+                randomTokens(rng.integers(200, 264))
+                for _ in range(numThreads * args.requests)
+            ]
+            start = time.perf_counter()
+            sendConcurrently(scheduler,
+                             requestContexts,
+                             1,
+                             numThreads=numThreads,
+                             length=args.length)
+            seconds = time.perf_counter() - start
+            scheduler.close()
+            line += "{:>14.1f}".format(len(requestContexts) / seconds)
+        print(line)
+        numThreads *= 2
+
+    print("FAILED" if failed else "ok")
+    sys.exit(1 if failed else 0)
+
+
+# Sends a request for each of 'contexts' from 'numThreads' threads at once
+# (one thread for each context by default), each waiting for its last
+# request to finish before it sends the next one. Returns a Future for
+# each context.
+def sendConcurrently(scheduler,
+                     contexts: list,
+                     numSamples: int,
+                     numThreads: int = None,
+                     **settings):
+    if numThreads is None:
+        numThreads = len(contexts)
+    futures = [None] * len(contexts)
+    start = threading.Barrier(numThreads)
+
+    def send(first):
+        start.wait()
+        for i in range(first, len(contexts), numThreads):
+            futures[i] = scheduler.submitTokens(contexts[i], numSamples,
+                                                **settings)
+            # (Waits for it, without raising its error)
+            futures[i].exception()
+
+    threads = [
+        threading.Thread(target=send, args=(i, )) for i in range(numThreads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return futures
+
+
+# A tiny model with a vocabulary of the 256 bytes and '<|endoftext|>'.
+def makeRandomModel(modelPath: str):
+    os.makedirs(modelPath, exist_ok=True)
+
+    byteEncoder = fast_encoder.bytesToUnicode()
+    encoder = {byteEncoder[x]: x for x in range(256)}
+    encoder['<|endoftext|>'] = len(encoder)
+    with open(os.path.join(modelPath, "encoder.json"), "w") as f:
+        json.dump(encoder, f)
+    with open(os.path.join(modelPath, "vocab.bpe"), "w",
+              encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+
+    hparams = {
+        'n_vocab': len(encoder),
+        'n_ctx': 1024,
+        'n_embd': 32,
+        'n_head': 2,
+        'n_layer': 1,
+    }
+    with open(os.path.join(modelPath, "hparams.json"), "w") as f:
+        json.dump(hparams, f)
+
+    rng = np.random.default_rng(0)
+    embd = hparams['n_embd']
+    shapes = {
+        'model/wte': (len(encoder), embd),
+        'model/wpe': (hparams['n_ctx'], embd),
+        'attn/c_attn/w': (1, embd, 3 * embd),
+        'attn/c_attn/b': (3 * embd, ),
+        'attn/c_proj/w': (1, embd, embd),
+        'mlp/c_fc/w': (1, embd, 4 * embd),
+        'mlp/c_fc/b': (4 * embd, ),
+        'mlp/c_proj/w': (1, 4 * embd, embd),
+    }
+
+    def tensor(name):
+        shape = shapes.get(name, shapes.get(name.split("/", 2)[-1], embd))
+        # Layer norm gains start at 1.
+        if name.endswith("/g"):
+            return np.ones(shape, dtype=np.float32)
+        return rng.normal(0, 0.02, shape).astype(np.float32)
+
+    names = flat_weights.modelTensorNames(hparams['n_layer'])
+    flat_weights.writeWeights(modelPath, [(x, tensor(x)) for x in names])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Times the in-memory work of 'src/story_manager.py' on long stories.
+
+Builds stories with thousands of turns and hundreds of remembered
+actions, and times adding a turn, building the AI seed (with and without
+a next action, like speculation does) and rewinding. Saving is turned
+off, so only the story bookkeeping is timed.
+
+Only uses the public StoryManager methods, so it can be run on an older
+checkout to compare.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import story_manager
+
+
+# Stands in for the BPE encoder. (One token per word)
+class WordEncoder:
+    def encode(self, text: str):
+        return [len(x) for x in text.split(" ")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark StoryManager on long stories.")
+    parser.add_argument("--turns",
+                        default="1000,5000",
+                        help="Comma separated story lengths to try.")
+    parser.add_argument("--remembered",
+                        default="100,500",
+                        help="Comma separated numbers of remembered actions.")
+    parser.add_argument("--memory-size",
+                        dest="memorySize",
+                        type=int,
+                        default=15)
+    parser.add_argument("--token-budget", dest="tokenBudget", type=int)
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=200,
+                        help="Number of times each operation is timed.")
+    args = parser.parse_args()
+
+    print("{:>6} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+        "turns", "remembered", "add turn", "seed", "next seed", "rewind"))
+    for numTurns in [int(x) for x in args.turns.split(",")]:
+        for numRemembered in [int(x) for x in args.remembered.split(",")]:
+            manager = makeStory(numTurns, numRemembered, args)
+            times = timeStory(manager, args.repeat)
+            print("{:>6} {:>10} {:>10.1f}us {:>10.1f}us {:>10.1f}us "
+                  "{:>10.1f}us".format(numTurns, numRemembered,
+                                       *[x * 1e6 for x in times]))
+
+
+def makeStory(numTurns: int, numRemembered: int, args):
+    manager = story_manager.StoryManager("story.save",
+                                         tempfile.mkdtemp(),
+                                         memorySize=args.memorySize,
+                                         encoder=WordEncoder(),
+                                         tokenBudget=args.tokenBudget)
+    # (Only the in-memory work is timed)
+    manager._record = lambda record: None
+
+    every = max(1, numTurns // max(1, numRemembered))
+    for i in range(numTurns):
+        action = manager.createAction(
+            "The AI wrote this part of the story, turn {}. ".format(i) * 4,
+            "You do thing number {}.".format(i))
+        if i % every == 0 and numRemembered > 0:
+            manager.saveAction(action)
+        manager.updateMemory(action)
+
+    return manager
+
+
+# Returns the average seconds to add a turn, build the seed, build the
+# seed for a next action, and rewind.
+def timeStory(manager, repeat: int):
+    addSeconds = 0.0
+    rewindSeconds = 0.0
+    for i in range(repeat):
+        start = time.perf_counter()
+        action = manager.createAction("More story. " * 10, "You wait.")
+        manager.updateMemory(action)
+        addSeconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        manager.revertAction()
+        rewindSeconds += time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        manager.getAISeedTokens()
+    seedSeconds = time.perf_counter() - start
+
+    nextAction = manager.createAction("The next part. " * 10, "You go on.")
+    start = time.perf_counter()
+    for i in range(repeat):
+        manager.getAISeedTokens(nextAction)
+    nextSeedSeconds = time.perf_counter() - start
+
+    return (addSeconds / repeat, seedSeconds / repeat,
+            nextSeedSeconds / repeat, rewindSeconds / repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+End to end turn latency benchmark for 'src/game.py'.
+
+Writes a tiny gpt-2 model with random weights (hparams, a small BPE
+vocabulary learned from the story database, and a flat weight file) to a
+temp directory, or uses a real model with '--model-dir'. Then starts a
+game and runs a scripted list of commands through Game.gameCommand, the
+same way 'play_game.py' does.
+
+Prints the p50/p95/p99 time of each kind of command (and until any of
+the new text could be shown, as 'firstText'), the startup time and the
+peak RSS, and can save them as JSON ('--output') to compare with
+a later run ('--compare').
+
+The random model never stops early, so each turn generates the full
+length of text. (The numbers are only comparable between runs with the
+same model and settings)
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+START_TIME = time.perf_counter()
+
+import numpy as np
+import regex as re
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from src import fast_encoder, flat_weights, game, model_manager, turn_metrics
+
+IMPORT_TIME = time.perf_counter()
+
+STORY_JSON = os.path.join(ROOT_DIR, "game_data", "storyDatabase.json")
+
+# The commands sent to the game. ('' is "continue")
+SCRIPT = [
+    "look around",
+    "",
+    "/retry",
+    "I open the door and walk inside",
+    '"Is anyone there?"',
+    "",
+    "/retry",
+    "/retry",
+    "/retry",
+    "I pick up my sword",
+    "/remember",
+    "I ask the stranger where we are",
+    "",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the time each turn of the game takes.")
+    parser.add_argument("--model-dir",
+                        dest="modelDir",
+                        help="Directory with the model. (Like 'gpt2-model'. "
+                        "Default is a new random model)")
+    parser.add_argument("--model-name",
+                        dest="modelName",
+                        default="rpg_model",
+                        help="Model in '--model-dir' to use.")
+    parser.add_argument("--backend",
+                        choices=list(model_manager.BACKENDS.keys()),
+                        default="numpy")
+    parser.add_argument("--layers",
+                        type=int,
+                        default=2,
+                        help="Layers in the random model.")
+    parser.add_argument("--embd",
+                        type=int,
+                        default=64,
+                        help="Embedding size of the random model.")
+    parser.add_argument("--heads",
+                        type=int,
+                        default=4,
+                        help="Attention heads in the random model.")
+    parser.add_argument("--merges",
+                        type=int,
+                        default=500,
+                        help="BPE merges in the random model's vocabulary.")
+    parser.add_argument("--turns",
+                        type=int,
+                        default=40,
+                        help="Number of commands timed. (The script is "
+                        "repeated as needed)")
+    parser.add_argument("--warmup",
+                        type=int,
+                        default=2,
+                        help="Number of commands run before timing.")
+    parser.add_argument("--candidates", type=int, default=3)
+    parser.add_argument("--token-budget", dest="tokenBudget", type=int)
+    parser.add_argument("--speculate",
+                        action="store_true",
+                        help="Speculate between commands, like the player "
+                        "is typing for '--think-time' seconds.")
+    parser.add_argument("--think-time",
+                        dest="thinkTime",
+                        type=float,
+                        default=0.5)
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help="Stream the AI text, like 'play_game.py' does.")
+    parser.add_argument("--genre", default="fantasy")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Save the results as JSON.")
+    parser.add_argument("--compare",
+                        help="JSON from an earlier run to compare with.")
+    args = parser.parse_args()
+
+    modelDir = args.modelDir
+    if modelDir is None:
+        modelDir = tempfile.mkdtemp()
+        makeRandomModel(os.path.join(modelDir, args.modelName), args)
+        print("Random model:", os.path.join(modelDir, args.modelName))
+
+    # Startup is timed from the start of the script, without the time
+    # it took to make the random model.
+    loadStart = time.perf_counter()
+    modelManager = model_manager.ModelManager(modelDir,
+                                              args.modelName,
+                                              backend=args.backend)
+    loadSeconds = time.perf_counter() - loadStart
+
+    dataDir = tempfile.mkdtemp()
+    gameStart = time.perf_counter()
+    metrics = turn_metrics.TurnMetrics()
+    benchGame = game.Game(modelManager,
+                          dataDir,
+                          dataDir,
+                          STORY_JSON,
+                          numCandidates=args.candidates,
+                          speculate=args.speculate,
+                          tokenBudget=args.tokenBudget,
+                          metrics=metrics)
+    characterClass = list(benchGame.storyStarter.promptDatabase[args.genre])[0]
+    benchGame.startGame(args.genre, "Alex", characterClass)
+    gameSeconds = time.perf_counter() - gameStart
+
+    startup = {
+        'importSeconds': IMPORT_TIME - START_TIME,
+        'loadSeconds': loadSeconds,
+        'gameSeconds': gameSeconds,
+        'totalSeconds': IMPORT_TIME - START_TIME + loadSeconds + gameSeconds,
+    }
+
+    # Command kind -> seconds each one took.
+    latencies = collections.defaultdict(list)
+    for i in range(args.warmup + args.turns):
+        command = SCRIPT[i % len(SCRIPT)]
+        if args.speculate:
+            benchGame.speculate()
+            time.sleep(args.thinkTime)
+
+        # Seconds until the first streamed text.
+        firstText = []
+
+        def onText(text: str):
+            if len(firstText) == 0:
+                firstText.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        benchGame.gameCommand(command, onText if args.stream else None)
+        seconds = time.perf_counter() - start
+
+        if i >= args.warmup:
+            latencies[commandKind(command)].append(seconds)
+            latencies['all'].append(seconds)
+            # (Text that isn't streamed is shown once the command is done)
+            latencies['firstText'].append((firstText + [seconds])[0])
+
+    if benchGame.speculator is not None:
+        benchGame.speculator.cancel()
+
+    results = {
+        'config': {
+            'model': modelDir if args.modelDir else "random",
+            'modelName': args.modelName,
+            'hparams': modelManager.hparams.values,
+            'backend': args.backend,
+            'turns': args.turns,
+            'candidates': args.candidates,
+            'tokenBudget': args.tokenBudget,
+            'speculate': args.speculate,
+            'stream': args.stream,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+        },
+        'startup': startup,
+        'peakRssMB': peakRssMB(),
+        'latency': {
+            x: latencyStats(y)
+            for x, y in latencies.items()
+        },
+        'stages': stageStats(metrics),
+    }
+
+    printResults(results)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            printComparison(json.load(f), results)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Saved", args.output)
+
+
+def commandKind(command: str):
+    if command == "":
+        return "continue"
+    if command[0] == "/":
+        return command[1:].split(" ")[0]
+    return "action"
+
+
+def latencyStats(values: list):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': turn_metrics.percentile(values, 50),
+        'p95': turn_metrics.percentile(values, 95),
+        'p99': turn_metrics.percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+# Mean seconds of each stage of the turns that ran the AI, and the
+# model's tokens per second.
+def stageStats(metrics: turn_metrics.TurnMetrics):
+    turns = list(metrics.turns)
+    stages = collections.defaultdict(float)
+    for turn in turns:
+        for name, seconds in turn.stages.items():
+            stages[name] += seconds / len(turns)
+
+    modelSeconds = sum([x.modelSeconds for x in turns])
+    if modelSeconds > 0:
+        stages['tokensPerSecond'] = sum([x.generatedTokens
+                                         for x in turns]) / modelSeconds
+    return dict(stages)
+
+
+# Peak resident memory of this process in megabytes.
+def peakRssMB():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # (Kilobytes on Linux, bytes on macOS)
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def printResults(results: dict):
+    startup = results['startup']
+    print("Startup: {:.2f}s (imports {:.2f}s, model {:.2f}s, game {:.2f}s)".
+          format(startup['totalSeconds'], startup['importSeconds'],
+                 startup['loadSeconds'], startup['gameSeconds']))
+    print("Peak RSS: {:.1f} MB".format(results['peakRssMB']))
+
+    for kind, stats in sorted(results['latency'].items()):
+        print(
+            "{:>9}: {:4} turns  p50 {:.4f}s  p95 {:.4f}s  p99 {:.4f}s".format(
+                kind, stats['count'], stats['p50'], stats['p95'],
+                stats['p99']))
+
+    for name, value in results['stages'].items():
+        print("  {}: {:.4f}".format(name, value))
+
+
+# Prints how much each number changed since 'old'.
+def printComparison(old: dict, new: dict):
+    def change(name, oldValue, newValue):
+        if oldValue:
+            print("  {}: {:.4f} -> {:.4f} ({:+.1%})".format(
+                name, oldValue, newValue, newValue / oldValue - 1))
+
+    print("Compared with the earlier run:")
+    change("startup", old['startup']['totalSeconds'],
+           new['startup']['totalSeconds'])
+    change("peak RSS MB", old['peakRssMB'], new['peakRssMB'])
+    for kind, stats in sorted(new['latency'].items()):
+        if kind not in old['latency']:
+            continue
+        for percent in ('p50', 'p95', 'p99'):
+            change(kind + " " + percent, old['latency'][kind][percent],
+                   stats[percent])
+
+
+# Writes 'hparams.json', 'encoder.json', 'vocab.bpe' and a flat weight
+# file with random weights to 'modelPath'.
+def makeRandomModel(modelPath: str, args):
+    os.makedirs(modelPath, exist_ok=True)
+
+    merges = learnMerges(args.merges)
+    byteEncoder = fast_encoder.bytesToUnicode()
+    tokens = [byteEncoder[x] for x in range(256)]
+    tokens += [x + y for x, y in merges]
+    encoder = {x: i for i, x in enumerate(tokens)}
+    encoder['<|endoftext|>'] = len(encoder)
+
+    with open(os.path.join(modelPath, "encoder.json"), "w") as f:
+        json.dump(encoder, f)
+    with open(os.path.join(modelPath, "vocab.bpe"), "w",
+              encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+        for first, second in merges:
+            f.write(first + " " + second + "\n")
+
+    hparams = {
+        'n_vocab': len(encoder),
+        'n_ctx': 1024,
+        'n_embd': args.embd,
+        'n_head': args.heads,
+        'n_layer': args.layers,
+    }
+    with open(os.path.join(modelPath, "hparams.json"), "w") as f:
+        json.dump(hparams, f)
+
+    rng = np.random.default_rng(args.seed)
+    embd = args.embd
+
+    def normal(*shape):
+        return rng.normal(0, 0.02, shape).astype(np.float32)
+
+    shapes = {
+        'attn/c_attn/w': (1, embd, 3 * embd),
+        'attn/c_proj/w': (1, embd, embd),
+        'mlp/c_fc/w': (1, embd, 4 * embd),
+        'mlp/c_proj/w': (1, 4 * embd, embd),
+    }
+    biasSizes = {
+        'attn/c_attn/b': 3 * embd,
+        'mlp/c_fc/b': 4 * embd,
+    }
+
+    def tensor(name):
+        if name == 'model/wte':
+            return normal(len(encoder), embd)
+        if name == 'model/wpe':
+            return normal(hparams['n_ctx'], embd)
+        layerName = name.split("/", 2)[-1]
+        if layerName in shapes:
+            return normal(*shapes[layerName])
+        # Layer norm gains start at 1, and everything else at 0.
+        size = biasSizes.get(layerName, embd)
+        if name.endswith("/g"):
+            return np.ones(size, dtype=np.float32)
+        return np.zeros(size, dtype=np.float32)
+
+    names = flat_weights.modelTensorNames(args.layers)
+    flat_weights.writeWeights(modelPath, [(x, tensor(x)) for x in names])
+
+
+# Learns 'numMerges' BPE merges from the story database, so the random
+# model's tokens are about as long as real ones.
+def learnMerges(numMerges: int):
+    with open(STORY_JSON) as f:
+        text = json.dumps(json.load(f)).replace("\\n", "\n")
+
+    byteEncoder = fast_encoder.bytesToUnicode()
+    pattern = re.compile(
+        r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+    )
+    words = collections.Counter()
+    for word in pattern.findall(text):
+        words[tuple(byteEncoder[x] for x in word.encode("utf-8"))] += 1
+
+    merges = []
+    for _ in range(numMerges):
+        pairs = collections.Counter()
+        for word, count in words.items():
+            for pair in zip(word, word[1:]):
+                pairs[pair] += count
+        if len(pairs) == 0:
+            break
+
+        first, second = max(pairs, key=pairs.get)
+        merges.append((first, second))
+
+        newWords = collections.Counter()
+        for word, count in words.items():
+            newWord = []
+            i = 0
+            while i < len(word):
+                if word[i:i + 2] == (first, second):
+                    newWord.append(first + second)
+                    i += 2
+                else:
+                    newWord.append(word[i])
+                    i += 1
+            newWords[tuple(newWord)] += count
+        words = newWords
+
+    return merges
+
+
+if __name__ == "__main__":
+    main()
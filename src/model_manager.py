@@ -3,42 +3,118 @@
 # Mainly just a rewrite of 'intractive_conditional_samples.py'
 # from the gpt-2 'src' directory.
 import sys
+import codecs
+import concurrent.futures
+import hashlib
+import importlib
 import json
 import os
-import numpy as np
-import tensorflow.compat.v1 as tf
+import threading
+import time
 
-from gpt_2.src import encoder, model, sample
+# NumPy and the encoder are imported by importModelModules(), and each
+# backend by getBackend(), so the game's menus don't wait for them.
+# (Importing this module only imports the standard library)
+np = None
+fast_encoder = None
+
+# Backends that can run the model, as (module, class) in 'src'.
+#
+# A backend is made with (hparams, modelPath, stopTokens, sentenceTokens,
+# settings, allowGpu), where 'settings' are the default sampling settings.
+# It has to have...
+# - load(setStage): Loads the model. 'setStage' is called with a string
+#   saying what it's doing.
+# - sample(contexts, past, numSamples, settings): Samples 'numSamples'
+#   samples for each of 'contexts'. (A list of token lists that are all
+#   the same length, and come after the attention cache 'past')
+#   Returns the sampled tokens and the attention cache of the contexts.
+#   (See 'tf_backend.sampleSequence' for how sampling works)
+#   It can also be given 'onStep', which is called with the tokens of each
+#   step as they're sampled, and stops sampling if it returns True.
+# - canPad: (Optional) True if 'sample' can also be given 'padding', the
+#   number of padding tokens at the start of each context. Then contexts
+#   of different lengths can share a batch. (See 'numpy_backend.py')
+BACKENDS = {
+    'tensorflow': ('tf_backend', 'TensorflowBackend'),
+    'numpy': ('numpy_backend', 'NumpyBackend'),
+}
+
+# The encoder's files in the model's directory.
+TOKENIZER_FILES = ('encoder.json', 'vocab.bpe')
+
+
+# Imports NumPy and the encoder. (Only the first call does anything)
+def importModelModules():
+    global np, fast_encoder
+    if fast_encoder is not None:
+        return
+
+    import numpy
+    from . import fast_encoder as encoderModule
+
+    np = numpy
+    fast_encoder = encoderModule
+
+
+# Imports a backend, and returns its class.
+def getBackend(name: str):
+    moduleName, className = BACKENDS[name]
+    module = importlib.import_module("." + moduleName, __package__)
+    return getattr(module, className)
+
+
+# The values from 'hparams.json', so they can be used without TensorFlow.
+class HParams:
+    def __init__(self, values: dict):
+        self.values = dict(values)
+        for name, value in self.values.items():
+            setattr(self, name, value)
 
 
 class ModelManager:
-    def __init__(self, modelDir: str, modelName: str, allowGpu: bool = False):
+    # If 'loadModel' is False the model isn't loaded until loadModel()
+    # or loadModelInBackground() is called. (The settings can be used
+    # before then. The encoder is loaded the first time it's used, or by
+    # loadModel)
+    def __init__(self,
+                 modelDir: str,
+                 modelName: str,
+                 allowGpu: bool = False,
+                 loadModel: bool = True,
+                 backend: str = 'tensorflow'):
         self.modelName = modelName
         self.modelDir = os.path.expanduser(os.path.expandvars(modelDir))
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend: " + backend)
+        self.backendName = backend
+        self.allowGpu = allowGpu
 
-        # Number of batches to run (we only need 1 sample)
-        batchSize = 1
+        # Default sampling settings. These are passed to the backend on
+        # each call, so any of them can be changed per call (see
+        # getSamplesFromText) without rebuilding the model.
+        self.settings = {}
 
         # Float value controlling randomness (Lower is less random)
-        temperature = 0.5
+        self.settings['temperature'] = 0.5
 
         # Integer value controlling diversity. Basically the number
         # of words that are considered during sample generation.
         # (0 means to have no limit, but 40 is a good value)
-        topK = 40
+        # (Only used when 'topP' is 0)
+        self.settings['topK'] = 40
 
-        # The 'interactive_conditional_samples.py' script does not say
-        # what this value does.
-        topP = 0.9
+        # Nucleus sampling. Only the most likely words that add up to
+        # this probability are considered. (0 means to use 'topK')
+        self.settings['topP'] = 0.9
 
-        # Required (Tensorflow will complain if this is not here)
-        tf.compat.v1.disable_eager_execution()
-
-        # Load encoder, and hparams
-        self.enc = encoder.get_encoder(modelName, modelDir)
-        self.hparams = model.default_hparams()
+        # Load hparams (The encoder is loaded by loadEncoder())
+        self._enc = None
+        self.encoderLock = threading.Lock()
+        self.tokenizerId = getTokenizerId(modelDir, modelName)
+        self.modelId = getModelId(modelDir, modelName)
         with open(os.path.join(modelDir, modelName, 'hparams.json')) as f:
-            self.hparams.override_from_dict(json.load(f))
+            self.hparams = HParams(json.load(f))
 
         # Normally used when the sample generator hasn't been
         # given a prompt. We don't really need it.
@@ -47,56 +123,552 @@ class ModelManager:
         # The default from the hparams file
         # seems good enough.
         # length = self.hparams.n_ctx // 2
-        length = 60
+        # (This is only the max length. Sampling stops early once every
+        # sample reaches an action or "<|endoftext|>")
+        self.settings['length'] = 60
 
-        config = None
-        if allowGpu:
-            config = tf.ConfigProto()
-            config.gpu_options.allow_growth = True
-        else:
-            config = tf.ConfigProto(device_count={"GPU": 0})
+        # Stop after this many sentences. (0 means no limit)
+        self.settings['maxSentences'] = 0
+
+        # Tokens that end a sample, and tokens that end a sentence.
+        # (Made by loadEncoder())
+        self.stopTokens = None
+        self.sentenceTokens = None
+
+        # Made by loadModel()
+        self.backend = None
+
+        # The tokens from the previous call, and their attention cache.
+        # Used to skip the part of the context that hasn't changed.
+        self.cacheTokens = []
+        self.cachePast = None
+
+        # Only one thread can use the backend (and the cache) at a time.
+        self.lock = threading.Lock()
+
+        # Stats for the last call of each thread. (See getLastStats)
+        self.threadStats = threading.local()
+
+        # Set once loadModel() is done. (Even if it failed)
+        self.loadedEvent = threading.Event()
+        self.loadError = None
+        # What loadModel() is doing right now, and how long it took.
+        self.loadStage = "Not started"
+        self.loadTime = None
+
+        if loadModel:
+            self.loadModel()
+
+    # The BPE encoder. (Loads it if it isn't loaded yet)
+    @property
+    def enc(self):
+        self.loadEncoder()
+        return self._enc
+
+    # Loads the encoder, and finds the stop and sentence tokens.
+    # (Only the first call does anything)
+    def loadEncoder(self):
+        with self.encoderLock:
+            if self._enc is not None:
+                return
 
-        self.sess = tf.Session(config=config)
+            importModelModules()
+            enc = fast_encoder.get_encoder(self.modelName, self.modelDir)
 
-        # Create a placeholder sample for self.sess.run to use.
-        self.context = tf.placeholder(tf.int32, [batchSize, None])
-        # np.random.seed(seed)
-        # tf.set_random_seed(seed)
+            # Tokens that end a sample. (Anything after an action marker
+            # ">" or a "<|endoftext|>" gets removed by Game._stripAIText)
+            stopTokens = np.zeros(self.hparams.n_vocab, dtype=bool)
+            # Tokens that end a sentence.
+            sentenceTokens = np.zeros(self.hparams.n_vocab, dtype=bool)
+            for token, tokenId in enc.encoder.items():
+                if tokenId >= self.hparams.n_vocab:
+                    continue
+                if ">" in token or "<" in token:
+                    stopTokens[tokenId] = True
+                if "." in token or "?" in token or "!" in token:
+                    sentenceTokens[tokenId] = True
 
-        self.output = sample.sample_sequence(
-            hparams=self.hparams,
-            length=length,
-            context=self.context,
-            batch_size=batchSize,
-            temperature=temperature,
-            top_k=topK,
-            top_p=topP,
-        )
+            self.stopTokens = stopTokens
+            self.sentenceTokens = sentenceTokens
+            self._enc = enc
 
-        # Load pre-trained model
-        saver = tf.train.Saver()
-        ckpt = tf.train.latest_checkpoint(os.path.join(modelDir, modelName))
+    # Same as self.enc.encode(). (Can be given in place of the encoder,
+    # so it isn't loaded until something is encoded)
+    def encode(self, text: str):
+        return self.enc.encode(text)
 
-        with tf.get_default_graph().as_default():
-            saver.restore(self.sess, ckpt)
+    # Loads the encoder, and the model with the backend.
+    def loadModel(self):
+        start = time.perf_counter()
+        try:
+            self._setLoadStage("Loading the encoder")
+            self.loadEncoder()
 
-    def __del__(self):
-        self.sess.close()
+            self._setLoadStage("Importing the backend")
+            backendClass = getBackend(self.backendName)
+            self.backend = backendClass(hparams=self.hparams,
+                                        modelPath=os.path.join(
+                                            self.modelDir, self.modelName),
+                                        stopTokens=self.stopTokens,
+                                        sentenceTokens=self.sentenceTokens,
+                                        settings=dict(self.settings),
+                                        allowGpu=self.allowGpu)
+            self.backend.load(self._setLoadStage)
+        except Exception as e:
+            self.loadError = e
+            self.loadStage = "Failed"
+            raise
+        finally:
+            self.loadTime = time.perf_counter() - start
+            self.loadedEvent.set()
 
-    def getSampleFromText(self, inputStr: str):
+        self.loadStage = "Ready"
+
+    # Runs loadModel() in a thread. (Use isLoaded() or waitUntilLoaded()
+    # to know when it's done)
+    def loadModelInBackground(self):
+        def load():
+            try:
+                self.loadModel()
+            except Exception:
+                # Raised again by waitUntilLoaded()
+                pass
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+
+    def isLoaded(self):
+        return self.loadedEvent.is_set() and self.loadError is None
+
+    # Blocks until the model is loaded. (Raises the error if loading failed)
+    def waitUntilLoaded(self):
+        self.loadedEvent.wait()
+        if self.loadError is not None:
+            raise RuntimeError("Failed to load the model") from self.loadError
+
+    def _setLoadStage(self, stage: str):
+        self.loadStage = stage
+
+    # 'settings' can override any of the sampling settings in
+    # self.settings for this call. ('length', 'maxSentences',
+    # 'temperature', 'topK', and 'topP')
+    def getSampleFromText(self, inputStr: str, **settings):
+        return self.getSamplesFromText(inputStr, 1, **settings)[0]
+
+    # Generates 'numSamples' samples for the same text in one batch.
+    # (Much cheaper than calling getSampleFromText 'numSamples' times)
+    def getSamplesFromText(self, inputStr: str, numSamples: int, **settings):
         # Convert string to tokens
         contextTokens = self.enc.encode(inputStr)
 
+        return self.getSamplesFromTokens(contextTokens, numSamples, **settings)
+
+    # Same as getSamplesFromText, but for text that is already tokens.
+    #
+    # If 'stop' (a threading.Event) is set while the model runs, sampling
+    # stops after the current step, so the samples are cut short.
+    def getSamplesFromTokens(self,
+                             contextTokens: list,
+                             numSamples: int,
+                             stop=None,
+                             **settings):
+        self.waitUntilLoaded()
+        settings = self._samplingSettings(settings)
+
+        # The model can't see more than n_ctx tokens, so the oldest
+        # tokens are cut if the context is too long.
+        maxContext = self.getContextBudget(settings['length'])
+        contextTokens = contextTokens[-maxContext:]
+
+        def checkStop(samples):
+            return stop.is_set()
+
+        onStep = None
+        if stop is not None:
+            onStep = checkStop
+
+        start = time.perf_counter()
+        with self.lock:
+            lockTime = time.perf_counter()
+            out, numNewTokens = self._runModel(contextTokens, numSamples,
+                                               settings, onStep)
+        modelTime = time.perf_counter()
+
+        # Convert output tokens to strings
+        texts = self._decodeSamples(out, settings)
+
+        self.threadStats.last = {
+            'contextTokens': len(contextTokens),
+            'newTokens': numNewTokens,
+            'numSamples': numSamples,
+            'generatedTokens': int(np.size(out)),
+            'waitSeconds': lockTime - start,
+            'modelSeconds': modelTime - lockTime,
+            'decodeSeconds': time.perf_counter() - modelTime,
+        }
+        return texts
+
+    # Same as getSamplesFromTokens, but calls 'onText' with the text of
+    # the first sample as each of its tokens is sampled. (A character
+    # split between tokens is passed on once all of it is there)
+    #
+    # Returns as soon as the first sample is done, with its text and a
+    # concurrent.futures.Future for a list of the other samples. They keep
+    # going in the background (and keep the model busy) until they're done,
+    # or until 'stop' is set.
+    def streamFromTokens(self,
+                         contextTokens: list,
+                         numSamples: int,
+                         onText,
+                         stop=None,
+                         **settings):
+        self.waitUntilLoaded()
+        settings = self._samplingSettings(settings)
+
+        maxContext = self.getContextBudget(settings['length'])
+        contextTokens = contextTokens[-maxContext:]
+
+        streamer = SampleStreamer(self, settings, onText)
+        rest = concurrent.futures.Future()
+        run = {}
+
+        def onStep(samples):
+            streamer.onStep(samples)
+            return stop is not None and stop.is_set()
+
+        def generate():
+            try:
+                with self.lock:
+                    run['lockTime'] = time.perf_counter()
+                    _, newTokens = self._getCachedPast(contextTokens)
+                    run['newTokens'] = len(newTokens)
+                    out, _ = self._runModel(contextTokens, numSamples,
+                                            settings, onStep)
+                texts = self._decodeSamples(out, settings)
+            except Exception as e:
+                streamer.finish(e)
+                rest.set_exception(e)
+                return
+
+            streamer.finish()
+            rest.set_result(texts[1:])
+
+        start = time.perf_counter()
+        threading.Thread(target=generate, daemon=True).start()
+        streamer.finished.wait()
+        if streamer.error is not None:
+            raise streamer.error
+
+        self.threadStats.last = {
+            'contextTokens': len(contextTokens),
+            'newTokens': run['newTokens'],
+            'numSamples': numSamples,
+            'generatedTokens': streamer.numSteps * numSamples,
+            'waitSeconds': run['lockTime'] - start,
+            'modelSeconds': streamer.doneTime - run['lockTime'],
+            # (Each token is decoded as it's sampled)
+            'decodeSeconds': 0.0,
+            'firstTokenSeconds': streamer.firstTokenTime - start,
+        }
+        return streamer.text, rest
+
+    # Stats for the last getSamplesFromTokens (or streamFromTokens, or
+    # getSamplesFromTokenBatch) call made by this thread.
+    # (None if there wasn't one) A dict with...
+    # 'contextTokens': Number of tokens in the context.
+    # 'newTokens': How many of them weren't in the attention cache.
+    # 'numSamples': Number of samples.
+    # 'generatedTokens': Number of tokens sampled. (For all samples, and
+    #                    including the ones cut off after a stop token.
+    #                    With streamFromTokens only until the first sample
+    #                    was done)
+    # 'waitSeconds': Time spent waiting for another thread to finish.
+    # 'modelSeconds': Time spent running the model.
+    # 'decodeSeconds': Time spent converting the tokens to strings.
+    # (With streamFromTokens it also has 'firstTokenSeconds', the time
+    # until the first token was sampled. With getSamplesFromTokenBatch the
+    # stats are for the whole batch, the context is the longest one, and
+    # it has 'batchSize', the number of contexts)
+    def getLastStats(self):
+        return getattr(self.threadStats, 'last', None)
+
+    # Max number of context tokens that leaves room for 'length'
+    # generated tokens. (Defaults to the default length)
+    def getContextBudget(self, length: int = None):
+        if length is None:
+            length = self.settings['length']
+        return max(1, self.hparams.n_ctx - length)
+
+    # True if getSamplesFromTokenBatch can be given contexts of different
+    # lengths. (Only if the backend can pad them)
+    def canPadBatches(self):
+        return getattr(getBackend(self.backendName), 'canPad', False)
+
+    # Generates 'numSamples' samples for each context in one batch.
+    # Unless canPadBatches(), all of the contexts have to be the same
+    # number of tokens long, once they're cut to the context budget like
+    # in getSamplesFromTokens. (Otherwise the shorter ones are padded)
+    # (Doesn't use or change the attention cache)
+    # Returns a list with a list of samples for each context.
+    def getSamplesFromTokenBatch(self, contexts: list, numSamples: int,
+                                 **settings):
+        self.waitUntilLoaded()
+        settings = self._samplingSettings(settings)
+
+        maxContext = self.getContextBudget(settings['length'])
+        contexts = [x[-maxContext:] for x in contexts]
+        past = np.zeros(pastShape(self.hparams, len(contexts), 0),
+                        dtype=np.float32)
+
+        padding = None
+        longest = max(len(x) for x in contexts)
+        if any(len(x) != longest for x in contexts):
+            if not self.canPadBatches():
+                raise ValueError("The '{}' backend can't batch contexts of "
+                                 "different lengths".format(self.backendName))
+            padding = [longest - len(x) for x in contexts]
+            contexts = [[0] * x + y for x, y in zip(padding, contexts)]
+
+        start = time.perf_counter()
+        with self.lock:
+            lockTime = time.perf_counter()
+            if padding is None:
+                out, _ = self.backend.sample(contexts, past, numSamples,
+                                             settings)
+            else:
+                out, _ = self.backend.sample(contexts,
+                                             past,
+                                             numSamples,
+                                             settings,
+                                             padding=padding)
+        modelTime = time.perf_counter()
+
+        texts = self._decodeSamples(out, settings)
+
+        # (For the whole batch)
+        self.threadStats.last = {
+            'contextTokens': longest,
+            'newTokens': longest,
+            'numSamples': numSamples,
+            'generatedTokens': int(np.size(out)),
+            'waitSeconds': lockTime - start,
+            'modelSeconds': modelTime - lockTime,
+            'decodeSeconds': time.perf_counter() - modelTime,
+            'batchSize': len(contexts),
+        }
+        return [
+            texts[i:i + numSamples] for i in range(0, len(texts), numSamples)
+        ]
+
+    # Values for every sampling setting. (Anything not in 'settings'
+    # uses the default from self.settings)
+    def _samplingSettings(self, settings: dict):
+        values = {}
+        for name, value in self.settings.items():
+            value = settings.pop(name, value)
+            if value is None:
+                value = self.settings[name]
+            values[name] = value
+
+        if len(settings) > 0:
+            raise TypeError("Unknown sampling settings: " +
+                            ", ".join(settings.keys()))
+
+        # At least 1 token is always generated.
+        values['length'] = max(1, values['length'])
+
+        return values
+
+    # Converts samples into strings. Since the batch keeps going until
+    # every sample is done, anything after a sample's stop token is cut.
+    def _decodeSamples(self, out, settings: dict):
+        texts = []
+        for tokens in out:
+            numSentences = 0
+            for i, token in enumerate(tokens):
+                numSentences += int(self.sentenceTokens[token])
+                if self._endsSample(token, numSentences, settings):
+                    tokens = tokens[:i + 1]
+                    break
+            texts.append(self.enc.decode(tokens))
+
+        return texts
+
+    # True if a sample ends with 'token', the 'numSentences'th sentence.
+    def _endsSample(self, token: int, numSentences: int, settings: dict):
+        maxSentences = settings['maxSentences']
+        return bool(self.stopTokens[token]) or 0 < maxSentences <= numSentences
+
+    def _runModel(self,
+                  contextTokens: list,
+                  numSamples: int,
+                  settings: dict,
+                  onStep=None):
+        # Only feed the tokens that aren't in the attention cache.
+        past, newTokens = self._getCachedPast(contextTokens)
+
         # Generate sample
-        out = self.sess.run(self.output,
-                            feed_dict={self.context:
-                                       [contextTokens]})[:,
-                                                         len(contextTokens):]
+        out, present = self.backend.sample([newTokens],
+                                           past,
+                                           numSamples,
+                                           settings,
+                                           onStep=onStep)
+
+        # Keep the attention cache of the context for the next call.
+        self.cacheTokens = contextTokens
+        self.cachePast = present
+
+        return out, len(newTokens)
+
+    # The attention cache of the last context, as (tokens, past). (None
+    # if the model hasn't run yet)
+    def exportCache(self):
+        with self.lock:
+            if self.cachePast is None or len(self.cacheTokens) == 0:
+                return None
+            return list(self.cacheTokens), self.cachePast
+
+    # Sets the attention cache to 'past', the cache of 'tokens'. (Like
+    # exportCache returns) Only the part of it that the next context
+    # starts with is used. Returns False if 'past' doesn't fit the model.
+    def importCache(self, tokens: list, past):
+        if list(past.shape) != pastShape(self.hparams, 1, len(tokens)):
+            return False
+
+        with self.lock:
+            self.cacheTokens = list(tokens)
+            self.cachePast = past
+        return True
+
+    # Returns the part of the attention cache that can be reused for
+    # 'contextTokens', and the tokens that still have to be fed.
+    # If the context doesn't start with the cached tokens (rewind, or
+    # the memory moved forward) the cache is thrown out.
+    def _getCachedPast(self, contextTokens: list):
+        # The last token always has to be fed, so the model has
+        # something to generate from.
+        maxReuse = min(len(self.cacheTokens), len(contextTokens) - 1)
+
+        numReused = 0
+        while (numReused < maxReuse
+               and self.cacheTokens[numReused] == contextTokens[numReused]):
+            numReused += 1
+
+        if numReused == 0:
+            past = np.zeros(pastShape(self.hparams, 1, 0), dtype=np.float32)
+        else:
+            past = self.cachePast[..., :numReused, :]
+
+        return past, contextTokens[numReused:]
+
+
+# Passes the text of the first sample of a batch to 'onText' as it's
+# sampled. (For ModelManager.streamFromTokens) The text ends where
+# _decodeSamples cuts the sample.
+class SampleStreamer:
+    def __init__(self, modelManager: ModelManager, settings: dict, onText):
+        self.modelManager = modelManager
+        self.settings = settings
+        self.onText = onText
+        self.decoder = codecs.getincrementaldecoder('utf-8')(
+            errors=modelManager.enc.errors)
+        self.numSentences = 0
+        self.numSteps = 0
+        self.firstTokenTime = None
+        # The text passed on so far.
+        self.text = ""
+
+        # Set once the first sample is done (or the model failed).
+        self.finished = threading.Event()
+        self.done = False
+        self.doneTime = None
+        self.error = None
+
+    # Called with the tokens of each step. (The other samples keep going
+    # once the first one is done)
+    def onStep(self, samples):
+        if self.done:
+            return
+        if self.firstTokenTime is None:
+            self.firstTokenTime = time.perf_counter()
+        self.numSteps += 1
+
+        token = int(samples[0])
+        self._write(self.modelManager.enc.decodeBytes([token]))
+        self.numSentences += int(self.modelManager.sentenceTokens[token])
+        if self.modelManager._endsSample(token, self.numSentences,
+                                         self.settings):
+            self.finish()
+
+    # Passes on what's left of a split character. (Or if 'error' is given
+    # the first sample can't be finished)
+    def finish(self, error: Exception = None):
+        if self.done:
+            return
+        self.done = True
+        self.doneTime = time.perf_counter()
+        self.error = error
+        if error is None:
+            self._write(b"", final=True)
+        self.finished.set()
+
+    def _write(self, data: bytes, final: bool = False):
+        text = self.decoder.decode(data, final=final)
+        if len(text) > 0:
+            self.text += text
+            self.onText(text)
+
+
+# Shape of an attention cache. (Same as 'model.past_shape' from gpt-2)
+def pastShape(hparams, batchSize: int, sequence: int):
+    return [
+        batchSize, hparams.n_layer, 2, hparams.n_head, sequence,
+        hparams.n_embd // hparams.n_head
+    ]
+
+
+# Returns a string that changes if the encoder files change.
+# (Used to tell if saved tokens came from the same encoder)
+def getTokenizerId(modelDir: str, modelName: str):
+    tokenizerHash = hashlib.sha1()
+    for fileName in TOKENIZER_FILES:
+        with open(os.path.join(modelDir, modelName, fileName), 'rb') as f:
+            tokenizerHash.update(f.read())
+
+    return tokenizerHash.hexdigest()
+
+
+# Returns a string that changes if the model changes. (A new checkpoint,
+# hparams or encoder. Converting the weights also changes it)
+#
+# The weights themselves are too big to hash each time the game starts,
+# so the other files in the model's directory (the checkpoint's index and
+# data files, 'weights.bin') are only checked by size and modification
+# time. (Replacing the weights under the same checkpoint name changes it,
+# but so does copying the model)
+def getModelId(modelDir: str, modelName: str):
+    modelPath = os.path.join(modelDir, modelName)
+    modelHash = hashlib.sha1(getTokenizerId(modelDir, modelName).encode())
+    hashedFiles = ('hparams.json', 'checkpoint', 'weights.json')
+    for fileName in hashedFiles:
+        filePath = os.path.join(modelPath, fileName)
+        if not os.path.isfile(filePath):
+            continue
+        with open(filePath, 'rb') as f:
+            modelHash.update(fileName.encode() + b"\0" + f.read())
 
-        # Convert output tokens to a string
-        text = self.enc.decode(out[0])
+    for fileName in sorted(os.listdir(modelPath)):
+        filePath = os.path.join(modelPath, fileName)
+        # (The encoder files are in the tokenizer id)
+        if (fileName in hashedFiles or fileName in TOKENIZER_FILES
+                or not os.path.isfile(filePath)):
+            continue
+        stat = os.stat(filePath)
+        modelHash.update("{}\0{}\0{}\0".format(fileName, stat.st_size,
+                                               stat.st_mtime_ns).encode())
 
-        return text
+    return modelHash.hexdigest()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# Runs the model with just NumPy. (See 'model_manager.py' for what a
+# backend has to have)
+#
+# The forward pass is the same as 'model.py' from gpt-2, and sampling
+# works the same as 'tf_backend.sampleSequence'. The difference is the
+# attention cache. One buffer is made for the whole sample, and each step
+# writes its keys and values into it instead of concatenating.
+import numpy as np
+
+from . import checkpoint_reader, flat_weights
+
+
+class NumpyBackend:
+    # Contexts of different lengths can be padded to share a batch.
+    canPad = True
+
+    def __init__(self,
+                 hparams,
+                 modelPath: str,
+                 stopTokens,
+                 sentenceTokens,
+                 settings: dict,
+                 allowGpu: bool = False):
+        # (There is no GPU support, so 'allowGpu' and the default
+        # 'settings' aren't used)
+        self.hparams = hparams
+        self.modelPath = modelPath
+        self.stopTokens = stopTokens
+        self.sentenceTokens = sentenceTokens
+        self.rng = np.random.default_rng()
+
+    # Reads the weights from the checkpoint, or maps them from the flat
+    # weight file if there is one. (See 'flat_weights.py')
+    def load(self, setStage):
+        if flat_weights.hasWeights(self.modelPath):
+            setStage("Mapping the weights")
+            readTensor = flat_weights.loadWeights(self.modelPath).__getitem__
+        else:
+            setStage("Reading the checkpoint")
+            prefix = checkpoint_reader.latestCheckpoint(self.modelPath)
+            if prefix is None:
+                raise ValueError("No checkpoint in " + self.modelPath)
+            readTensor = checkpoint_reader.CheckpointReader(prefix).getTensor
+
+        def getTensor(name):
+            # (Float32 weights from the flat weight file aren't copied)
+            tensor = readTensor('model/' + name).astype(np.float32, copy=False)
+            # The conv1d weights are [1, nx, nf]
+            if tensor.ndim == 3:
+                tensor = tensor[0]
+            return tensor
+
+        self.wte = getTensor('wte')
+        self.wpe = getTensor('wpe')
+        self.lnfG = getTensor('ln_f/g')
+        self.lnfB = getTensor('ln_f/b')
+
+        # A dict of weights for each layer.
+        self.layers = []
+        for layer in range(self.hparams.n_layer):
+            weights = {}
+            for name in flat_weights.LAYER_TENSORS:
+                weights[name] = getTensor('h{}/{}'.format(layer, name))
+            self.layers.append(weights)
+
+    # Shape of an attention cache.
+    def pastShape(self, batchSize: int, sequence: int):
+        return [
+            batchSize, self.hparams.n_layer, 2, self.hparams.n_head, sequence,
+            self.hparams.n_embd // self.hparams.n_head
+        ]
+
+    # Same as TensorflowBackend.sample.
+    #
+    # 'padding' can be the number of padding tokens at the start of each
+    # of the contexts, so contexts of different lengths can be batched.
+    # The padding is masked, and the positions of each context start after
+    # it, so it doesn't change what's sampled. ('past' has to be empty)
+    def sample(self,
+               contexts: list,
+               past,
+               numSamples: int,
+               settings: dict,
+               onStep=None,
+               padding: list = None):
+        contexts = np.asarray(contexts, dtype=np.int32)
+        batchSize, contextLength = contexts.shape
+        pastLength = past.shape[-2]
+        length = settings['length']
+        contextLength += pastLength
+        if padding is not None:
+            padding = np.asarray(padding, dtype=np.int32)
+
+        # Run the uncached part of the context in one go, and sample
+        # the first token from the last position.
+        cache = np.zeros(self.pastShape(batchSize, contextLength),
+                         dtype=np.float32)
+        cache[..., :pastLength, :] = past
+        logits = self.forward(contexts, cache, pastLength, padding)[:, -1]
+        contextPresent = cache
+
+        # Repeat the context for each sample, with room for the
+        # sampled tokens.
+        cache = np.zeros(self.pastShape(batchSize * numSamples,
+                                        contextLength + length - 1),
+                         dtype=np.float32)
+        cache[..., :contextLength, :] = np.repeat(contextPresent,
+                                                  numSamples,
+                                                  axis=0)
+        samples = self._sampleLogits(np.repeat(logits, numSamples, axis=0),
+                                     settings)
+        if padding is not None:
+            padding = np.repeat(padding, numSamples)
+
+        output = [samples]
+        done = self.stopTokens[samples]
+        numSentences = self.sentenceTokens[samples].astype(np.int32)
+        maxSentences = settings['maxSentences']
+        stopped = onStep is not None and onStep(samples)
+        for i in range(length - 1):
+            if stopped:
+                break
+            if maxSentences > 0:
+                done |= numSentences >= maxSentences
+            if done.all():
+                break
+
+            logits = self.forward(samples[:, np.newaxis], cache,
+                                  contextLength + i, padding)[:, -1]
+            samples = self._sampleLogits(logits, settings)
+            output.append(samples)
+            done |= self.stopTokens[samples]
+            numSentences += self.sentenceTokens[samples]
+            stopped = onStep is not None and onStep(samples)
+
+        return np.stack(output, axis=1), contextPresent
+
+    # Runs 'tokens' through the model and returns the logits for each of
+    # them. 'cache' holds the keys and values of the first 'pastLength'
+    # positions, and gets the ones for 'tokens' written after them.
+    # 'padding' is the number of padding positions at the start of each
+    # row, or None. (See 'sample')
+    def forward(self, tokens, cache, pastLength: int, padding=None):
+        sequence = tokens.shape[1]
+        positions = np.arange(pastLength, pastLength + sequence)
+        if padding is not None:
+            # (The padding itself just gets position 0)
+            positions = np.maximum(positions - padding[:, np.newaxis], 0)
+        h = self.wte[tokens] + self.wpe[positions]
+
+        for layer, weights in enumerate(self.layers):
+            layerCache = cache[:, layer, :, :, :pastLength + sequence]
+            a = self._attn(norm(h, weights['ln_1/g'], weights['ln_1/b']),
+                           weights, layerCache, pastLength, padding)
+            h = h + a
+            m = self._mlp(norm(h, weights['ln_2/g'], weights['ln_2/b']),
+                          weights)
+            h = h + m
+
+        h = norm(h, self.lnfG, self.lnfB)
+        return h @ self.wte.T
+
+    def _attn(self, x, weights, cache, pastLength: int, padding=None):
+        batchSize, sequence, nx = x.shape
+        numHeads = self.hparams.n_head
+
+        def splitHeads(x):
+            # From [batch, sequence, features] to
+            # [batch, heads, sequence, features]
+            return x.reshape(batchSize, sequence, numHeads,
+                             -1).transpose(0, 2, 1, 3)
+
+        c = x @ weights['attn/c_attn/w'] + weights['attn/c_attn/b']
+        q, k, v = map(splitHeads, np.split(c, 3, axis=2))
+        cache[:, 0, :, pastLength:] = k
+        cache[:, 1, :, pastLength:] = v
+        k = cache[:, 0]
+        v = cache[:, 1]
+
+        w = q @ k.transpose(0, 1, 3, 2)
+        w *= 1 / np.sqrt(np.float32(v.shape[-1]))
+
+        # Positions can't see anything after them. (There is nothing
+        # after a single new token)
+        if sequence > 1:
+            numSource = k.shape[-2]
+            i = np.arange(sequence)[:, np.newaxis]
+            j = np.arange(numSource)
+            mask = i >= j - numSource + sequence
+            w = np.where(mask, w, np.float32(-1e10))
+
+        # Nothing can see the padding.
+        if padding is not None:
+            mask = np.arange(k.shape[-2]) >= padding[:, np.newaxis]
+            w = np.where(mask[:, np.newaxis, np.newaxis], w, np.float32(-1e10))
+
+        a = softmax(w) @ v
+        a = a.transpose(0, 2, 1, 3).reshape(batchSize, sequence, nx)
+        return a @ weights['attn/c_proj/w'] + weights['attn/c_proj/b']
+
+    def _mlp(self, x, weights):
+        h = gelu(x @ weights['mlp/c_fc/w'] + weights['mlp/c_fc/b'])
+        return h @ weights['mlp/c_proj/w'] + weights['mlp/c_proj/b']
+
+    # Samples one token for each row of 'logits'.
+    def _sampleLogits(self, logits, settings: dict):
+        logits = logits / np.float32(settings['temperature'])
+        if settings['topP'] > 0.0:
+            logits = topPLogits(logits, settings['topP'])
+        else:
+            logits = topKLogits(logits, settings['topK'])
+
+        probs = np.cumsum(softmax(logits.astype(np.float64)), axis=-1)
+        points = self.rng.random((len(logits), 1)) * probs[:, -1:]
+        samples = (probs < points).sum(axis=-1)
+        return np.minimum(samples, logits.shape[-1] - 1).astype(np.int32)
+
+
+def softmax(x):
+    x = x - x.max(axis=-1, keepdims=True)
+    ex = np.exp(x)
+    return ex / ex.sum(axis=-1, keepdims=True)
+
+
+def gelu(x):
+    return 0.5 * x * (1 + np.tanh(
+        np.float32(np.sqrt(2 / np.pi)) * (x + np.float32(0.044715) * x**3)))
+
+
+def norm(x, g, b, epsilon: float = 1e-5):
+    u = x.mean(axis=-1, keepdims=True)
+    s = np.square(x - u).mean(axis=-1, keepdims=True)
+    x = (x - u) / np.sqrt(s + np.float32(epsilon))
+    return x * g + b
+
+
+# Same as 'tf_backend.topKLogits'.
+def topKLogits(logits, k: int):
+    if k <= 0:
+        return logits
+
+    k = min(k, logits.shape[-1])
+    minValues = np.partition(logits, -k, axis=-1)[:, -k, np.newaxis]
+    return np.where(logits < minValues, np.float32(-1e10), logits)
+
+
+# Same as 'tf_backend.topPLogits'.
+def topPLogits(logits, p: float):
+    logitsSort = -np.sort(-logits, axis=-1)
+    probsSort = softmax(logitsSort)
+    probsSums = np.cumsum(probsSort, axis=-1) - probsSort
+    logitsMasked = np.where(probsSums < p, logitsSort, np.float32(1000))
+    minLogits = logitsMasked.min(axis=-1, keepdims=True)
+    return np.where(logits < minLogits, np.float32(-1e10), logits)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# Pre-sampled AI responses for the first turn of a new game.
+#
+# A new game starts with a prompt from StoryStarter, made from a template
+# (genre, class, item1, item2, prompt) and the character's name. If the
+# player's first input is "continue" (or nothing) the AI only sees that
+# prompt, so its responses can be sampled ahead of time. Each template
+# is sampled once, with PLACEHOLDER_NAME as the name, and the player's
+# name is put in its place when the responses are used.
+#
+# Usage: python -m src.opening_cache [--openings 3]
+#
+# 'game_data/openings.json' looks like this...
+# {
+#   "version": 1,
+#   "modelId": "...",     (See ModelManager.modelId)
+#   "databaseId": "...",  (Changes with 'storyDatabase.json')
+#   "templates": [
+#     {
+#       "template": ["fantasy", "knight", "sword", "shield", "You ..."],
+#       "openings": ["The AI's response", ...]
+#     },
+#     ...
+#   ]
+# }
+#
+# The file isn't used if either id doesn't match, so a new checkpoint or
+# a changed story database never gets old responses. (Run the command
+# again to sample new ones)
+#
+# Only the responses are stored. The prompt's tokens would save less than
+# a tenth of a millisecond, and its attention cache can't be shared, since
+# the name is the third token and every token after it depends on it.
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+CACHE_VERSION = 1
+# The character's name in the sampled prompts.
+PLACEHOLDER_NAME = "Alex"
+PLACEHOLDER_REGEX = re.compile(r"\b" + PLACEHOLDER_NAME + r"\b")
+
+
+# Returns a string that changes if the story database changes.
+def getDatabaseId(databasePath: str):
+    with open(databasePath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class OpeningCache:
+    # Reads the openings in 'cachePath', if they were sampled with the
+    # model 'modelId' from the database 'databaseId'.
+    def __init__(self, cachePath: str, modelId: str, databaseId: str):
+        # template -> openings
+        self.openings = {}
+
+        try:
+            with open(cachePath, "r") as f:
+                cacheData = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if (cacheData.get('version') != CACHE_VERSION
+                or cacheData.get('modelId') != modelId
+                or cacheData.get('databaseId') != databaseId):
+            return
+
+        for entry in cacheData['templates']:
+            self.openings[tuple(entry['template'])] = entry['openings']
+
+    def __len__(self):
+        return len(self.openings)
+
+    # The openings for a template, for the character 'charName'.
+    # ([] if it doesn't have any)
+    def get(self, template: tuple, charName: str):
+        # (A function, so a name with a '\' in it isn't taken as an escape)
+        return [
+            PLACEHOLDER_REGEX.sub(lambda match: charName, x)
+            for x in self.openings.get(tuple(template), [])
+        ]
+
+
+# Samples 'numOpenings' openings for every template in the story database
+# at 'databasePath', and writes them to 'cachePath'. Each one is sampled
+# by a new Game, exactly like the first "continue" of a game would be.
+# 'onProgress' is called with (done, total) after each template.
+def buildCache(modelManager,
+               databasePath: str,
+               cachePath: str,
+               numOpenings: int = 3,
+               onProgress=None):
+    # (Imported here, since 'game.py' imports this)
+    from .game import Game
+    from .story_starter import StoryStarter
+
+    templates = StoryStarter(databasePath).listTemplates()
+    entries = []
+    for i, template in enumerate(templates):
+        # (Each game gets its own directory, since games started in the
+        # same second have the same save file)
+        savesDir = tempfile.mkdtemp()
+        game = Game(modelManager,
+                    savesDir,
+                    savesDir,
+                    databasePath,
+                    numCandidates=numOpenings)
+        prompt = game.storyStarter.makePrompt(PLACEHOLDER_NAME, template)
+        game.startGame("custom",
+                       PLACEHOLDER_NAME,
+                       template[1],
+                       customPrompt=prompt)
+        game.gameCommand("")
+        game.quitGame()
+        shutil.rmtree(savesDir)
+
+        entries.append({
+            'template': list(template),
+            'openings': [game.currentText] + game.candidates,
+        })
+        if onProgress is not None:
+            onProgress(i + 1, len(templates))
+
+    cacheData = {
+        'version': CACHE_VERSION,
+        'modelId': modelManager.modelId,
+        'databaseId': getDatabaseId(databasePath),
+        'templates': entries,
+    }
+    with open(cachePath + ".tmp", "w") as f:
+        json.dump(cacheData, f, indent=2)
+    os.replace(cachePath + ".tmp", cachePath)
+
+
+if __name__ == "__main__":
+    from . import model_manager
+
+    parser = argparse.ArgumentParser(
+        description="Sample the AI's first response to each story prompt.")
+    parser.add_argument("--model-dir",
+                        dest="modelDir",
+                        default="gpt2-model",
+                        help="Directory with the model.")
+    parser.add_argument("--model-name",
+                        dest="modelName",
+                        default="rpg_model",
+                        help="Model in '--model-dir' to use.")
+    parser.add_argument("--backend",
+                        choices=list(model_manager.BACKENDS.keys()),
+                        default="tensorflow")
+    parser.add_argument("--database",
+                        default=os.path.join("game_data",
+                                             "storyDatabase.json"),
+                        help="Story database with the prompts.")
+    parser.add_argument("--output",
+                        default=os.path.join("game_data", "openings.json"),
+                        help="Where the openings are written.")
+    parser.add_argument("--openings",
+                        type=int,
+                        default=3,
+                        help="Number of openings for each prompt. (The "
+                        "extras are used by '/retry')")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    modelManager = model_manager.ModelManager(args.modelDir,
+                                              args.modelName,
+                                              backend=args.backend)
+
+    def showProgress(done, total):
+        print("\r{}/{} prompts".format(done, total), end="", flush=True)
+
+    buildCache(modelManager, args.database, args.output, args.openings,
+               showProgress)
+    print("\nWrote {} in {:.0f}s".format(args.output,
+                                         time.perf_counter() - start))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# A small sidecar file for each save, so the saves can be listed without
+# reading every story.
+#
+# '<save>.meta' looks like this...
+# {
+#   "genre": "fantasy",
+#   "class": "knight",
+#   "player": "Alex",
+#   "turns": 12,             (Number of actions in the transcript)
+#   "modified": 1700000000,  (When it was written)
+#   "storySize": 1234,       (Size of the save, and its journal, when it
+#   "journalSize": 56        was written)
+# }
+#
+# StoryManager writes it along with the save. If the sizes don't match
+# the files (the game crashed before writing it, or an older version
+# made the save) it's rebuilt from the save when it's listed.
+import json
+import os
+import time
+
+from . import save_format
+
+META_VERSION = 1
+
+
+def metaPath(storyFile: str):
+    return storyFile + ".meta"
+
+
+def journalPath(storyFile: str):
+    return storyFile + ".journal"
+
+
+# The text of the sidecar for a story.
+def makeMeta(storyData: dict, turns: int, storySize: int, journalSize: int):
+    return json.dumps({
+        'version': META_VERSION,
+        'genre': storyData.get('genre', ""),
+        'class': storyData.get('class', ""),
+        'player': storyData.get('player', ""),
+        'turns': turns,
+        'modified': time.time(),
+        'storySize': storySize,
+        'journalSize': journalSize,
+    })
+
+
+# Lists the saves in 'savesPath', newest first. Returns 'limit' of them
+# (or all of them if 'limit' is None) starting at 'offset', and the total
+# number of saves.
+#
+# Each save is a dict with 'filePath', 'fileName', 'genre', 'class',
+# 'player', 'turns' and 'modified'. Only the saves that are returned have
+# their sidecar read.
+def listSaves(savesPath: str, offset: int = 0, limit: int = None):
+    sizes = {}
+    modified = {}
+    saves = []
+    with os.scandir(savesPath) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            sizes[entry.name] = stat.st_size
+            modified[entry.name] = stat.st_mtime
+            if save_format.isStoryFile(entry.name):
+                saves.append(entry.name)
+
+    # (An old save that was converted, but not removed yet, is left out)
+    saves = [
+        x for x in saves
+        if save_format.savePath(x) == x or save_format.savePath(x) not in sizes
+    ]
+
+    # (A save with a journal was last changed when its journal was)
+    def lastModified(name):
+        return max(modified[name], modified.get(journalPath(name), 0))
+
+    saves.sort(key=lastModified, reverse=True)
+    total = len(saves)
+    if limit is None:
+        limit = total
+
+    savesInfo = []
+    for name in saves[offset:offset + limit]:
+        filePath = os.path.join(savesPath, name)
+        meta = readMeta(filePath, sizes[name], sizes.get(journalPath(name), 0))
+        if meta is None:
+            meta = rebuildMeta(filePath)
+
+        saveInfo = {}
+        saveInfo['filePath'] = filePath
+        saveInfo['fileName'] = os.path.splitext(name)[0]
+        saveInfo['genre'] = meta['genre']
+        saveInfo['class'] = meta['class']
+        saveInfo['player'] = meta['player']
+        saveInfo['turns'] = meta['turns']
+        saveInfo['modified'] = lastModified(name)
+        savesInfo.append(saveInfo)
+
+    return savesInfo, total
+
+
+# Reads the sidecar of a save. Returns None if there isn't one, or it
+# doesn't match the save's files.
+def readMeta(storyFile: str, storySize: int, journalSize: int):
+    try:
+        with open(metaPath(storyFile), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (meta.get('version') != META_VERSION
+            or meta.get('storySize') != storySize
+            or meta.get('journalSize') != journalSize):
+        return None
+    return meta
+
+
+# Makes the sidecar of a save from the save (and its journal), and
+# writes it. Returns the new sidecar.
+def rebuildMeta(storyFile: str):
+    storyData = save_format.readStory(storyFile)
+    turns = len(storyData.get('transcript', []))
+
+    # Count the actions that were added (or reverted) in the journal.
+    # (The same way StoryManager replays it)
+    journalSize = 0
+    if os.path.isfile(journalPath(storyFile)):
+        journalSize = os.path.getsize(journalPath(storyFile))
+        with open(journalPath(storyFile), "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['seq'] <= storyData.get('journalSeq', 0):
+                    continue
+                if record['op'] == "action":
+                    turns += 1
+                elif record['op'] == "revert":
+                    turns -= 1
+
+    text = makeMeta(storyData, turns, os.path.getsize(storyFile), journalSize)
+    try:
+        with open(metaPath(storyFile), "w", newline="") as f:
+            f.write(text)
+    except OSError:
+        # (The list still works if the saves can't be written to)
+        pass
+
+    return json.loads(text)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Reads and writes story files.
+#
+# Older story files are the storyData dict as indented JSON, with a copy
+# of each action in every list it's in. (See 'story_manager.py')
+#
+# Story files from this version start with a header line...
+# RPG-SAVE 2 zlib
+# and the rest of the file is the storyData as compact JSON, compressed
+# with the codec named in the header. ('zlib' or 'lzma')
+#
+# Each action is only stored once, in 'actions', and the three lists hold
+# indexes into it...
+# storyData['actions'] = [action, action, ...]
+# storyData['transcript'] = [0, 1, 2, ...]
+# storyData['curMemory'] = [1, 2]
+# storyData['savedActions'] = [0]
+#
+# readStory() returns the storyData of either version with the three
+# lists of actions. (An action in more than one list is the same dict)
+#
+# Story files from this version end in '.save', since they aren't JSON
+# anymore. Older saves end in '.json', and are written as '.save' the
+# next time they're saved. (See savePath)
+import json
+import lzma
+import os
+import zlib
+
+MAGIC = b"RPG-SAVE"
+SAVE_VERSION = 2
+# The codec used to write new files.
+CODEC = "zlib"
+
+ACTION_LISTS = ('transcript', 'curMemory', 'savedActions')
+
+SAVE_EXTENSION = ".save"
+# The extension of the older story files.
+OLD_EXTENSION = ".json"
+
+
+# True if 'fileName' is a story file. (From either version)
+def isStoryFile(fileName: str):
+    extension = os.path.splitext(fileName)[1].lower()
+    return extension in (SAVE_EXTENSION, OLD_EXTENSION)
+
+
+# The path 'storyFile' is written to. (The same path, unless it's an older
+# '.json' save)
+def savePath(storyFile: str):
+    root, extension = os.path.splitext(storyFile)
+    if extension.lower() == OLD_EXTENSION:
+        return root + SAVE_EXTENSION
+    return storyFile
+
+
+# Makes the file of a storyData dict with the three lists of actions.
+# (Actions with the same 'id' are stored once)
+def encodeStory(storyDict: dict, codec: str = CODEC):
+    storyData = dict(storyDict)
+    actions = []
+    indexes = {}
+    for listName in ACTION_LISTS:
+        actionIndexes = []
+        for action in storyDict[listName]:
+            key = action.get('id')
+            if key is None or key not in indexes:
+                actions.append(action)
+                if key is not None:
+                    indexes[key] = len(actions) - 1
+                actionIndexes.append(len(actions) - 1)
+            else:
+                actionIndexes.append(indexes[key])
+        storyData[listName] = actionIndexes
+    storyData['actions'] = actions
+
+    data = json.dumps(storyData, separators=(',', ':')).encode("utf-8")
+    if codec == "zlib":
+        data = zlib.compress(data, 1)
+    elif codec == "lzma":
+        data = lzma.compress(data)
+    else:
+        raise ValueError("Unknown save codec: {}".format(codec))
+
+    header = "{} {} {}\n".format(MAGIC.decode(), SAVE_VERSION, codec)
+    return header.encode("utf-8") + data
+
+
+# The storyData dict of a story file's contents, with the three lists of
+# actions. (From either version)
+def decodeStory(data: bytes):
+    if not data.startswith(MAGIC):
+        return json.loads(data.decode("utf-8"))
+
+    header, data = data.split(b"\n", 1)
+    version, codec = header.decode("utf-8").split(" ")[1:3]
+    if int(version) > SAVE_VERSION:
+        raise ValueError(
+            "The save is from a newer version (save version {})".format(
+                version))
+
+    if codec == "zlib":
+        data = zlib.decompress(data)
+    elif codec == "lzma":
+        data = lzma.decompress(data)
+    else:
+        raise ValueError("Unknown save codec: {}".format(codec))
+
+    storyData = json.loads(data.decode("utf-8"))
+    actions = storyData.pop('actions')
+    for listName in ACTION_LISTS:
+        storyData[listName] = [actions[x] for x in storyData[listName]]
+    return storyData
+
+
+def readStory(filePath: str):
+    with open(filePath, "rb") as f:
+        return decodeStory(f.read())
+
+
+# True if the file is in the older (uncompressed JSON) format.
+def isOldFormat(filePath: str):
+    with open(filePath, "rb") as f:
+        return f.read(len(MAGIC)) != MAGIC
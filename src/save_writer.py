@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Writes save files in a background thread, so the game never waits on
+# the disk.
+#
+# The text (or bytes) to write is made by the caller (so it can't change
+# while it's being written), and queued as one of...
+# - replace(path, text): Writes 'text' to a temp file, and then moves it
+#   over 'path' with os.replace. (So 'path' is never half written)
+# - append(path, text): Adds 'text' to the end of 'path'. (Appends aren't
+#   fsynced, so after a power cut the end of an appended file can be lost
+#   even though it was written)
+# - remove(path): Removes 'path' if it exists.
+#
+# The worker waits 'delay' seconds after the first request of a burst,
+# and then writes everything that was queued. A replace drops the queued
+# writes to the same path (and to 'clearPath', see replace), and appends
+# to the same file are done as one write.
+#
+# At most 'delay' seconds of saves (plus the ones being written) are lost
+# if the game crashes, and if more than 'maxPending' requests are queued
+# the game waits for them to be written. flush() waits for everything,
+# and close() also stops the worker. (Anything after that is written
+# right away)
+import os
+import threading
+import time
+
+
+class SaveWriter:
+    def __init__(self, delay: float = 0.05, maxPending: int = 1000):
+        self.delay = delay
+        self.maxPending = maxPending
+
+        # Queued requests, as [op, path, text] lists in the order they
+        # were made.
+        self.pending = []
+        # Number of requests the worker took that aren't written yet.
+        self.writing = 0
+        # The last error from writing (of any kind, the worker keeps going),
+        # raised by the next flush().
+        self.error = None
+
+        self.condition = threading.Condition()
+        self.flushing = False
+        self.closed = False
+        self.worker = threading.Thread(target=self._worker, daemon=True)
+        self.worker.start()
+
+    # Replaces 'path' with 'text'. If 'clearPath' is given it is removed
+    # after 'path' is replaced, and the appends queued to it are dropped.
+    # (Like a journal that 'text' already includes)
+    def replace(self, path: str, text: str, clearPath: str = None):
+        with self.condition:
+            self.pending = [
+                x for x in self.pending
+                if x[1] != path and (clearPath is None or x[1] != clearPath)
+            ]
+            self._queue(['replace', path, text])
+            if clearPath is not None:
+                self._queue(['remove', clearPath, None])
+
+    def append(self, path: str, text: str):
+        with self.condition:
+            last = self.pending[-1] if len(self.pending) > 0 else None
+            if last is not None and last[0] == 'append' and last[1] == path:
+                last[2] += text
+                return
+            self._queue(['append', path, text])
+
+    def remove(self, path: str):
+        with self.condition:
+            self.pending = [x for x in self.pending if x[1] != path]
+            self._queue(['remove', path, None])
+
+    # Waits until everything queued has been written. Raises the error
+    # if a write failed.
+    def flush(self):
+        with self.condition:
+            self.flushing = True
+            self.condition.notify_all()
+            while len(self.pending) > 0 or self.writing > 0:
+                self.condition.wait()
+            self.flushing = False
+
+            error = self.error
+            self.error = None
+        if error is not None:
+            raise error
+
+    # Waits until everything queued has been written, and stops the worker.
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.worker.join()
+
+    # (Has to be called with self.condition held)
+    def _queue(self, request: list):
+        if self.closed:
+            writeFile(*request)
+            return
+        while len(self.pending) >= self.maxPending:
+            self.condition.notify_all()
+            self.condition.wait()
+        self.pending.append(request)
+        self.condition.notify_all()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0:
+                    if self.closed:
+                        return
+                    self.condition.wait()
+                # Let the rest of the burst come in.
+                deadline = time.monotonic() + self.delay
+                while not self.flushing and len(
+                        self.pending) < self.maxPending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                requests = self.pending
+                self.pending = []
+                self.writing = len(requests)
+                self.condition.notify_all()
+
+            for op, path, text in requests:
+                try:
+                    writeFile(op, path, text)
+                except Exception as e:
+                    # (Not just OSError. If the worker stopped, flush()
+                    # would wait forever)
+                    self.error = e
+
+            with self.condition:
+                self.writing = 0
+                self.condition.notify_all()
+
+
+# Does one request. (Also used to write without a SaveWriter)
+# (Newlines aren't translated, so the files are the size of 'text')
+def writeFile(op: str, path: str, text):
+    if op == 'replace':
+        tempPath = path + ".tmp"
+        if isinstance(text, bytes):
+            f = open(tempPath, "wb")
+        else:
+            f = open(tempPath, "w", newline="")
+        with f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempPath, path)
+    elif op == 'append':
+        with open(path, "a", newline="") as f:
+            f.write(text)
+    elif op == 'remove':
+        if os.path.isfile(path):
+            os.remove(path)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Generates AI responses in the background before they are asked for.
+#
+# While the player is typing, 'speculate' is given the seeds that are the
+# most likely to be sent to the AI next (for example the seed for the
+# "continue" action), along with the sampling settings to use for each.
+# A worker thread runs them through 'generate', and if the next seed the
+# game needs is one of them (with the same settings) 'take' returns the
+# result without running the AI again.
+#
+# Seeds that end up not being used are thrown away, and one that is still
+# being generated is stopped, so it doesn't keep the model from the seed
+# the game needs. A turn that needed a seed that wasn't speculated counts
+# as a miss.
+import queue
+import threading
+
+
+class SpeculationJob:
+    def __init__(self, seed: tuple, settings: dict):
+        self.seed = seed
+        self.settings = settings
+        self.result = None
+        # Set when the job is thrown away. (Stops the generation)
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+
+class Speculator:
+    def __init__(self, generate):
+        # 'generate' takes a seed (a tuple of tokens), a dictionary of
+        # sampling settings and a threading.Event, and returns the AI
+        # output for it. It should stop early once the event is set.
+        # (The output is thrown away then)
+        self.generate = generate
+        self.jobs = {}
+        self.jobQueue = queue.Queue()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.worker = threading.Thread(target=self._worker, daemon=True)
+        self.worker.start()
+
+    # Start generating for 'seeds', a list of (seed, settings) tuples
+    # (most likely first). Jobs that aren't in 'seeds' anymore are
+    # thrown away.
+    def speculate(self, seeds: list):
+        keys = [self._jobKey(seed, settings) for seed, settings in seeds]
+
+        for key in list(self.jobs.keys()):
+            if key not in keys:
+                self._discard(self.jobs.pop(key))
+
+        for key, (seed, settings) in zip(keys, seeds):
+            if key not in self.jobs:
+                job = SpeculationJob(seed, settings)
+                self.jobs[key] = job
+                self.jobQueue.put(job)
+
+    # Returns the result for 'seed' if it was speculated with the same
+    # settings (waiting for it to finish if needed), otherwise returns
+    # None. Every other speculated seed is thrown away.
+    # (Meant to be called once for each turn)
+    def take(self, seed: tuple, settings: dict):
+        job = self.jobs.pop(self._jobKey(seed, settings), None)
+        speculated = len(self.jobs) > 0 or job is not None
+        for otherJob in self.jobs.values():
+            self._discard(otherJob)
+        self.jobs = {}
+
+        if job is None:
+            if speculated:
+                self.misses += 1
+            return None
+
+        job.done.wait()
+        if job.result is None:
+            # The generation failed, so don't count it.
+            return None
+
+        self.hits += 1
+        return job.result
+
+    # Throws away everything that hasn't been taken yet.
+    def cancel(self):
+        for job in self.jobs.values():
+            self._discard(job)
+        self.jobs = {}
+
+    # Fraction of turns that used a speculated seed, out of the turns
+    # that had any. (None if there hasn't been any speculation yet)
+    def hitRate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return None
+        return self.hits / total
+
+    def _jobKey(self, seed: tuple, settings: dict):
+        return (seed, tuple(sorted(settings.items())))
+
+    def _discard(self, job: SpeculationJob):
+        job.cancelled.set()
+
+    def _worker(self):
+        while True:
+            job = self.jobQueue.get()
+            if not job.cancelled.is_set():
+                try:
+                    job.result = self.generate(job.seed, job.settings,
+                                               job.cancelled)
+                except Exception:
+                    job.result = None
+                if job.cancelled.is_set():
+                    # (It may have been stopped part of the way through)
+                    job.result = None
+            job.done.set()
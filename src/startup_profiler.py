@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Times the imports made while the game starts, for
+# 'play_game.py --profile-startup'.
+#
+# ImportProfiler goes first in sys.meta_path, so it's asked about each
+# module that isn't imported yet. It finds the module with the other
+# finders, and wraps its loader so the time to create and run the module
+# is recorded. Imports made while a module runs are its children, so the
+# times make a tree like 'python -X importtime' prints...
+#
+#   cumulative  self  module
+#      152.1ms  4.5ms src.game
+#      110.9ms  3.8ms   src.model_manager
+#
+# Only the imports of the thread that started the profiler are timed.
+# (The model loads in a thread of its own, which doesn't keep the menus
+# from showing)
+import sys
+import threading
+import time
+
+
+class ImportNode:
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.children = []
+
+    def selfSeconds(self):
+        return self.seconds - sum(x.seconds for x in self.children)
+
+
+class ImportProfiler:
+    def __init__(self):
+        self.threadId = threading.get_ident()
+        self.root = ImportNode("")
+        # The modules being imported right now, and when each started.
+        self.stack = [(self.root, None)]
+
+    def start(self):
+        sys.meta_path.insert(0, self)
+
+    def stop(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    # Called by the import system for each module that isn't imported.
+    def find_spec(self, name, path, target=None):
+        if threading.get_ident() != self.threadId:
+            return None
+
+        for finder in sys.meta_path:
+            findSpec = getattr(finder, 'find_spec', None)
+            if finder is self or findSpec is None:
+                continue
+            spec = findSpec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = TimedLoader(self, name, spec.loader)
+        return spec
+
+    def _startModule(self, name: str):
+        node = ImportNode(name)
+        self.stack[-1][0].children.append(node)
+        self.stack.append((node, time.perf_counter()))
+
+    def _endModule(self):
+        node, start = self.stack.pop()
+        node.seconds = time.perf_counter() - start
+
+    # Seconds spent importing. (By the top level imports)
+    def totalSeconds(self):
+        return sum(x.seconds for x in self.root.children)
+
+    # The import tree as text. Modules that took less than 'minSeconds'
+    # (with their imports) are left out.
+    def report(self, minSeconds: float = 0.001):
+        lines = ["{:>10} {:>8}  module".format("cumulative", "self")]
+
+        def addNode(node, depth):
+            if node.seconds < minSeconds:
+                return
+            lines.append("{:>8.1f}ms {:>6.1f}ms {}{}".format(
+                node.seconds * 1000,
+                node.selfSeconds() * 1000, "  " * depth, node.name))
+            for child in node.children:
+                addNode(child, depth + 1)
+
+        for node in self.root.children:
+            addNode(node, 0)
+
+        return "\n".join(lines)
+
+
+# Wraps a module's loader to time it. (The module gets the real loader
+# back before it runs)
+class TimedLoader:
+    def __init__(self, profiler: ImportProfiler, name: str, loader):
+        self.profiler = profiler
+        self.name = name
+        self.loader = loader
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+    def create_module(self, spec):
+        self.profiler._startModule(self.name)
+        try:
+            return self.loader.create_module(spec)
+        except BaseException:
+            self.profiler._endModule()
+            raise
+
+    def exec_module(self, module):
+        module.__loader__ = self.loader
+        if getattr(module, '__spec__', None) is not None:
+            module.__spec__.loader = self.loader
+
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler._endModule()
@@ -17,50 +17,269 @@
 #
 # Each item in each list will contain an action.
 #
+# (The story file stores each action once, and the lists refer to it.
+# See 'save_format.py') An older '.json' story file is moved to a '.save'
+# file the next time the whole story is saved.
+#
 # This 'action' dictionary will look like this...
 #
 # action = {}
 # action['aiText'] = "<insert ai generate text>"
 # action['userText'] = "<insert user's text>"
+# // Identifies the action. (The same action can be in all three lists)
+# action['id'] = 0
+# // The action's text as tokens, stored as a string of space separated
+# // token ids. (Only if an encoder was given, see 'createAction')
+# action['tokens'] = "<token ids>"
+#
+# While the story is loaded the three lists aren't kept in 'storyData'.
+# Each action is stored once in 'self.actions' (id -> action), and the
+# lists only hold ids...
+# - self.transcript: A list of ids.
+# - self.curMemory: A deque of ids, that only keeps the last 'memorySize'.
+# - self.savedActions: A dict of id -> None. (An ordered set)
+# So finding, adding, or removing an action doesn't compare dicts.
+# (Saves without ids get them when loaded. See '_loadActions')
+#
+# // Which tokenizer made the 'tokens' of each action. If it doesn't match
+# // the current tokenizer when the story is loaded the tokens are redone.
+# storyData['tokenizer'] = "<tokenizer id>"
+#
+# // The last journal record that is included in the file. (See below)
+# storyData['journalSeq'] = 0
+#
+# With 'journal=True' each change is appended to '<storyFile>.journal'
+# as one line of JSON, instead of rewriting the whole file...
+# {"seq": 4, "op": "save", "action": {...}}     (saveAction)
+# {"seq": 5, "op": "action", "id": 3}           (updateMemory)
+# {"seq": 6, "op": "prompt", "prompt": "..."}   (updateCurrentPrompt)
+# {"seq": 7, "op": "revert"}                    (revertAction)
+#
+# Every 'compactEvery' records the whole storyData is written to the
+# story file (as a temp file that replaces it), and the journal is
+# emptied. An action is only written in full the first time it's in
+# the journal (or if it isn't in the file), after that just its 'id' is.
+# Loading a story replays the records with a 'seq' after the
+# file's 'journalSeq', so a crash between the two steps doesn't apply a
+# record twice, and a half written last record is ignored.
+#
+# If a SaveWriter is given (see 'save_writer.py') the files are written
+# by it in the background, and flush() waits for them to be written.
+#
+# A small '<storyFile>.meta' file is written with the story file (and on
+# flush) so the saves can be listed quickly. (See 'save_catalog.py')
+#
+# The model's attention cache can also be kept in '<storyFile>.kv'. (See
+# saveAttentionCache and 'attention_cache.py')
+import collections
 import json
 import os
 
+from . import attention_cache, save_catalog, save_format
+from .save_writer import writeFile
+
 
 class StoryManager:
     def __init__(self,
                  storyFile: str,
                  storyDirectory: str,
-                 memorySize: int = 5):
+                 memorySize: int = 5,
+                 encoder=None,
+                 tokenBudget: int = None,
+                 tokenizerId: str = None,
+                 journal: bool = False,
+                 compactEvery: int = 100,
+                 writer=None):
         self.storyDirectory = os.path.abspath(storyDirectory)
         self.storyFile = os.path.join(self.storyDirectory, storyFile)
         self.storyData = {}
         self.memorySize = memorySize
 
+        # Used to turn actions into tokens for the AI seed.
+        # (Anything with an 'encode' method, like ModelManager.enc or
+        # ModelManager)
+        self.encoder = encoder
+        # Identifies the encoder, so tokens from a different one aren't
+        # used. (See ModelManager.tokenizerId)
+        self.tokenizerId = tokenizerId
+        # Max number of tokens in the AI seed. (None means no limit)
+        self.tokenBudget = tokenBudget
+        # Number of tokens in the last seed from getAISeed()
+        self.seedTokenCount = 0
+
+        # Append changes to a journal instead of rewriting the story file.
+        self.journal = journal
+        self.compactEvery = compactEvery
+        # Number of records in the journal.
+        self.journalRecords = 0
+        # True once the story file has been written (or read), so the
+        # journal has something to go with.
+        self.hasStoryFile = False
+        # Sizes of the story file and the journal once they're written,
+        # and if the '.meta' file needs to be written again.
+        self.storySize = 0
+        self.journalSize = 0
+        self.metaChanged = False
+
+        # Writes the files in the background. (None writes them right away)
+        self.writer = writer
+
+        # The actions of the story. (See the top of this file)
+        self.actions = {}
+        self.transcript = []
+        self.curMemory = collections.deque(maxlen=self.memorySize)
+        self.savedActions = {}
+        # The id given to the next new action.
+        self.nextActionId = 0
+        # id -> the action's tokens as a list, for the stored actions that
+        # have been in a seed.
+        self.tokenLists = {}
+
         # If file exists load it into self.storyData
         if os.path.isfile(self.storyFile):
-            with open(self.storyFile, "r") as f:
-                self.storyData = json.load(f)
+            self._readStory(self.storyFile)
         else:
             # if it doesn't exist initialize dictionary
             self.storyData['genre'] = ""
             self.storyData['class'] = ""
             self.storyData['player'] = ""
             self.storyData['currentPrompt'] = ""
-            self.storyData['transcript'] = []
-            self.storyData['curMemory'] = []
-            self.storyData['savedActions'] = []
+            self.storyData['tokenizer'] = self.tokenizerId
+            self.storyData['journalSeq'] = 0
 
     # Load saveData from file.
     def loadStoryData(self, filePath):
         if not os.path.isfile(filePath):
             return False
 
-        with open(filePath, "r") as f:
-            self.storyData = json.load(f)
+        # (The current story might still have writes queued)
+        self.flush()
+
         self.storyFile = filePath
+        self._readStory(filePath)
 
         return True
 
+    # Reads the story file, and replays its journal if it has one.
+    def _readStory(self, filePath: str):
+        self.storyData = save_format.readStory(filePath)
+        self.storyData.setdefault('journalSeq', 0)
+        self._loadActions(self.storyData.pop('transcript'),
+                          self.storyData.pop('curMemory'),
+                          self.storyData.pop('savedActions'))
+
+        self.journalRecords = 0
+        complete = True
+        journalPath = filePath + ".journal"
+        if os.path.isfile(journalPath):
+            with open(journalPath, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Only the last record can be half written.
+                        complete = False
+                        break
+                    if record['seq'] <= self.storyData['journalSeq']:
+                        continue
+                    self._applyRecord(record)
+                    self.storyData['journalSeq'] = record['seq']
+                    self.journalRecords += 1
+
+        self.hasStoryFile = True
+        self.storySize = os.path.getsize(filePath)
+        self.journalSize = 0
+        if os.path.isfile(journalPath):
+            self.journalSize = os.path.getsize(journalPath)
+        self.metaChanged = False
+        self._prepareTokens()
+
+        # Start a new journal, so nothing is appended after a half
+        # written record.
+        if not complete:
+            self.saveStory()
+
+    # Fills the action store from the three lists of a save.
+    def _loadActions(self, transcript: list, curMemory: list,
+                     savedActions: list):
+        self.actions = {}
+        self.transcript = []
+        self.curMemory = collections.deque(maxlen=self.memorySize)
+        self.savedActions = {}
+        self.nextActionId = 0
+        self.tokenLists = {}
+
+        # Older saves have copies of the actions without ids, so a copy
+        # in the memory or saved actions gets the id of the latest
+        # transcript action with the same text.
+        textIds = {}
+
+        def getId(action: dict, inTranscript: bool):
+            if 'id' in action:
+                return self._storeAction(action)
+
+            text = (action['aiText'], action['userText'])
+            if not inTranscript and text in textIds:
+                return textIds[text]
+
+            action['id'] = self.nextActionId
+            textIds[text] = self._storeAction(action)
+            return action['id']
+
+        for action in transcript:
+            self.transcript.append(getId(action, True))
+        for action in curMemory:
+            self.curMemory.append(getId(action, False))
+        for action in savedActions:
+            self.savedActions[getId(action, False)] = None
+
+    # Adds an action to self.actions (if it isn't there) and returns its id.
+    def _storeAction(self, action: dict):
+        if 'id' not in action:
+            action['id'] = self.nextActionId
+        actionId = action['id']
+        if actionId not in self.actions:
+            self.actions[actionId] = action
+        self.nextActionId = max(self.nextActionId, actionId + 1)
+
+        return actionId
+
+    # The action of a journal record. (See _actionRecord)
+    def _recordAction(self, record: dict):
+        if 'action' in record:
+            self._storeAction(record['action'])
+            return record['action']
+        return self.actions[record['id']]
+
+    def _applyRecord(self, record: dict):
+        if record['op'] == "action":
+            self._addToMemory(self._recordAction(record))
+        elif record['op'] == "save":
+            self.savedActions[self._recordAction(record)['id']] = None
+        elif record['op'] == "prompt":
+            self.storyData['currentPrompt'] = record['prompt']
+        elif record['op'] == "revert":
+            self._revert()
+
+    # Makes sure the tokens in the loaded actions came from our encoder,
+    # and adds them to actions in the memory that don't have them.
+    # (Older saves don't have any tokens)
+    def _prepareTokens(self):
+        if self.encoder is None:
+            return
+
+        if self.storyData.get('tokenizer') != self.tokenizerId:
+            for action in self.actions.values():
+                action.pop('tokens', None)
+            self.storyData['tokenizer'] = self.tokenizerId
+
+        # (The transcript isn't used for the seed, so its actions only
+        # get tokens when they are created)
+        for actionId in list(self.curMemory) + list(self.savedActions):
+            action = self.actions[actionId]
+            if 'tokens' not in action:
+                action['tokens'] = self._encodeTokens(self._actionText(action))
+
     # Change save location. (Also, removes the old file)
     def changeStoryFile(self, storyFile: str):
         # Store the old storyFile location
@@ -70,77 +289,312 @@ class StoryManager:
         # Dump the current save data into the new file.
         self.saveStory()
         # Delete the old file.
-        os.remove(oldStoryFile)
+        self._writeFile('remove', oldStoryFile)
+        self._writeFile('remove', oldStoryFile + ".journal")
+        self._writeFile('remove', save_catalog.metaPath(oldStoryFile))
+        self._writeFile('remove', attention_cache.cachePath(oldStoryFile))
 
     def updateCurrentPrompt(self, newPrompt: str):
         self.storyData['currentPrompt'] = newPrompt
-        self.saveStory()
+        self._record({'op': "prompt", 'prompt': newPrompt})
 
-    # Updates self.storyData['curMemory'] and self.storyData['transcript']
+    # Updates self.curMemory and self.transcript
     def updateMemory(self, action: dict):
-        self.storyData['transcript'].append(action)
+        record = self._actionRecord("action", action)
+        self._addToMemory(action)
 
-        self.storyData['curMemory'].append(action)
+        # Save storyData to file
+        self._record(record)
 
-        # Reduce self.storyData['curMemory'] to memorySize
-        if len(self.storyData['curMemory']) > self.memorySize:
-            index = len(self.storyData['curMemory']) - self.memorySize
-            self.storyData['curMemory'] = self.storyData['curMemory'][index:]
+    def _addToMemory(self, action: dict):
+        actionId = self._storeAction(action)
+        self.transcript.append(actionId)
 
-        # Save storyData to file
-        self.saveStory()
+        # (The deque drops the oldest action once it has memorySize)
+        self.curMemory.append(actionId)
 
-    # Updates self.storyData['savedActions']
+    # Updates self.savedActions
     def saveAction(self, action: dict):
-        self.storyData['savedActions'].append(action)
+        record = self._actionRecord("save", action)
+        self.savedActions[self._storeAction(action)] = None
 
-        self.saveStory()
+        self._record(record)
 
-    # Save storyData to json
+    # A journal record for 'action'. (Just the id if the action is
+    # already stored)
+    def _actionRecord(self, op: str, action: dict):
+        if action['id'] in self.actions:
+            return {'op': op, 'id': action['id']}
+        return {'op': op, 'action': action}
+
+    # storyData with the lists of actions, like it is saved.
+    def getStoryDict(self):
+        storyDict = dict(self.storyData)
+        storyDict['transcript'] = [self.actions[x] for x in self.transcript]
+        storyDict['curMemory'] = [self.actions[x] for x in self.curMemory]
+        storyDict['savedActions'] = [
+            self.actions[x] for x in self.savedActions
+        ]
+        return storyDict
+
+    # Save storyData to the story file. (And empty the journal)
+    # The file is replaced by a temp file, so a crash while saving
+    # doesn't leave a half written story.
     def saveStory(self):
-        with open(self.storyFile, "w") as f:
-            f.write(json.dumps(self.storyData, indent=2))
+        # (The new format isn't JSON, so it doesn't go in a '.json' file)
+        newStoryFile = save_format.savePath(self.storyFile)
+        if newStoryFile != self.storyFile:
+            self.changeStoryFile(newStoryFile)
+            return
+
+        # Reverted actions are dropped from the store, the same as if
+        # the story was loaded from the file.
+        used = set(self.transcript)
+        used.update(self.curMemory)
+        used.update(self.savedActions)
+        self.actions = {x: y for x, y in self.actions.items() if x in used}
+        self.tokenLists = {
+            x: y
+            for x, y in self.tokenLists.items() if x in used
+        }
+
+        data = save_format.encodeStory(self.getStoryDict())
+        journalPath = self.storyFile + ".journal"
+        if self.writer is not None:
+            self.writer.replace(self.storyFile, data, clearPath=journalPath)
+        else:
+            writeFile('replace', self.storyFile, data)
+            writeFile('remove', journalPath, None)
+
+        self.hasStoryFile = True
+        self.journalRecords = 0
+        self.storySize = len(data)
+        self.journalSize = 0
+        self._writeMeta()
+
+    # Writes 'past', the model's attention cache of 'tokens', next to the
+    # story. (See ModelManager.exportCache)
+    def saveAttentionCache(self, modelId: str, tokens: list, past):
+        data = attention_cache.encodeCache(modelId, tokens, past)
+        self._writeFile('replace', attention_cache.cachePath(self.storyFile),
+                        data)
+
+    # Reads the attention cache next to the story. Returns (tokens, past),
+    # or None if there isn't one from the model 'modelId'.
+    def loadAttentionCache(self, modelId: str):
+        return attention_cache.readCache(
+            attention_cache.cachePath(self.storyFile), modelId)
+
+    # Waits until the story is written. (Only needed with a SaveWriter)
+    # Also writes the '.meta' file if the journal changed since it was.
+    def flush(self):
+        if self.metaChanged:
+            self._writeMeta()
+        if self.writer is not None:
+            self.writer.flush()
+
+    # Same as flush, and stops the SaveWriter. (For when the game is done
+    # with the story)
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+    def _writeMeta(self):
+        text = save_catalog.makeMeta(self.storyData, len(self.transcript),
+                                     self.storySize, self.journalSize)
+        self._writeFile('replace', save_catalog.metaPath(self.storyFile), text)
+        self.metaChanged = False
+
+    # Saves a change. (Appends it to the journal in journal mode)
+    def _record(self, record: dict):
+        if (not self.journal or not self.hasStoryFile
+                or self.journalRecords >= self.compactEvery):
+            self.saveStory()
+            return
+
+        self.storyData['journalSeq'] += 1
+        record['seq'] = self.storyData['journalSeq']
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        self._writeFile('append', self.storyFile + ".journal", line)
+        self.journalRecords += 1
+        self.journalSize += len(line.encode("utf-8"))
+        self.metaChanged = True
+
+    def _writeFile(self, op: str, path: str, text: str = None):
+        if self.writer is None:
+            writeFile(op, path, text)
+        elif op == 'replace':
+            self.writer.replace(path, text)
+        elif op == 'append':
+            self.writer.append(path, text)
+        elif op == 'remove':
+            self.writer.remove(path)
 
     # Create action dictionary
-    def createAction(self, aiText: str, userText: str):
+    # If 'preview' (from previewAction) is for the same text its tokens are
+    # used, instead of encoding the text again.
+    def createAction(self, aiText: str, userText: str, preview: dict = None):
+        if (preview is None or preview['aiText'] != aiText
+                or preview['userText'] != userText):
+            preview = self.previewAction(aiText, userText)
+
         action = {}
         action['aiText'] = aiText
         action['userText'] = userText
+        action['id'] = self.nextActionId
+        self.nextActionId += 1
+        if 'tokens' in preview:
+            action['tokens'] = preview['tokens']
+
+        return action
+
+    # Same as createAction, but the action doesn't get an id, so nothing
+    # changes. (For the seed of an action that might not be made, see
+    # getAISeedTokens)
+    def previewAction(self, aiText: str, userText: str):
+        action = {}
+        action['aiText'] = aiText
+        action['userText'] = userText
+
+        # Tokenize the action once, instead of every time it's in a seed.
+        if self.encoder is not None:
+            action['tokens'] = self._encodeTokens(self._actionText(action))
 
         return action
 
     # Revert previous action (returns last aiText)
     def revertAction(self):
-        lastAction = self.storyData['curMemory'].pop()
+        aiText = self._revert()
+        self._record({'op': "revert"})
+
+        return aiText
+
+    def _revert(self):
+        lastId = self.curMemory.pop()
         # Also remove from transcript
-        self.storyData['transcript'].pop()
+        self.transcript.pop()
 
         # If lastAction exists in savedActions remove it from there.
-        if lastAction in self.storyData['savedActions']:
-            self.storyData['savedActions'].remove(lastAction)
+        self.savedActions.pop(lastId, None)
 
         # Return the aiText from that action
-        return lastAction['aiText']
+        return self.actions[lastId]['aiText']
 
     # Generates a string for the AI model using the contents of
-    # storyData['savedActions'] and storyData['curMemory']
-    def getAISeed(self):
-        seed = ""
+    # self.savedActions and self.curMemory
+    #
+    # If 'nextAction' is given the seed will be the one that would be
+    # made after 'updateMemory(nextAction)' (without changing anything).
+    def getAISeed(self, nextAction: dict = None):
+        seed, numTokens = self.buildAISeed(nextAction)
 
-        for action in self.storyData['savedActions']:
-            if action not in self.storyData['curMemory']:
-                seed += action['aiText'] + '\n> ' + action['userText'] + '\n'
-
-        for action in self.storyData['curMemory']:
-            seed += action['aiText'] + '\n> ' + action['userText'] + '\n'
+        if nextAction is None:
+            self.seedTokenCount = numTokens
 
         return seed
 
-    # Generates a string containing the entire storyData['transcript']
+    # Same as getAISeed, but returns a list of tokens for the AI model.
+    # (Made from the tokens stored in each action)
+    def getAISeedTokens(self, nextAction: dict = None):
+        actions, numTokens = self._getSeedActions(nextAction)
+
+        if nextAction is None:
+            self.seedTokenCount = numTokens
+
+        tokens = []
+        for action in actions:
+            tokens += self._actionTokens(action)
+
+        return tokens
+
+    # Same as getAISeed, but also returns the number of tokens in the seed.
+    def buildAISeed(self, nextAction: dict = None):
+        actions, numTokens = self._getSeedActions(nextAction)
+
+        seed = "".join([self._actionText(x) for x in actions])
+
+        return seed, numTokens
+
+    # Picks the actions that go into the seed, keeping it within
+    # self.tokenBudget tokens. Returns the actions and the number of
+    # tokens in them.
+    #
+    # The newest action always goes in, then the saved actions, and then
+    # the rest of the memory from newest to oldest. Once something doesn't
+    # fit, it and everything older than it is left out.
+    def _getSeedActions(self, nextAction: dict = None):
+        curMemory = [self.actions[x] for x in self.curMemory]
+        if nextAction is not None:
+            curMemory = (curMemory + [nextAction])[-self.memorySize:]
+
+        memoryIds = set([x.get('id') for x in curMemory])
+        savedActions = [
+            self.actions[x] for x in self.savedActions if x not in memoryIds
+        ]
+
+        tokenBudget = self.tokenBudget
+        if tokenBudget is None:
+            tokenBudget = float('inf')
+
+        numTokens = 0
+        if len(curMemory) > 0:
+            numTokens = self._countTokens(curMemory[-1])
+
+        def fillBudget(actions: list):
+            nonlocal numTokens
+
+            included = []
+            for action in reversed(actions):
+                actionTokens = self._countTokens(action)
+                if numTokens + actionTokens > tokenBudget:
+                    break
+                numTokens += actionTokens
+                included.append(action)
+
+            included.reverse()
+            return included
+
+        savedActions = fillBudget(savedActions)
+        curMemory = fillBudget(curMemory[:-1]) + curMemory[-1:]
+
+        return savedActions + curMemory, numTokens
+
+    # Generates a string containing the entire transcript
     def getTranscript(self):
-        transcript = ""
+        return "".join(
+            [self._actionText(self.actions[x]) for x in self.transcript])
+
+    # The text of an action, as it shows up in the seed and transcript.
+    def _actionText(self, action: dict):
+        return action['aiText'] + '\n> ' + action['userText'] + '\n'
+
+    # Encodes text into the string stored in action['tokens']
+    def _encodeTokens(self, text: str):
+        return " ".join(str(x) for x in self.encoder.encode(text))
+
+    # The tokens of an action as a list. ([] if there is no encoder)
+    # (Don't change the list, it might be cached)
+    def _actionTokens(self, action: dict):
+        actionId = action.get('id')
+        if actionId in self.tokenLists:
+            return self.tokenLists[actionId]
+
+        if 'tokens' in action:
+            tokens = [int(x) for x in action['tokens'].split()]
+            if actionId in self.actions:
+                self.tokenLists[actionId] = tokens
+            return tokens
+
+        if self.encoder is None:
+            return []
+        return self.encoder.encode(self._actionText(action))
 
-        for action in self.storyData['transcript']:
-            transcript += action['aiText'] + '\n> ' + action['userText'] + '\n'
+    # Number of tokens in an action. (0 if there is no encoder)
+    def _countTokens(self, action: dict):
+        if action.get('id') in self.tokenLists:
+            return len(self.tokenLists[action['id']])
+        if 'tokens' in action:
+            return action['tokens'].count(" ") + 1
 
-        return transcript
+        return len(self._actionTokens(action))
@@ -28,12 +28,36 @@ class StoryStarter:
     '''
 
     def getPrompt(self, genre: str, charName: str, charClass: str):
+        return self.makePrompt(charName, self.pickTemplate(genre, charClass))
+
+    # Randomly picks the items and the prompt for a character class.
+    # Returns the template (genre, charClass, item1, item2, prompt)
+    def pickTemplate(self, genre: str, charClass: str):
         genreDatabase = self.promptDatabase[genre]
         classDatabase = genreDatabase[charClass]
         item1 = random.choice(classDatabase["item1"])
         item2 = random.choice(classDatabase["item2"])
         prompt = random.choice(classDatabase["prompt"])
 
+        return (genre, charClass, item1, item2, prompt)
+
+    # Returns every template getPrompt can pick.
+    def listTemplates(self):
+        templates = []
+        for genre in self.listGenres():
+            for charClass in self.listClasses(genre):
+                classDatabase = self.promptDatabase[genre][charClass]
+                for item1 in classDatabase["item1"]:
+                    for item2 in classDatabase["item2"]:
+                        for prompt in classDatabase["prompt"]:
+                            templates.append(
+                                (genre, charClass, item1, item2, prompt))
+        return templates
+
+    # The story prompt of a template for the character 'charName'.
+    def makePrompt(self, charName: str, template: tuple):
+        genre, charClass, item1, item2, prompt = template
+
         storyString = "You are " + charName + ", a " + charClass + ". "
         storyString += "You have a " + item1 + " and a " + item2 + ".\n\n"
         storyString += prompt
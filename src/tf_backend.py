@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# Runs the model with TensorFlow (1.x compat mode) and the gpt-2 model
+# code. (See 'model_manager.py' for what a backend has to have)
+import os
+
+from . import flat_weights
+
+# TensorFlow and the gpt-2 model are imported by importTensorflow(), since
+# importing TensorFlow alone takes a few seconds.
+tf = None
+model = None
+
+
+# Imports TensorFlow and the gpt-2 model. (Only the first call does anything)
+def importTensorflow():
+    global tf, model
+    if model is not None:
+        return
+
+    import tensorflow.compat.v1 as tensorflow
+    from gpt_2.src import model as gpt2Model
+
+    # Required (Tensorflow will complain if this is not here)
+    tensorflow.disable_eager_execution()
+
+    tf = tensorflow
+    model = gpt2Model
+
+
+class TensorflowBackend:
+    def __init__(self,
+                 hparams,
+                 modelPath: str,
+                 stopTokens,
+                 sentenceTokens,
+                 settings: dict,
+                 allowGpu: bool = False):
+        self.hparamsValues = hparams.values
+        self.modelPath = modelPath
+        self.stopTokens = stopTokens
+        self.sentenceTokens = sentenceTokens
+        self.settings = settings
+        self.allowGpu = allowGpu
+        self.sess = None
+        # The 'onStep' of the sample() call that is running.
+        self.onStep = None
+
+    def __del__(self):
+        if self.sess is not None:
+            self.sess.close()
+
+    # Builds the graph, and restores the checkpoint.
+    def load(self, setStage):
+        setStage("Importing TensorFlow")
+        importTensorflow()
+
+        setStage("Building the model")
+        self.hparams = model.default_hparams()
+        self.hparams.override_from_dict(self.hparamsValues)
+
+        config = None
+        if self.allowGpu:
+            config = tf.ConfigProto()
+            config.gpu_options.allow_growth = True
+        else:
+            config = tf.ConfigProto(device_count={"GPU": 0})
+
+        # The model gets its own graph, since it might be loaded in
+        # another thread.
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            # Create placeholders for self.sess.run to use.
+            # 'context' only holds the tokens that are not in the attention
+            # cache yet, and 'past' holds the attention cache itself.
+            # 'numSamples' is how many samples are generated for each context.
+            self.context = tf.placeholder(tf.int32, [None, None])
+            self.past = tf.placeholder(tf.float32,
+                                       model.past_shape(hparams=self.hparams))
+            self.numSamples = tf.placeholder_with_default(1, [])
+            self.settingInputs = {}
+            for name, value in self.settings.items():
+                self.settingInputs[name] = tf.placeholder_with_default(
+                    value, [], name=name)
+            # np.random.seed(seed)
+            # tf.set_random_seed(seed)
+
+            self.output, self.present = sampleSequence(
+                hparams=self.hparams,
+                length=self.settingInputs['length'],
+                context=self.context,
+                past=self.past,
+                numSamples=self.numSamples,
+                temperature=self.settingInputs['temperature'],
+                topK=self.settingInputs['topK'],
+                topP=self.settingInputs['topP'],
+                stopTokens=self.stopTokens,
+                sentenceTokens=self.sentenceTokens,
+                maxSentences=self.settingInputs['maxSentences'],
+                onStep=self._onStep,
+            )
+
+            self.sess = tf.Session(graph=self.graph, config=config)
+
+            # Load pre-trained model
+            if flat_weights.hasWeights(self.modelPath):
+                setStage("Loading the weights")
+                self._loadFlatWeights()
+            else:
+                setStage("Restoring the checkpoint")
+                saver = tf.train.Saver()
+                ckpt = tf.train.latest_checkpoint(self.modelPath)
+                saver.restore(self.sess, ckpt)
+
+    # Sets the variables from the flat weight file. (See 'flat_weights.py')
+    def _loadFlatWeights(self):
+        weights = flat_weights.loadWeights(self.modelPath)
+
+        assignOps = []
+        feedDict = {}
+        for variable in tf.global_variables():
+            value = tf.placeholder(variable.dtype.base_dtype, variable.shape)
+            assignOps.append(variable.assign(value))
+            feedDict[value] = weights[variable.op.name].astype(
+                value.dtype.as_numpy_dtype, copy=False)
+
+        self.sess.run(assignOps, feed_dict=feedDict)
+
+    # Samples 'numSamples' samples for each of 'contexts'. (Which all have
+    # the same length, and come after the attention cache 'past')
+    # Returns the sampled tokens, and the attention cache of the contexts.
+    #
+    # If 'onStep' is given it's called with the tokens sampled by each
+    # step (one for each sample) while the model runs. Sampling stops
+    # early if it returns True.
+    def sample(self,
+               contexts: list,
+               past,
+               numSamples: int,
+               settings: dict,
+               onStep=None):
+        feedDict = {}
+        for name, value in settings.items():
+            feedDict[self.settingInputs[name]] = value
+        feedDict[self.context] = contexts
+        feedDict[self.past] = past
+        feedDict[self.numSamples] = numSamples
+
+        self.onStep = onStep
+        try:
+            return self.sess.run([self.output, self.present],
+                                 feed_dict=feedDict)
+        finally:
+            self.onStep = None
+
+    # Called by the graph after each step. (See sampleSequence)
+    def _onStep(self, samples):
+        if self.onStep is None:
+            return False
+        return bool(self.onStep(samples))
+
+
+# Mostly the same as 'sample.sample_sequence' from gpt-2, except the
+# attention cache ('past') of the context is passed in, and the attention
+# cache of the whole context is returned along with the sampled tokens.
+#
+# The context is only run once, and then repeated 'numSamples' times
+# so each context gets 'numSamples' samples. (The output is ordered
+# as [context0 sample0, context0 sample1, ..., context1 sample0, ...])
+#
+# A sample is done once it samples one of 'stopTokens', or once it has
+# sampled 'maxSentences' of 'sentenceTokens' (if 'maxSentences' > 0).
+# The loop stops as soon as every sample is done, so samples that
+# finished earlier than others have extra tokens after their end.
+#
+# 'onStep' is called (with tf.numpy_function) with the tokens of each
+# step as they're sampled, and the loop stops if it returns True.
+def sampleSequence(*, hparams, length, context, past, numSamples, temperature,
+                   topK, topP, stopTokens, sentenceTokens, maxSentences,
+                   onStep):
+    def step(tokens, past):
+        lmOutput = model.model(hparams=hparams,
+                               X=tokens,
+                               past=past,
+                               reuse=tf.AUTO_REUSE)
+
+        logits = lmOutput['logits'][:, :, :hparams.n_vocab]
+        presents = lmOutput['present']
+        presents.set_shape(model.past_shape(hparams=hparams))
+        return logits, presents
+
+    def sampleLogits(logits):
+        logits = logits / tf.cast(temperature, tf.float32)
+        logits = tf.cond(topP > 0.0, lambda: topPLogits(logits, topP),
+                         lambda: topKLogits(logits, topK))
+        return tf.random.categorical(logits, num_samples=1, dtype=tf.int32)
+
+    def updateDone(samples, done, numSentences):
+        samples = samples[:, 0]
+        stop = tf.numpy_function(onStep, [samples], tf.bool)
+        stop.set_shape([])
+        done = tf.logical_or(done, stop)
+        numSentences += tf.cast(tf.gather(sentenceTokens, samples), tf.int32)
+        enoughSentences = tf.logical_and(maxSentences > 0, numSentences
+                                         >= maxSentences)
+        done = tf.logical_or(done, tf.gather(stopTokens, samples))
+        done = tf.logical_or(done, enoughSentences)
+        return done, numSentences
+
+    with tf.name_scope('sample_sequence'):
+        # Run the uncached part of the context in one go, and sample
+        # the first token from the last position.
+        logits, presents = step(context, past)
+        contextPresent = tf.concat([past, presents], axis=-2)
+
+        # Repeat the context for each sample.
+        firstSample = sampleLogits(
+            tf.repeat(logits[:, -1, :], numSamples, axis=0))
+        samplePresent = tf.repeat(contextPresent, numSamples, axis=0)
+
+        done, numSentences = updateDone(
+            firstSample, tf.zeros_like(firstSample[:, 0], dtype=tf.bool),
+            tf.zeros_like(firstSample[:, 0]))
+
+        def body(past, prev, output, done, numSentences):
+            logits, presents = step(prev, past)
+            samples = sampleLogits(logits[:, -1, :])
+            done, numSentences = updateDone(samples, done, numSentences)
+            return [
+                tf.concat([past, presents], axis=-2),
+                samples,
+                tf.concat([output, samples], axis=1),
+                done,
+                numSentences,
+            ]
+
+        def cond(past, prev, output, done, numSentences):
+            return tf.logical_not(tf.reduce_all(done))
+
+        _, _, tokens, _, _ = tf.while_loop(
+            cond=cond,
+            body=body,
+            maximum_iterations=length - 1,
+            loop_vars=[
+                samplePresent, firstSample, firstSample, done, numSentences
+            ],
+            shape_invariants=[
+                tf.TensorShape(model.past_shape(hparams=hparams)),
+                tf.TensorShape([None, 1]),
+                tf.TensorShape([None, None]),
+                tf.TensorShape([None]),
+                tf.TensorShape([None]),
+            ],
+            back_prop=False,
+        )
+
+        return tokens, contextPresent
+
+
+# Same as 'sample.top_k_logits' from gpt-2, but 'k' can be a tensor.
+def topKLogits(logits, k):
+    def _topK():
+        values, _ = tf.nn.top_k(logits, k=tf.minimum(k, tf.shape(logits)[-1]))
+        minValues = values[:, -1, tf.newaxis]
+        return tf.where(logits < minValues,
+                        tf.ones_like(logits, dtype=logits.dtype) * -1e10,
+                        logits)
+
+    return tf.cond(k > 0, _topK, lambda: logits)
+
+
+# Same as 'sample.top_p_logits' from gpt-2.
+def topPLogits(logits, p):
+    logitsSort = tf.sort(logits, direction='DESCENDING')
+    probsSort = tf.nn.softmax(logitsSort)
+    probsSums = tf.cumsum(probsSort, axis=1, exclusive=True)
+    logitsMasked = tf.where(probsSums < p, logitsSort,
+                            tf.ones_like(logitsSort) * 1000)
+    minLogits = tf.reduce_min(logitsMasked, axis=1, keepdims=True)
+    return tf.where(logits < minLogits,
+                    tf.ones_like(logits, dtype=logits.dtype) * -1e10, logits)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# Records where the time of each turn goes.
+#
+# Game starts a TurnRecord for each turn that runs the AI, times each
+# stage of it with 'turn.stage(name)', and adds the token counts from
+# ModelManager.getLastStats(). Finished turns are...
+# - Kept in memory for '/stats'. (See TurnMetrics.summary)
+# - Written to a JSON-lines log, one object per turn. (If 'logPath' is set)
+# - Added to counters that can be served in the Prometheus text format
+#   on localhost. (See TurnMetrics.startServer)
+#
+# Timing a stage is just two time.perf_counter() calls, and the log is
+# one short line per turn, so it can be left on.
+import collections
+import json
+import threading
+import time
+
+# Upper bounds (in seconds) of the turn latency histogram buckets.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class TurnRecord:
+    def __init__(self, kind: str):
+        # 'action', 'continue', or 'retry'
+        self.kind = kind
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+
+        # Stage name -> seconds. (In the order they ran)
+        self.stages = {}
+
+        # Filled in from ModelManager.getLastStats()
+        self.promptTokens = 0
+        self.newTokens = 0
+        self.generatedTokens = 0
+        self.modelSeconds = 0.0
+        # True if the AI response came from the speculator.
+        self.speculated = False
+        # True if the AI response was a pre-sampled opening. (See
+        # 'opening_cache.py')
+        self.cachedOpening = False
+        # Seconds until the first of the AI response was shown, if it was
+        # streamed. (See Game.gameCommand)
+        self.firstTextSeconds = None
+
+    # Times the code in a 'with' block as 'name'.
+    def stage(self, name: str):
+        return StageTimer(self, name)
+
+    def addStage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    # Adds the stats from ModelManager.getLastStats()
+    def addModelStats(self, stats: dict):
+        self.promptTokens = stats['contextTokens']
+        self.newTokens = stats['newTokens']
+        self.generatedTokens = stats['generatedTokens']
+        self.modelSeconds = stats['modelSeconds']
+
+    def tokensPerSecond(self):
+        if self.modelSeconds <= 0:
+            return None
+        return self.generatedTokens / self.modelSeconds
+
+    def toDict(self):
+        return {
+            'timestamp': self.timestamp,
+            'kind': self.kind,
+            'seconds': self.seconds,
+            'stages': self.stages,
+            'promptTokens': self.promptTokens,
+            'newTokens': self.newTokens,
+            'generatedTokens': self.generatedTokens,
+            'modelSeconds': self.modelSeconds,
+            'tokensPerSecond': self.tokensPerSecond(),
+            'speculated': self.speculated,
+            'cachedOpening': self.cachedOpening,
+            'firstTextSeconds': self.firstTextSeconds,
+        }
+
+
+class StageTimer:
+    def __init__(self, turn: TurnRecord, name: str):
+        self.turn = turn
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.turn.addStage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class TurnMetrics:
+    def __init__(self, logPath: str = None, maxTurns: int = 1000):
+        # The most recent turns. (For '/stats')
+        self.turns = collections.deque(maxlen=maxTurns)
+
+        # Totals since the start, for the Prometheus counters.
+        self.turnCounts = {}
+        self.stageSeconds = {}
+        self.latencyBuckets = [0] * len(LATENCY_BUCKETS)
+        self.totalSeconds = 0.0
+        self.promptTokens = 0
+        self.generatedTokens = 0
+        self.modelSeconds = 0.0
+        self.speculatedTurns = 0
+
+        # The HTTP server reads these from another thread.
+        self.lock = threading.Lock()
+
+        self.logFile = None
+        if logPath is not None:
+            self.logFile = open(logPath, "a")
+
+        self.server = None
+
+    def startTurn(self, kind: str):
+        return TurnRecord(kind)
+
+    def finishTurn(self, turn: TurnRecord):
+        turn.seconds = time.perf_counter() - turn.start
+
+        with self.lock:
+            self.turns.append(turn)
+            self.turnCounts[turn.kind] = self.turnCounts.get(turn.kind, 0) + 1
+            for name, seconds in turn.stages.items():
+                self.stageSeconds[name] = self.stageSeconds.get(name,
+                                                                0.0) + seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if turn.seconds <= bound:
+                    self.latencyBuckets[i] += 1
+            self.totalSeconds += turn.seconds
+            self.promptTokens += turn.promptTokens
+            self.generatedTokens += turn.generatedTokens
+            self.modelSeconds += turn.modelSeconds
+            self.speculatedTurns += int(turn.speculated)
+
+        if self.logFile is not None:
+            self.logFile.write(json.dumps(turn.toDict()) + "\n")
+            self.logFile.flush()
+
+    # Text for the '/stats' command.
+    def summary(self):
+        with self.lock:
+            turns = list(self.turns)
+            numTurns = sum(self.turnCounts.values())
+            speculatedTurns = self.speculatedTurns
+            generatedTokens = self.generatedTokens
+            modelSeconds = self.modelSeconds
+
+        if len(turns) == 0:
+            return "No stats yet. (Stats are recorded each time the AI runs)"
+
+        last = turns[-1]
+        text = "Turns: {} ({} used speculation)\n".format(
+            numTurns, speculatedTurns)
+
+        text += "Last turn: {:.2f}s ({} prompt tokens, {} new, ".format(
+            last.seconds, last.promptTokens, last.newTokens)
+        text += "{} generated".format(last.generatedTokens)
+        if last.tokensPerSecond() is not None:
+            text += ", {:.1f} tokens/s".format(last.tokensPerSecond())
+        text += ")\n"
+        if last.firstTextSeconds is not None:
+            text += "  first text shown after {:.2f}s\n".format(
+                last.firstTextSeconds)
+        for name, seconds in last.stages.items():
+            text += "  {}: {:.3f}s\n".format(name, seconds)
+
+        latencies = sorted([x.seconds for x in turns])
+        text += "Turn time: p50 {:.2f}s, p95 {:.2f}s, max {:.2f}s\n".format(
+            percentile(latencies, 50), percentile(latencies, 95),
+            latencies[-1])
+
+        if modelSeconds > 0:
+            text += "AI speed: {:.1f} tokens/s\n".format(generatedTokens /
+                                                         modelSeconds)
+
+        return text.rstrip("\n")
+
+    # The totals in the Prometheus text format.
+    def prometheusText(self):
+        with self.lock:
+            lines = []
+
+            lines.append("# HELP rpg_turns_total Turns that ran the AI.")
+            lines.append("# TYPE rpg_turns_total counter")
+            for kind, count in sorted(self.turnCounts.items()):
+                lines.append('rpg_turns_total{{kind="{}"}} {}'.format(
+                    kind, count))
+
+            lines.append("# HELP rpg_turn_seconds Time each turn took.")
+            lines.append("# TYPE rpg_turn_seconds histogram")
+            for bound, count in zip(LATENCY_BUCKETS, self.latencyBuckets):
+                lines.append('rpg_turn_seconds_bucket{{le="{}"}} {}'.format(
+                    bound, count))
+            numTurns = sum(self.turnCounts.values())
+            lines.append(
+                'rpg_turn_seconds_bucket{{le="+Inf"}} {}'.format(numTurns))
+            lines.append("rpg_turn_seconds_sum {}".format(self.totalSeconds))
+            lines.append("rpg_turn_seconds_count {}".format(numTurns))
+
+            lines.append("# HELP rpg_turn_stage_seconds_total Time spent in "
+                         "each stage of a turn.")
+            lines.append("# TYPE rpg_turn_stage_seconds_total counter")
+            for name, seconds in sorted(self.stageSeconds.items()):
+                lines.append(
+                    'rpg_turn_stage_seconds_total{{stage="{}"}} {}'.format(
+                        name, seconds))
+
+            counters = (
+                ("rpg_prompt_tokens_total", "Tokens in the AI prompts.",
+                 self.promptTokens),
+                ("rpg_generated_tokens_total", "Tokens the AI generated.",
+                 self.generatedTokens),
+                ("rpg_model_seconds_total", "Time spent running the model.",
+                 self.modelSeconds),
+                ("rpg_speculated_turns_total",
+                 "Turns that used a speculated AI response.",
+                 self.speculatedTurns),
+            )
+            for name, helpText, value in counters:
+                lines.append("# HELP {} {}".format(name, helpText))
+                lines.append("# TYPE {} counter".format(name))
+                lines.append("{} {}".format(name, value))
+
+        return "\n".join(lines) + "\n"
+
+    # Serves prometheusText() at 'http://host:port/metrics' in a thread.
+    def startServer(self, port: int, host: str = "127.0.0.1"):
+        # (Only imported here, since the server is rarely used)
+        import http.server
+
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.prometheusText().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Don't print each request over the game.
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port),
+                                                      MetricsHandler)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+
+
+# The 'percent' percentile of the sorted list 'values'. (Nearest rank)
+def percentile(values: list, percent: float):
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
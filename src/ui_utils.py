@@ -3,6 +3,7 @@ import time
 import random
 import pyfiglet
 import os
+import sys
 
 
 def main():
@@ -51,5 +52,57 @@ def slowPrint(inputStr: str, range1: int, range2: int, newline: bool):
         print()
 
 
+# Prints text that comes a bit at a time (like an AI response while it's
+# generated), wrapped to 'width' columns.
+# A word is printed once the space after it comes, so it can be moved to
+# the next line if it doesn't fit. (finish() prints the last one)
+# 'onFirstText' is called before anything is printed.
+class StreamPrinter:
+    def __init__(self, width: int, onFirstText=None):
+        self.width = width
+        self.onFirstText = onFirstText
+        self.column = 0
+        self.word = ""
+        # True once any text was given.
+        self.printed = False
+
+    def write(self, text: str):
+        if not self.printed:
+            self.printed = True
+            if self.onFirstText is not None:
+                self.onFirstText()
+
+        for char in text:
+            if char == "\n":
+                self._printWord()
+                print()
+                self.column = 0
+            elif char == " ":
+                self._printWord()
+                if self.column < self.width:
+                    print(" ", end="")
+                    self.column += 1
+            else:
+                self.word += char
+
+        sys.stdout.flush()
+
+    def finish(self):
+        self._printWord()
+        if self.printed:
+            print()
+
+    def _printWord(self):
+        if self.word == "":
+            return
+
+        if self.column > 0 and self.column + len(self.word) > self.width:
+            print()
+            self.column = 0
+        print(self.word, end="")
+        self.column += len(self.word)
+        self.word = ""
+
+
 if __name__ == "__main__":
     main()